@@ -18,7 +18,6 @@ import plotly.io as pio
 # set up directories
 base_dir = get_absolute_path(".")
 Dunne = Run("Dunne")
-mkdir('dunne_over')
 
 Dunne.FileVersion = 4
 
@@ -314,5 +313,36 @@ Dunne.Geom.domain.ICPressure.RefPatch = 'z_lower'
 # file mkdir dunne_over
 # cd dunne_over
 
-Dunne.run(base_dir+'/dunne_over')
+# only run when executed directly, so the Dunne configuration can be
+# imported, e.g. by dunne_sweep.py
+if __name__ == '__main__':
+    import argparse
+    import os
+    import sys
+    sys.path.append(os.path.join(base_dir, '..'))
+    from pftools.topology import set_topology
+    from pftools.tuning import apply_tuned, format_trials, pulse_stop, save_tuned, tune_solver
+
+    parser = argparse.ArgumentParser(description='Run the Dunne overland flow example.')
+    parser.add_argument('--tune', action='store_true',
+                        help='pick solver settings from runs of the first rain pulse first')
+    parser.add_argument('--ranks', type=int, default=1,
+                        help='MPI ranks; the grid is split over them by pftools.topology')
+    args = parser.parse_args()
+
+    # python dunne_flow.py --tune tries solver settings on runs cut at the
+    # end of the first rain pulse and saves the fastest that match the
+    # reference pressures to Dunne.solver.json, which later runs use
+    tuned_file = base_dir+'/Dunne.solver.json'
+    if args.tune:
+        result = tune_solver(Dunne, base_dir+'/dunne_over', pulse_stop(Dunne.to_dict(), 'rainrec'),
+                             root_dir=base_dir+'/dunne_tuning')
+        print(format_trials(result))
+        save_tuned(tuned_file, result)
+    apply_tuned(Dunne, tuned_file)
+    if args.ranks > 1:
+        print('Process.Topology P, Q, R =', set_topology(Dunne, args.ranks, base_dir+'/dunne_over'))
+
+    mkdir('dunne_over')
+    Dunne.run(base_dir+'/dunne_over')
 
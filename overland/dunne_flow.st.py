@@ -13,10 +13,21 @@ import matplotlib.pyplot as plt
 import matplotlib.animation as ani
 
 import numpy as np
+import glob
+import os
+import shutil
+import sys
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import plotly.io as pio
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pftools.frames import load_frames
+from pftools.overland import run_hydrograph
+from pftools.plotting import animated_heatmap
+from pftools.timeseries import pfb_filename
+from pftools.watch import pfb_complete
+
 base_dir = get_absolute_path(".")
 Dunne = Run("Dunne")
 mkdir('dunne_over')
@@ -317,11 +328,66 @@ Dunne.Geom.domain.ICPressure.RefPatch = 'z_lower'
 Dunne.Geom.domain.Perm.Value = st.number_input("Hydraulic Conductivity Value [m/h]", min_value=1e-4, max_value=1.0, value=Dunne.Geom.domain.Perm.Value, step=None, format=None, key=None, help=None)
 Dunne.Geom.domain.Porosity.Value = st.number_input("Porosity Value [-]", min_value=.1, max_value=.7, value=Dunne.Geom.domain.Porosity.Value, step=None, format=None, key=None, help=None)
 
+# every perm / porosity pair gets its own run directory next to dunne_over,
+# so results of settings seen before are kept and reused; only the
+# MAX_RUNS most recently used run directories are kept on disk
+MAX_RUNS = 32
+
+def run_directory(perm, porosity):
+    return base_dir+'/dunne_over_K{:g}_phi{:g}'.format(perm, porosity)
+
+def run_finished(run_dir):
+    last = int(round(Dunne.TimingInfo.StopTime/Dunne.TimeStep.Value))
+    return pfb_complete(pfb_filename(run_dir, 'Dunne', 'press', last))
+
+def prune_runs(keep=MAX_RUNS):
+    # a run directory's mtime is bumped whenever it is used
+    run_dirs = sorted(glob.glob(glob.escape(base_dir)+'/dunne_over_K*_phi*'), key=os.path.getmtime)
+    for run_dir in run_dirs[:max(0, len(run_dirs) - keep)]:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+# completed runs are shared by all sessions on the server; each run is made
+# from a copy of the keys above, so the script's Dunne is never changed
+@st.cache_resource(max_entries=MAX_RUNS, show_spinner=False)
+def run_dunne(perm, porosity):
+    run_dir = run_directory(perm, porosity)
+    if not run_finished(run_dir):
+        run = Run('Dunne')
+        run.pfset(flat_map=Dunne.to_dict())
+        run.pfset(key='Geom.domain.Perm.Value', value=perm)
+        run.pfset(key='Geom.domain.Porosity.Value', value=porosity)
+        mkdir(run_dir)
+        run.run(run_dir)
+    os.utime(run_dir)
+    prune_runs()
+    return run_dir
+
+def finished_run(perm, porosity):
+    run_dir = run_dunne(perm, porosity)
+    if not run_finished(run_dir):
+        # pruned from disk since it was cached
+        run_dunne.clear()
+        run_dir = run_dunne(perm, porosity)
+    return run_dir
+
+# loaded frame cubes and hydrographs, keyed on the run directory and the
+# time it was last run so a rerun is picked up
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_results(run_dir, run_time, N):
+    section = (slice(None), 0, slice(None))
+    sat   = load_frames(run_dir, 'Dunne', 'satur', range(0, N), section, clip=True)
+    press = load_frames(run_dir, 'Dunne', 'press', range(0, N), section, clip=True)
+    outflow = run_hydrograph(run_dir, 'Dunne', range(0, N),
+                             Dunne.ComputationalGrid.DX, Dunne.ComputationalGrid.DY,
+                             slope_x=Dunne.TopoSlopesX.Geom.domain.Value,
+                             slope_y=Dunne.TopoSlopesY.Geom.domain.Value,
+                             mannings=Dunne.Mannings.Geom.domain.Value)[0]
+    return sat, press, outflow
+
 control1 = st.button(" (re)Run ParFlow ")
 if control1 == True:
     with st.spinner('Running ParFlow'):
-        # set up directories
-        Dunne.run(base_dir+'/dunne_over')
+        finished_run(Dunne.Geom.domain.Perm.Value, Dunne.Geom.domain.Porosity.Value)
 
         
                     #sat[icount,:,:] = data_arr.reshape(300,20)
@@ -353,6 +419,11 @@ if control1 == True:
 #     image.pyplot(plt)
 #     #plt.pause(0.01)
 
+# the browser animation sends all frames once and plays them client side;
+# the pyplot mode redraws every frame on the server
+render_mode = st.radio("Animation", ["In the browser", "Frame by frame (pyplot)"])
+frame_step = st.number_input("Show every n-th frame", min_value=1, max_value=20, value=1)
+
 control2 = st.button(" Animate Results ")
 if control2 == True:
     N=100
@@ -362,30 +433,28 @@ if control2 == True:
     press = np.zeros([N+1,300,20])
     
 
-    for icount in range(0, N):
-        base = (base_dir+"/dunne_over/Dunne.out.satur.{:05d}.pfb")
-        filename = base.format(icount)
-        data_obj = PFData(filename)
-        data_obj.loadHeader()
-        data_obj.loadData()
-        data_arr = data_obj.getDataAsArray()
-        data_obj.close()
-        sat[icount,:,:] = np.where(data_arr[:,0,:]<=0.0, 0.0, data_arr[:,0,:])
-        base = (base_dir+"/dunne_over/Dunne.out.press.{:05d}.pfb")
-        filename = base.format(icount)
-        data_obj = PFData(filename)
-        data_obj.loadHeader()
-        data_obj.loadData()
-        data_arr = data_obj.getDataAsArray()
-        data_obj.close()
-        press[icount,:,:] = np.where(data_arr[:,0,:]<=0.0, 0.0, data_arr[:,0,:])
-        #outflow = 
-
-    fig, ax = plt.subplots()
-    image = st.pyplot(plt)
-    for i in range(N):
-        ax.cla()
-        ax.imshow(sat[i,:,:],vmin=0.1, vmax=1.0,origin='lower',aspect=0.015,cmap='Blues',interpolation='none')  #,extent=[0,100,0,1])
-        ax.set_title("frame {}".format(i))
-        image.pyplot(plt)
-        #plt.pause(0.01)
\ No newline at end of file
+    # show the run for the current settings if there is one, otherwise the
+    # run in dunne_over; frames are loaded in parallel, keeping the x-z
+    # section and clipping negative values, and cached between clicks
+    run_dir = run_directory(Dunne.Geom.domain.Perm.Value, Dunne.Geom.domain.Porosity.Value)
+    if run_finished(run_dir):
+        os.utime(run_dir)
+    else:
+        run_dir = base_dir+'/dunne_over'
+    run_time = os.path.getmtime(run_dir+'/Dunne.pfidb')
+    sat[0:N,:,:], press[0:N,:,:], outflow[0:N] = load_results(run_dir, run_time, N)
+    time[0:N] = np.arange(0, N)*Dunne.TimeStep.Value
+    st.line_chart({'outflow [m^3/h]': outflow[0:N]})
+
+    if render_mode == "In the browser":
+        st.plotly_chart(animated_heatmap(sat[0:N], zmin=0.1, zmax=1.0, frame_step=frame_step,
+                                         title="frame {}"))
+    else:
+        fig, ax = plt.subplots()
+        image = st.pyplot(plt)
+        for i in range(0, N, frame_step):
+            ax.cla()
+            ax.imshow(sat[i,:,:],vmin=0.1, vmax=1.0,origin='lower',aspect=0.015,cmap='Blues',interpolation='none')  #,extent=[0,100,0,1])
+            ax.set_title("frame {}".format(i))
+            image.pyplot(plt)
+            #plt.pause(0.01)
\ No newline at end of file
@@ -0,0 +1,80 @@
+#  This script runs a parameter sweep of the Dunne flow example
+# in dunne_flow.py.  Every combination of the values given on the command
+# line is run concurrently in its own directory and the outlet hydrographs
+# of all members are collected into one table, e.g.
+#
+#   python dunne_sweep.py --perm 0.1 1 10 --mannings 2e-6 5e-6 --workers 8
+#
+# writes dunne_sweep/members.csv (one row of parameters and peak flow per
+# member) and dunne_sweep/hydrographs.csv (one column per member).
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pftools.ensemble import parameter_grid, run_ensemble
+from pftools.overland import keyed_hydrograph
+
+# sweep parameters and the Dunne keys each one sets
+PARAMETERS = {
+    'perm': ['Geom.domain.Perm.Value'],
+    'porosity': ['Geom.domain.Porosity.Value'],
+    'mannings': ['Mannings.Geom.domain.Value'],
+    'rain': ['Patch.z_upper.BCPressure.rain.Value'],
+    'vg_alpha': ['Geom.domain.RelPerm.Alpha', 'Geom.domain.Saturation.Alpha'],
+    'vg_n': ['Geom.domain.RelPerm.N', 'Geom.domain.Saturation.N'],
+}
+
+
+def sweep_overrides(params):
+    """Dunne key overrides for one member's sweep parameters."""
+    return {key: value for name, value in params.items() for key in PARAMETERS[name]}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a parameter sweep of the Dunne overland case.')
+    for name in PARAMETERS:
+        parser.add_argument('--' + name.replace('_', '-'), dest=name, type=float, nargs='+',
+                            help='values of ' + ' and '.join(PARAMETERS[name]))
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default='dunne_sweep')
+    args = parser.parse_args()
+
+    from dunne_flow import Dunne
+    # members run one directory deeper than dunne_over does
+    Dunne.GeomInput.solidinput1.FileName = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                        'tuff.pfsol')
+
+    grid = {name: getattr(args, name) for name in PARAMETERS if getattr(args, name)}
+    members = parameter_grid(grid)
+    records = run_ensemble(Dunne, [sweep_overrides(p) for p in members], args.out,
+                           post=keyed_hydrograph, workers=args.workers)
+
+    names = list(grid)
+    with open(os.path.join(args.out, 'members.csv'), 'w') as f:
+        f.write(','.join(['member'] + names + ['peak_outflow', 'peak_timestep', 'error']) + '\n')
+        for params, record in zip(members, records):
+            row = [str(record['member'])] + ['{:g}'.format(params[n]) for n in names]
+            if record['error'] is None:
+                timesteps, outflow = record['result']
+                peak = int(np.argmax(outflow))
+                row += ['{:g}'.format(outflow[peak]), str(timesteps[peak]), '']
+            else:
+                row += ['', '', '"{}"'.format(record['error'].replace('"', "'"))]
+            f.write(','.join(row) + '\n')
+
+    # one hydrograph column per member, blank where a member has no output
+    finished = [r for r in records if r['error'] is None]
+    timesteps = sorted(set().union(*(r['result'][0].tolist() for r in finished)))
+    table = np.full((len(timesteps), len(finished)), np.nan)
+    for col, record in enumerate(finished):
+        table[np.searchsorted(timesteps, record['result'][0]), col] = record['result'][1]
+    with open(os.path.join(args.out, 'hydrographs.csv'), 'w') as f:
+        f.write(','.join(['timestep'] + ['member_{:04d}'.format(r['member']) for r in finished]) + '\n')
+        for timestep, row in zip(timesteps, table):
+            f.write(','.join([str(timestep)] + ['' if np.isnan(q) else '{:g}'.format(q) for q in row]) + '\n')
+
+    print('{} of {} members finished, results in {}'.format(len(finished), len(records), args.out))
@@ -3,9 +3,14 @@ import numpy as np
 import plotly.graph_objs as go
 import plotly.express as px
 from parflow.tools.fs import get_absolute_path
-from parflowio.pyParflowio import PFData
 import matplotlib.pyplot as plt
 from streamlit.elements import color_picker
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pftools.frames import load_frames
+from pftools.overland import run_hydrograph
 
 base_dir = get_absolute_path(".")
 N=60
@@ -13,30 +18,17 @@ time    = np.zeros([N+1])    # time array, we will probably want to swap with a
 outflow = np.zeros([N+1])  # array to load in the meterological forcing
 sat = np.zeros([N+1,300,20])
 
-for icount in range(0, N):
-        base = (base_dir+"/dunne_over/Dunne.out.satur.{:05d}.pfb")
-        filename = base.format(icount)
-        data_obj = PFData(filename)
-        data_obj.loadHeader()
-        data_obj.loadData()
-        data_arr = data_obj.getDataAsArray()
-        data_obj.close()
-        sat[icount,:,:] = np.where(data_arr[:,0,:]<=0.0, 0.0, data_arr[:,0,:])
-        #sat[icount,:,:] = data_arr.reshape(300,20)
-        #print(data_arr[4,0,10])
-        #print(sat[icount,4,10])
-        
-        # base = (base_dir+"/output/PFCLM_SC.out.press.{:05d}.pfb")
-        # filename = base.format(icount)
-        # data_obj = PFData(filename)
-        # data_obj.loadHeader()
-        # data_obj.loadData()
-        # data_arr = data_obj.getDataAsArray()
-        # data_obj.close()
-        # data[4,icount] = (np.sqrt(slope)/mannings) * np.maximum(data_arr[19,0,0],0.0)**(5.0/3.0)
-        # time[icount] = icount
+# load the x-z saturation section of every frame in parallel, clipping
+# negative values
+sat[0:N,:,:] = load_frames(base_dir+"/dunne_over", 'Dunne', 'satur', range(0, N),
+                           (slice(None), 0, slice(None)), clip=True)
 #sat = np.where(sat<=0.0, 0.0, sat)
 
+# outlet hydrograph from the surface pressures, slopes and Manning's n of the run
+outflow[0:N], qx, qy = run_hydrograph(base_dir+"/dunne_over", 'Dunne', range(0, N), dx=5.0, dy=1.0,
+                                      slope_x=0.15, slope_y=0.0, mannings=2.e-6)
+time[0:N] = np.arange(0, N)
+
 fig, ax = plt.subplots()
 
 for i in range(N):
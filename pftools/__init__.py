@@ -0,0 +1,7 @@
+"""Shared helpers for the ParFlow example cases.
+
+The case scripts in ``overland/`` and ``single_column_CLM/`` add the
+repository root to ``sys.path`` and import what they need from here, e.g.::
+
+    from pftools.timeseries import read_timeseries
+"""
@@ -0,0 +1,91 @@
+"""Read per-variable archives of compacted per-timestep output.
+
+``pftools.compact`` folds all per-timestep PFBs of one output variable into
+``<run>.out.<variable>.nc``: a netCDF4 file holding a 'time' axis of
+timestep numbers and a zlib-compressed 'data' variable of shape
+(time, z, y, x), chunked along time, with the values exactly as in the
+PFBs (CLM layers stay on the z axis).  The readers in ``pftools.timeseries``
+fall back to these archives for timesteps whose PFB is gone, so analysis
+code does not need to know whether a run has been compacted.
+"""
+import os
+
+import netCDF4
+import numpy as np
+
+from pftools.pfb import _index_ranges
+
+
+def archive_filename(run_dir, run_name, variable):
+    """Path of the archive ``pftools.compact`` writes for ``variable``."""
+    return os.path.join(run_dir, '{}.out.{}.nc'.format(run_name, variable))
+
+
+def archive_timesteps(filename):
+    """Sorted timestep numbers held in an archive."""
+    with netCDF4.Dataset(filename) as ds:
+        return [int(t) for t in ds['time'][:]]
+
+
+def _rows(time, timesteps, filename):
+    rows = np.searchsorted(time, timesteps)
+    if (rows >= len(time)).any() or (time[np.minimum(rows, len(time) - 1)] != timesteps).any():
+        raise KeyError('{} does not hold all of the requested timesteps'.format(filename))
+    return rows
+
+
+def _read_rows(var, rows, box):
+    # netCDF reads a slice far faster than a list of rows, and a list of
+    # rows has to be increasing
+    order = np.argsort(rows, kind='stable')
+    ordered = rows[order]
+    if len(ordered) and ordered[-1] - ordered[0] == len(ordered) - 1:
+        data = var[(slice(int(ordered[0]), int(ordered[-1]) + 1),) + box]
+    else:
+        unique, inverse = np.unique(ordered, return_inverse=True)
+        data = var[(unique,) + box][inverse]
+    out = np.empty_like(data)
+    out[order] = data
+    return out
+
+
+def read_archive(filename, timesteps, index=()):
+    """Read frames of many timesteps from an archive.
+
+    ``index`` selects part of each frame with (z, y, x) ints and unit-step
+    slices, as for ``pftools.pfb.read_pfb_slice``.  Returns a
+    (len(timesteps), ...) float64 array.
+    """
+    timesteps = np.asarray(list(timesteps), dtype=np.int64)
+    with netCDF4.Dataset(filename) as ds:
+        ds.set_auto_mask(False)
+        var = ds['data']
+        ranges, keep = _index_ranges(index, var.shape[1:])
+        box = tuple(slice(lo, hi) for lo, hi in ranges)
+        if not len(timesteps):
+            return np.empty((0,) + tuple(hi - lo for (lo, hi), k in zip(ranges, keep) if k))
+        data = _read_rows(var, _rows(ds['time'][:], timesteps, filename), box)
+    return data[(slice(None),) + tuple(slice(None) if k else 0 for k in keep)]
+
+
+def read_archive_points(filename, indices, timesteps):
+    """Read the (z, y, x) cells in ``indices`` from an archive over time.
+
+    Returns a (len(timesteps), len(indices)) float64 array.
+    """
+    idx = np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+    timesteps = np.asarray(list(timesteps), dtype=np.int64)
+    with netCDF4.Dataset(filename) as ds:
+        ds.set_auto_mask(False)
+        var = ds['data']
+        if ((idx < 0) | (idx >= var.shape[1:])).any():
+            raise IndexError('cell index outside the {}x{}x{} grid'.format(*var.shape[1:]))
+        if not len(timesteps) or not len(idx):
+            return np.empty((len(timesteps), len(idx)))
+        # read the box around the cells, then pick the cells out of it
+        lo = idx.min(axis=0)
+        hi = idx.max(axis=0) + 1
+        box = tuple(slice(int(a), int(b)) for a, b in zip(lo, hi))
+        data = _read_rows(var, _rows(ds['time'][:], timesteps, filename), box)
+    rel = idx - lo
+    return data[:, rel[:, 0], rel[:, 1], rel[:, 2]]
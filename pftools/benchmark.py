@@ -0,0 +1,312 @@
+"""Benchmark ParFlow solver settings on the cases in this repo.
+
+A case is a run as recorded in its ``.pfidb`` (``overland/dunne_over/Dunne``
+or ``single_column_CLM/output/PFCLM_SC``, after the scripts have been run
+once).  ``benchmark_case`` reruns it once for every combination of a
+matrix of solver options, each in a fresh directory and a fresh worker
+process, and records the wall time, the KINSOL nonlinear and linear
+iteration counts and the peak memory of the ParFlow processes.  Every
+benchmark is appended to a CSV report together with the ParFlow version,
+so ``compare_report`` can show how each setting changed between versions::
+
+    python -m pftools.benchmark dunne pfclm_sc --krylov 20 100 --jacobian True False
+    python -m pftools.benchmark --compare
+"""
+import argparse
+import csv
+import glob
+import os
+import platform
+import resource
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pftools.config import read_pfidb
+from pftools.ensemble import _run_member, parameter_grid
+from pftools.frames import _pool_context
+from pftools.solverlog import kinsol_totals, log_filename, parflow_version, read_timing
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# case -> its .pfidb, the files ParFlow / CLM read from the run directory,
+# and the stop time benchmarks are cut to (None runs the whole case)
+CASES = {
+    'dunne': dict(pfidb='overland/dunne_over/Dunne.pfidb', inputs=[], stop=None),
+    'pfclm_sc': dict(pfidb='single_column_CLM/output/PFCLM_SC.pfidb',
+                     inputs=['drv_clmin.dat', 'drv_vegm.dat', 'drv_vegp.dat', 'clm.rst.*'],
+                     stop=240),
+}
+
+# matrix option -> solver key
+SOLVER_OPTIONS = {
+    'krylov': 'Solver.Linear.KrylovDimension',
+    'restarts': 'Solver.Linear.MaxRestart',
+    'precond': 'Solver.Linear.Preconditioner',
+    'jacobian': 'Solver.Nonlinear.UseJacobian',
+    'eta_choice': 'Solver.Nonlinear.EtaChoice',
+    'eta': 'Solver.Nonlinear.EtaValue',
+}
+
+# spellings of one solver key that differ between the case scripts:
+# dunne_flow.py sets MaxRestart, PFCLM_SC.py MaxRestarts
+_KEY_SPELLINGS = [('Solver.Linear.MaxRestart', 'Solver.Linear.MaxRestarts')]
+
+# the settings picked by hand in dunne_flow.py and PFCLM_SC.py and the
+# obvious alternatives
+DEFAULT_MATRIX = {
+    'krylov': ['20', '100'],
+    'jacobian': ['True', 'False'],
+    'precond': ['PFMG', 'PFMGOctree'],
+}
+
+REPORT_FIELDS = ['date', 'host', 'parflow_version', 'case', 'settings', 'repeat', 'wall_time',
+                 'solver_time', 'nonlinear_iterations', 'linear_iterations',
+                 'function_evaluations', 'peak_memory_mb', 'error']
+
+
+def absolute_inputs(keys, source_dir):
+    """Copy of ``keys`` with relative input paths made absolute.
+
+    Relative file names and paths that exist relative to ``source_dir``, the
+    directory the run was set up for (the solid file, the CLM forcing
+    directory, ...), are made absolute so the run can be repeated in
+    another directory.
+    """
+    keys = dict(keys)
+    source_dir = os.path.abspath(source_dir)
+    for key, value in keys.items():
+        if key.endswith(('FileName', 'FilePath')) and isinstance(value, str) and value \
+                and not os.path.isabs(value):
+            path = os.path.join(source_dir, value)
+            if os.path.exists(path):
+                keys[key] = os.path.normpath(path)
+    return keys
+
+
+def case_keys(pfidb):
+    """Keys of the run recorded in ``pfidb``, with input paths made absolute."""
+    return absolute_inputs(read_pfidb(pfidb), os.path.dirname(os.path.abspath(pfidb)))
+
+
+def defined_key(keys, key):
+    """The spelling of solver key ``key`` that ``keys`` defines.
+
+    Raises ValueError if ``keys`` defines none, as overriding it would add
+    a key the run never set, or one next to the key actually in effect.
+    """
+    spellings = next((spellings for spellings in _KEY_SPELLINGS if key in spellings), (key,))
+    for spelling in spellings:
+        if spelling in keys:
+            return spelling
+    raise ValueError('the run does not set {}'.format(' or '.join(spellings)))
+
+
+def solver_overrides(keys, settings):
+    """Solver keys -> values of SOLVER_OPTIONS ``settings``, spelt as in ``keys``."""
+    return {defined_key(keys, SOLVER_OPTIONS[option]): value for option, value in settings.items()}
+
+
+def format_settings(settings):
+    """Settings of a matrix entry as 'name=value' pairs, as in the report."""
+    return ' '.join('{}={}'.format(name, settings[name]) for name in sorted(settings))
+
+
+def _peak_memory_mb():
+    # largest resident set of any finished child of this process; kB on
+    # Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+
+
+def _run_case(name, keys, overrides, case_dir, inputs):
+    # runs in its own worker process, so the peak memory of its children is
+    # that of this case's ParFlow run only
+    os.makedirs(case_dir)
+    for filename in inputs:
+        shutil.copy(filename, case_dir)
+    for key, value in keys.items():
+        # CLM writes into these directories relative to the run directory
+        if key.endswith('FileDir') and isinstance(value, str) and value and not os.path.isabs(value):
+            os.makedirs(os.path.join(case_dir, value), exist_ok=True)
+    start = time.perf_counter()
+    _run_member(name, keys, overrides, case_dir, None)
+    wall_time = time.perf_counter() - start
+
+    metrics = dict(wall_time=wall_time, peak_memory_mb=_peak_memory_mb(),
+                   parflow_version=parflow_version(case_dir, name))
+    metrics['solver_time'] = read_timing(log_filename(case_dir, name, 'timing.csv')).get('Solver')
+    totals = kinsol_totals(log_filename(case_dir, name, 'kinsol.log'))
+    for counter in ('nonlinear_iterations', 'linear_iterations', 'function_evaluations'):
+        metrics[counter] = totals.get(counter)
+    return metrics
+
+
+def load_case(case, stop=None):
+    """(run name, keys, input files) of a case in CASES or a ``.pfidb`` file.
+
+    A ``.pfidb`` (e.g. from ``pftools.domain``) is run whole, without
+    extra input files.  ``stop`` overrides the stop time; the case's own cut
+    is used if None.
+    """
+    if case.endswith('.pfidb'):
+        spec = dict(pfidb=os.path.abspath(case), inputs=[], stop=None)
+    else:
+        spec = CASES[case]
+    pfidb = os.path.join(_REPO_DIR, spec['pfidb'])
+    if not os.path.exists(pfidb):
+        raise FileNotFoundError('{} not found, run the {} case once first'.format(pfidb, case))
+    keys = case_keys(pfidb)
+    name = os.path.basename(pfidb)[:-len('.pfidb')]
+    source_dir = os.path.dirname(pfidb)
+    inputs = sorted(f for pattern in spec['inputs']
+                    for f in glob.glob(os.path.join(glob.escape(source_dir), pattern)))
+    stop = spec['stop'] if stop is None else stop
+    if stop is not None:
+        keys['TimingInfo.StopTime'] = str(stop)
+    return name, keys, inputs
+
+
+def run_measured(name, keys, overrides, case_dir, inputs=()):
+    """Run ``name`` with ``keys`` and ``overrides`` in an emptied ``case_dir``.
+
+    The run is made in a fresh worker process, which keeps the memory
+    high-water marks of runs apart.  Returns a dict with 'wall_time',
+    'solver_time', 'peak_memory_mb', 'parflow_version', the KINSOL totals
+    and 'error' (None, or the message of a failed run).
+    """
+    shutil.rmtree(case_dir, ignore_errors=True)
+    record = dict(error=None)
+    with ProcessPoolExecutor(1, mp_context=_pool_context()) as pool:
+        try:
+            record.update(pool.submit(_run_case, name, keys, overrides, case_dir, inputs).result())
+        except Exception as e:
+            record['error'] = str(e)
+    return record
+
+
+def benchmark_case(case, matrix=None, root_dir='benchmark_runs', repeats=1, stop=None):
+    """Run ``case`` once per combination of ``matrix`` and repeat.
+
+    Args:
+        case: name in CASES
+        matrix: dict of SOLVER_OPTIONS name -> list of values, defaults to
+            DEFAULT_MATRIX
+        root_dir: directory the runs are made in; each run's directory is
+            emptied first
+        repeats: runs of every combination, to see the spread of wall times
+        stop: stop time, defaults to the case's
+
+    Returns:
+        a list of dicts with the REPORT_FIELDS of every run; a failed run
+        has its message in 'error' and does not stop the others
+
+    Raises ValueError, before any run, if the case does not set the key
+    of an option in ``matrix``.
+    """
+    name, keys, inputs = load_case(case, stop)
+    entries = [(settings, solver_overrides(keys, settings))
+               for settings in parameter_grid(matrix or DEFAULT_MATRIX)]
+
+    records = []
+    for entry, (settings, overrides) in enumerate(entries):
+        for repeat in range(repeats):
+            case_dir = os.path.abspath(os.path.join(root_dir, case, '{:03d}_{}'.format(entry, repeat)))
+            record = dict(date=time.strftime('%Y-%m-%dT%H:%M:%S'), host=platform.node(), case=case,
+                          settings=format_settings(settings), repeat=repeat)
+            record.update(run_measured(name, keys, overrides, case_dir, inputs))
+            record['error'] = record['error'] or ''
+            records.append(record)
+    return records
+
+
+def append_report(filename, records):
+    """Append benchmark records to the CSV report ``filename``."""
+    new = not os.path.exists(filename)
+    with open(filename, 'a', newline='') as f:
+        writer = csv.DictWriter(f, REPORT_FIELDS, extrasaction='ignore')
+        if new:
+            writer.writeheader()
+        for record in records:
+            writer.writerow({field: '' if record.get(field) is None else record[field]
+                             for field in REPORT_FIELDS})
+
+
+def compare_report(filename, threshold=0.1):
+    """Compare the last two ParFlow versions of every case and setting.
+
+    Uses the fastest repeat of each version.  Returns a list of dicts with
+    'case', 'settings', 'old_version', 'new_version', the wall times and
+    iteration counts of both, 'ratio' (new / old wall time) and
+    'regression' (wall time or nonlinear iterations grew by more than
+    ``threshold``).  Settings benchmarked with one version only are left
+    out.
+    """
+    with open(filename, newline='') as f:
+        rows = [row for row in csv.DictReader(f) if not row['error']]
+    best = {}
+    order = {}
+    for row in rows:
+        key = (row['case'], row['settings'])
+        order.setdefault(key, [])
+        if row['parflow_version'] not in order[key]:
+            order[key].append(row['parflow_version'])
+        version_key = key + (row['parflow_version'],)
+        if version_key not in best or float(row['wall_time']) < float(best[version_key]['wall_time']):
+            best[version_key] = row
+
+    out = []
+    for key, versions in order.items():
+        if len(versions) < 2:
+            continue
+        old, new = best[key + (versions[-2],)], best[key + (versions[-1],)]
+        ratio = float(new['wall_time']) / float(old['wall_time'])
+        iterations = float(new['nonlinear_iterations'] or 0) / max(1.0, float(old['nonlinear_iterations'] or 0))
+        out.append(dict(case=key[0], settings=key[1], old_version=versions[-2], new_version=versions[-1],
+                        old_wall_time=float(old['wall_time']), new_wall_time=float(new['wall_time']),
+                        old_nonlinear_iterations=old['nonlinear_iterations'],
+                        new_nonlinear_iterations=new['nonlinear_iterations'],
+                        ratio=ratio, regression=ratio > 1 + threshold or iterations > 1 + threshold))
+    return out
+
+
+def format_records(records):
+    """Table of benchmark records, fastest first within each case."""
+    lines = ['{:<10s} {:<45s} {:>9s} {:>7s} {:>8s} {:>9s}'.format(
+        'case', 'settings', 'wall s', 'nonlin', 'lin', 'peak MB')]
+    for r in sorted(records, key=lambda r: (r['case'], r['error'] != '', r.get('wall_time') or 0)):
+        if r['error']:
+            lines.append('{:<10s} {:<45s} failed: {}'.format(r['case'], r['settings'], r['error']))
+            continue
+        lines.append('{:<10s} {:<45s} {:>9.2f} {:>7} {:>8} {:>9.1f}'.format(
+            r['case'], r['settings'], r['wall_time'], r['nonlinear_iterations'],
+            r['linear_iterations'], r['peak_memory_mb']))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark ParFlow solver settings.')
+    parser.add_argument('cases', nargs='*', default=[],
+                        help='{} or .pfidb files'.format(', '.join(sorted(CASES))))
+    for option, key in SOLVER_OPTIONS.items():
+        parser.add_argument('--' + option.replace('_', '-'), dest=option, nargs='+',
+                            help='values of ' + key)
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--stop', type=float, default=None, help='stop time of every run')
+    parser.add_argument('--runs', default='benchmark_runs', help='directory the runs are made in')
+    parser.add_argument('--report', default='benchmarks.csv')
+    parser.add_argument('--compare', action='store_true',
+                        help='compare the last two ParFlow versions in the report')
+    args = parser.parse_args()
+
+    matrix = {option: getattr(args, option) for option in SOLVER_OPTIONS if getattr(args, option)}
+    for case in args.cases:
+        records = benchmark_case(case, matrix or None, args.runs, args.repeats, args.stop)
+        append_report(args.report, records)
+        print(format_records(records))
+    if args.compare:
+        for c in compare_report(args.report):
+            print('{case:<10s} {settings:<45s} {old_version} {old_wall_time:.2f}s -> '
+                  '{new_version} {new_wall_time:.2f}s ({ratio:.2f}x){flag}'
+                  .format(flag='  REGRESSION' if c['regression'] else '', **c))
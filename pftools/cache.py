@@ -0,0 +1,16 @@
+"""Content keys for the caches kept next to input files.
+
+The forcing, solid-file and spin-up caches are named after a hash of the
+files they were built from, so an edited file is simply rebuilt and an
+unchanged one is never processed twice.
+"""
+import hashlib
+
+
+def content_hash(filename):
+    """Short hex SHA-256 of the content of ``filename``."""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
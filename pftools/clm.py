@@ -0,0 +1,102 @@
+"""CLM input and output conventions shared by the single column scripts."""
+import re
+
+# layers of PFCLM_SC.out.clm_output.<file number>.C.pfb as
+# (name, description, units); names follow the CLM variable names
+CLM_LAYERS = [
+    ('eflx_lh_tot', 'total latent heat flux', 'W m-2'),
+    ('eflx_lwrad_out', 'total upward LW radiation', 'W m-2'),
+    ('eflx_sh_tot', 'total sensible heat flux', 'W m-2'),
+    ('eflx_soil_grnd', 'ground heat flux', 'W m-2'),
+    ('qflx_evap_tot', 'net veg. evaporation and transpiration and soil evaporation', 'mm s-1'),
+    ('qflx_evap_grnd', 'ground evaporation', 'mm s-1'),
+    ('qflx_evap_soi', 'soil evaporation', 'mm s-1'),
+    ('qflx_evap_veg', 'vegetation evaporation (canopy) and transpiration', 'mm s-1'),
+    ('qflx_tran_veg', 'transpiration', 'mm s-1'),
+    ('qflx_infl', 'infiltration flux', 'mm s-1'),
+    ('swe_out', 'SWE', 'mm'),
+    ('t_grnd', 'ground temperature', 'K'),
+    ('qflx_qirr', 'irrigation flux', 'mm s-1'),
+] + [('t_soil_{}'.format(i), 'soil temperature, layer {}'.format(i), 'K') for i in range(12)]
+
+CLM_LAYER_INDEX = {name: i for i, (name, _, _) in enumerate(CLM_LAYERS)}
+
+
+def clm_layers(nz):
+    """CLM_LAYERS for a clm_output file with ``nz`` layers.
+
+    Everything past layer 12 is soil temperature, so runs with a different
+    number of soil layers only change the length of that tail.
+    """
+    layers = CLM_LAYERS[:nz]
+    for i in range(len(CLM_LAYERS) - 13, nz - 13):
+        layers.append(('t_soil_{}'.format(i), 'soil temperature, layer {}'.format(i), 'K'))
+    return layers
+
+
+def set_clmin_values(filename, **values):
+    """Change entries of a ``drv_clmin.dat`` in place, e.g. ``startcode=1``.
+
+    Only the value column of each line is replaced, so the layout and the
+    descriptions are kept.
+    """
+    with open(filename) as f:
+        lines = f.readlines()
+    missing = set(values)
+    for i, line in enumerate(lines):
+        match = re.match(r'(\S+)(\s+)(\S+)(.*)', line, re.DOTALL)
+        if match and match.group(1) in values:
+            name, gap, old, rest = match.groups()
+            new = str(values[name])
+            # keep the description in the same column where possible
+            lines[i] = name + gap + new + ' ' * max(0, len(old) - len(new)) + rest
+            missing.discard(name)
+    if missing:
+        raise KeyError('{} not found in {}'.format(', '.join(sorted(missing)), filename))
+    with open(filename, 'w') as f:
+        f.writelines(lines)
+
+
+# column headers of drv_vegm.dat
+_VEGM_HEADER = (
+    ' x  y  lat    lon    sand clay color  fractional coverage of grid by vegetation class'
+    ' (Must/Should Add to 1.0)\n'
+    '       (Deg)\t (Deg)  (%/100)   index  ' + ' '.join('{:<4d}'.format(i) for i in range(1, 19)).rstrip()
+    + '\n')
+
+
+def read_vegm(filename):
+    """Cells of a ``drv_vegm.dat`` as a list of dicts.
+
+    Every cell has 'x', 'y' (1-based grid indices), 'lat', 'lon', 'sand',
+    'clay', 'color' and 'fractions', the coverage of the 18 IGBP
+    vegetation classes.
+    """
+    cells = []
+    with open(filename) as f:
+        for line in f.readlines()[2:]:
+            fields = line.split()
+            if not fields:
+                continue
+            cells.append(dict(x=int(fields[0]), y=int(fields[1]), lat=float(fields[2]),
+                              lon=float(fields[3]), sand=float(fields[4]), clay=float(fields[5]),
+                              color=int(fields[6]), fractions=[float(v) for v in fields[7:]]))
+    return cells
+
+
+def vegetation_fractions(igbp_class):
+    """Coverage fractions of a cell fully covered by IGBP class 1-18."""
+    igbp_class = int(igbp_class)
+    if not 1 <= igbp_class <= 18:
+        raise ValueError('IGBP vegetation classes are 1-18, not {}'.format(igbp_class))
+    return [1.0 if i == igbp_class else 0.0 for i in range(1, 19)]
+
+
+def write_vegm(filename, cells):
+    """Write cells as returned by ``read_vegm`` to a ``drv_vegm.dat``."""
+    with open(filename, 'w') as f:
+        f.write(_VEGM_HEADER)
+        for cell in cells:
+            f.write('{:4d}{:4d}  {:.4f} {:.4f}  {:.3f} {:.3f}   {:d}   {}\n'.format(
+                cell['x'], cell['y'], cell['lat'], cell['lon'], cell['sand'], cell['clay'],
+                int(cell['color']), ' '.join('{:.4f}'.format(v) for v in cell['fractions'])))
@@ -0,0 +1,219 @@
+"""Run many single columns as one ParFlow-CLM domain.
+
+Running every site of a sites table (see ``pftools.sites``) as its own
+1 x 1 x 20 run repeats ParFlow's start-up, CLM's initialization and all of
+the file handling for every column.  ``run_columns`` instead lays the
+columns out side by side along y in one 1 x N x NZ domain and runs it
+once, with a ``drv_vegm.dat`` row per column and the columns' 1D forcing
+written as 3D forcing files.  The columns stay independent: the
+permeability tensor has no y component, so no water moves between them
+below ground, and overland flow follows the x slope straight out of each
+column, as in the single column run.  The output is split back into one
+time series per column, in the same combined store ``pftools.sites``
+writes::
+
+    python -m pftools.columns sites.csv --run column_run --out columns.nc --ranks 4
+
+All columns share the base run's soil and ParFlow keys, so the sites
+table may only set them to the same value for every site; spin-up is not
+supported.
+"""
+import argparse
+import math
+import os
+import shutil
+
+import netCDF4
+import numpy as np
+
+from parflow import Run
+
+from pftools.benchmark import CASES, _REPO_DIR, case_keys
+from pftools.clm import read_vegm, set_clmin_values, write_vegm
+from pftools.forcing import FORCING_DTYPE, load_forcing, write_3d_forcing
+from pftools.sites import (SOIL_PARAMETERS, _attributes, _create_site_store, _create_site_variable,
+                           read_sites, site_cell, site_keys)
+from pftools.store import pack_run
+from pftools.topology import topology_keys
+
+# directory of the 3D forcing files in the run directory, and their prefix
+FORCING_DIR = 'forcing'
+FORCING_PREFIX = 'columns'
+
+
+def _check_shared_keys(sites):
+    # soil and ParFlow keys of the sites, which every column has to share
+    shared = [{column: value for column, value in site.items()
+               if column in SOIL_PARAMETERS or '.' in column} for site in sites]
+    for site, values in zip(sites, shared):
+        if values != shared[0]:
+            raise ValueError('sites {} and {} set different soil or ParFlow keys, which columns '
+                             'in one domain cannot'.format(sites[0]['name'], site['name']))
+
+
+def column_keys(keys, columns):
+    """Keys of the single column run ``keys`` stretched to ``columns`` columns along y.
+
+    Lateral flow between the columns is switched off by a zero y
+    component of the permeability tensor.  Raises ValueError if ``keys``
+    is not a single column or its y slope would route overland flow from
+    one column into the next.
+    """
+    if int(keys['ComputationalGrid.NX']) * int(keys['ComputationalGrid.NY']) != 1:
+        raise ValueError('the base run is not a single column')
+    for key, value in keys.items():
+        if key.startswith('TopoSlopesY.') and key.endswith('.Value') and float(value) != 0.0:
+            raise ValueError('{} = {}, columns along y need no y slope'.format(key, value))
+
+    keys = dict(keys)
+    geom = str(keys.get('Domain.GeomName', 'domain'))
+    keys['ComputationalGrid.NY'] = columns
+    keys['Geom.{}.Upper.Y'.format(geom)] = (float(keys['Geom.{}.Lower.Y'.format(geom)])
+                                            + columns * float(keys['ComputationalGrid.DY']))
+    keys['Perm.TensorType'] = 'TensorByGeom'
+    keys['Geom.Perm.TensorByGeom.Names'] = geom
+    keys['Geom.{}.Perm.TensorValY'.format(geom)] = 0.0
+    return keys
+
+
+def forcing_steps(keys, nt):
+    """(first, last) CLM steps the 3D forcing files have to cover.
+
+    ``first`` is rounded down to the start of a file of ``nt`` steps.
+    """
+    start = int(keys.get('Solver.CLM.IstepStart', 1))
+    steps = math.ceil((float(keys['TimingInfo.StopTime']) - float(keys['TimingInfo.StartTime']))
+                      / float(keys['TimeStep.Value']))
+    return (start - 1) // nt * nt + 1, start + steps - 1
+
+
+def write_column_forcing(sites, out_dir, first, last, nt, dx=1.0, dy=1.0):
+    """Write the sites' 1D forcing as the 3D forcing of a column per site.
+
+    Covers CLM steps ``first`` to ``last`` (row ``step - 1`` of each
+    forcing file), padded to whole files of ``nt`` steps by repeating the
+    last row.  Returns the files written.
+    """
+    steps = last - first + 1
+    padded = -(-steps // nt) * nt
+    forcing = np.empty((padded, len(sites), 1), dtype=FORCING_DTYPE)
+    for column, site in enumerate(sites):
+        rows = load_forcing(site['forcing'], first - 1, last)
+        if len(rows) < steps:
+            raise ValueError('{} has {} rows, {} are needed'.format(site['forcing'], first - 1 + len(rows),
+                                                                   last))
+        forcing[:steps, column, 0] = rows
+        forcing[steps:, column, 0] = rows[-1]
+    os.makedirs(out_dir, exist_ok=True)
+    return write_3d_forcing(out_dir, FORCING_PREFIX, forcing, first, nt, dx, dy)
+
+
+def split_columns(store, names, lat, lon, filename):
+    """Split a store of columns laid out along y into a store with a 'site' axis.
+
+    ``names``, ``lat`` and ``lon`` are those of the columns in y order.
+    The result has the layout of ``pftools.sites.combine_stores``.
+    Returns ``filename``.
+    """
+    tmp_filename = filename + '.tmp'
+    with netCDF4.Dataset(store) as src, netCDF4.Dataset(tmp_filename, 'w') as ds:
+        src.set_auto_mask(False)
+        time = src['time'][:]
+        _create_site_store(ds, src.run_name, time, names, lat, lon)
+        for name, var in src.variables.items():
+            if name == 'time' or var.dimensions[:1] != ('time',):
+                continue
+            # every column becomes a 1 x 1 cell of its own site
+            nc_var = _create_site_variable(ds, name, var.dimensions[1:], var.shape[1:-2] + (1, 1),
+                                           _attributes(var))
+            tchunk = nc_var.chunking()[0]
+            for start in range(0, len(time), tchunk):
+                block = var[start:start + tchunk]
+                nc_var[start:start + tchunk] = np.moveaxis(block, -2, 1)[..., np.newaxis, :]
+    os.replace(tmp_filename, filename)
+    return filename
+
+
+def run_columns(sites, run_dir='column_run', base_pfidb=None, inputs_dir=None, ranks=1, nt=24,
+                filename=None):
+    """Run every site as a column of one domain and split the output per site.
+
+    Args:
+        sites: list of site dicts, as returned by ``pftools.sites.read_sites``
+        run_dir: directory the domain is run in; emptied first
+        base_pfidb: ``.pfidb`` of the single column run, defaults to the
+            one ``PFCLM_SC.py`` leaves in ``single_column_CLM/output``
+        inputs_dir: directory with the ``drv_*.dat`` files the columns
+            start from, defaults to ``single_column_CLM/inputs``
+        ranks: MPI ranks the domain is split over, along y
+        nt: steps per 3D forcing file
+        filename: combined store to write, defaults to
+            ``<run_dir>/<run name>.columns.nc``
+
+    Returns:
+        the combined store's file name
+    """
+    base_pfidb = base_pfidb or os.path.join(_REPO_DIR, CASES['pfclm_sc']['pfidb'])
+    if not os.path.exists(base_pfidb):
+        raise FileNotFoundError('{} not found, run PFCLM_SC.py once first'.format(base_pfidb))
+    inputs_dir = inputs_dir or os.path.join(_REPO_DIR, 'single_column_CLM', 'inputs')
+    name = os.path.basename(base_pfidb)[:-len('.pfidb')]
+    run_dir = os.path.abspath(run_dir)
+    filename = filename or os.path.join(run_dir, '{}.columns.nc'.format(name))
+
+    # soil, initial condition and keys from the sites, forcing from the files below
+    _check_shared_keys(sites)
+    keys = column_keys(site_keys(case_keys(base_pfidb), sites[0]), len(sites))
+    first, last = forcing_steps(keys, nt)
+    keys.update({'Solver.CLM.MetForcing': '3D',
+                 'Solver.CLM.MetFilePath': os.path.join(run_dir, FORCING_DIR),
+                 'Solver.CLM.MetFileName': FORCING_PREFIX,
+                 'Solver.CLM.MetFileNT': nt})
+    keys.update(topology_keys(keys, ranks))
+
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(run_dir)
+    for input_file in ('drv_clmin.dat', 'drv_vegp.dat'):
+        shutil.copyfile(os.path.join(inputs_dir, input_file), os.path.join(run_dir, input_file))
+    set_clmin_values(os.path.join(run_dir, 'drv_clmin.dat'), startcode=2, clm_ic=2)
+    template = read_vegm(os.path.join(inputs_dir, 'drv_vegm.dat'))[0]
+    cells = [dict(site_cell(template, site), x=1, y=column + 1) for column, site in enumerate(sites)]
+    write_vegm(os.path.join(run_dir, 'drv_vegm.dat'), cells)
+    forcing_files = write_column_forcing(sites, os.path.join(run_dir, FORCING_DIR), first, last, nt,
+                                         float(keys['ComputationalGrid.DX']),
+                                         float(keys['ComputationalGrid.DY']))
+    for key, value in keys.items():
+        # CLM writes into these directories relative to the run directory
+        if key.endswith('FileDir') and isinstance(value, str) and value and not os.path.isabs(value):
+            os.makedirs(os.path.join(run_dir, value), exist_ok=True)
+
+    run = Run(name)
+    run.pfset(flat_map=keys)
+    # the forcing files hold nt steps as layers, and are split as such
+    nz = run.ComputationalGrid.NZ
+    run.ComputationalGrid.NZ = nt
+    for forcing_file in forcing_files:
+        run.dist(forcing_file)
+    run.ComputationalGrid.NZ = nz
+    try:
+        run.run(working_directory=run_dir)
+    except SystemExit as e:
+        # Run.run exits the interpreter when ParFlow fails
+        raise RuntimeError('{} failed in {} (exit status {})'.format(name, run_dir, e.code))
+
+    return split_columns(pack_run(run_dir, name), [site['name'] for site in sites],
+                         [cell['lat'] for cell in cells], [cell['lon'] for cell in cells], filename)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the sites of a sites table as columns of one domain.')
+    parser.add_argument('sites', help='CSV table of sites')
+    parser.add_argument('--run', default='column_run', help='directory the domain is run in')
+    parser.add_argument('--out', default=None, help='combined store of all columns')
+    parser.add_argument('--base', default=None, help='.pfidb of the single column run')
+    parser.add_argument('--inputs', default=None, help='directory with the drv_*.dat files')
+    parser.add_argument('--ranks', type=int, default=1)
+    parser.add_argument('--nt', type=int, default=24, help='steps per 3D forcing file')
+    args = parser.parse_args()
+    print(run_columns(read_sites(args.sites), args.run, args.base, args.inputs, args.ranks, args.nt,
+                      args.out))
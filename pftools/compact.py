@@ -0,0 +1,144 @@
+"""Fold the per-timestep output of a run into one archive per variable.
+
+``compact_run`` writes ``<run>.out.<variable>.nc`` (see ``pftools.archive``)
+for every per-timestep output variable of a run, written as PFB, SILO or
+both, reads each archive back and compares it with the original files, and
+only then removes the PFBs (and their ``.dist`` files) and the SILO files
+(and their block files under ``<run>.out/``).  Static outputs written once
+per run (mask, porosity, ...) stay PFBs; those written as SILO only are
+converted to PFB first (see ``pftools.silo``), so a SILO-only run is
+compacted in one step.  Afterwards ``pftools.timeseries``, ``pftools.frames``
+and the other readers read the run as before.  From the command line::
+
+    python -m pftools.compact heterog-dunne heterog-dunne
+"""
+import argparse
+import glob
+import os
+import re
+
+import netCDF4
+import numpy as np
+
+from pftools.archive import archive_filename, archive_timesteps, read_archive
+from pftools.pfb import read_pfb, read_pfb_header
+from pftools.silo import (convert_silo_run, read_silo, remove_empty_dirs, remove_silo, silo_filename, silo_grid,
+                          silo_timesteps)
+from pftools.timeseries import pfb_filename, pfb_timesteps
+
+# size of one chunk along time
+_CHUNK_BYTES = 1 << 20
+
+
+def timestep_variables(run_dir, run_name):
+    """Names of the outputs of ``run_name`` written once per timestep as PFB or SILO."""
+    pattern = re.compile(re.escape(run_name) + r'\.out\.(.+)\.\d{5}(\.C)?\.(pfb|silo)')
+    names = set()
+    for name in glob.glob(os.path.join(glob.escape(run_dir), glob.escape(run_name) + '.out.*')):
+        match = pattern.fullmatch(os.path.basename(name))
+        if match:
+            names.add(match.group(1))
+    return sorted(names)
+
+
+def _remove_pfb(filename):
+    os.remove(filename)
+    if os.path.exists(filename + '.dist'):
+        os.remove(filename + '.dist')
+
+
+def compact_variable(run_dir, run_name, variable, remove=True):
+    """Fold the per-timestep PFB and SILO files of ``variable`` into its archive.
+
+    Timesteps with a PFB are archived from it, the others from their SILO
+    file; a SILO file next to a PFB has to hold the same values.  Raises
+    FileExistsError if the variable already has an archive, and
+    RuntimeError, leaving all files in place, if the archive read back
+    does not match them.  Returns the archive file name.
+    """
+    filename = archive_filename(run_dir, run_name, variable)
+    if os.path.exists(filename):
+        raise FileExistsError('{} already exists'.format(filename))
+    pfb_steps = pfb_timesteps(run_dir, run_name, variable)
+    silo_steps = silo_timesteps(run_dir, run_name, variable) if variable != 'clm_output' else []
+    steps = sorted(set(pfb_steps) | set(silo_steps))
+    if not steps:
+        raise FileNotFoundError('no {} output for {} in {}'.format(variable, run_name, run_dir))
+    pfb_files = {t: pfb_filename(run_dir, run_name, variable, t) for t in pfb_steps}
+    silo_files = {t: silo_filename(run_dir, run_name, variable, t) for t in silo_steps}
+
+    def read_step(timestep):
+        if timestep in pfb_files:
+            return read_pfb(pfb_files[timestep])
+        return read_silo(silo_files[timestep])
+
+    if pfb_steps:
+        header = read_pfb_header(pfb_files[pfb_steps[0]])
+    else:
+        header = silo_grid(silo_files[silo_steps[0]])
+    # 2D SILO outputs keep the 3D size in their header
+    nz, ny, nx = read_step(steps[0]).shape
+    tchunk = max(1, min(len(steps), _CHUNK_BYTES // (8 * nz * ny * nx)))
+
+    tmp_filename = filename + '.tmp'
+    with netCDF4.Dataset(tmp_filename, 'w') as ds:
+        ds.run_name = run_name
+        ds.variable = variable
+        for key in ('x', 'y', 'z', 'dx', 'dy', 'dz'):
+            ds.setncattr(key, header[key])
+        ds.createDimension('time', len(steps))
+        ds.createDimension('z', nz)
+        ds.createDimension('y', ny)
+        ds.createDimension('x', nx)
+        time_var = ds.createVariable('time', 'i4', ('time',))
+        time_var.long_name = 'timestep'
+        time_var[:] = steps
+        data = ds.createVariable('data', 'f8', ('time', 'z', 'y', 'x'), zlib=True,
+                                 chunksizes=(tchunk, nz, ny, nx))
+        for start in range(0, len(steps), tchunk):
+            data[start:start + tchunk] = np.stack([read_step(t) for t in steps[start:start + tchunk]])
+
+    # check every timestep against its files before anything is removed
+    if archive_timesteps(tmp_filename) != steps:
+        raise RuntimeError('{} does not hold the timesteps of the output files'.format(tmp_filename))
+    for start in range(0, len(steps), tchunk):
+        archived = read_archive(tmp_filename, steps[start:start + tchunk])
+        for values, t in zip(archived, steps[start:start + tchunk]):
+            for f in (pfb_files.get(t), silo_files.get(t)):
+                if f is None:
+                    continue
+                if not np.array_equal(values, read_pfb(f) if f.endswith('.pfb') else read_silo(f)):
+                    raise RuntimeError('{} differs from {}'.format(tmp_filename, f))
+    os.replace(tmp_filename, filename)
+
+    if remove:
+        for f in pfb_files.values():
+            _remove_pfb(f)
+        for f in silo_files.values():
+            remove_silo(f)
+        remove_empty_dirs(run_dir, run_name)
+    return filename
+
+
+def compact_run(run_dir, run_name, variables=None, remove=True):
+    """Compact every per-timestep output variable of a run, or ``variables``.
+
+    Static SILO outputs are converted to PFB (checked against the PFB
+    ParFlow wrote, if any) and, with ``remove``, removed.  Returns the list
+    of archive file names.
+    """
+    convert_silo_run(run_dir, run_name, remove, static=True)
+    if variables is None:
+        variables = timestep_variables(run_dir, run_name)
+    return [compact_variable(run_dir, run_name, variable, remove) for variable in variables]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('run_dir')
+    parser.add_argument('run_name')
+    parser.add_argument('--variables', nargs='+', default=None)
+    parser.add_argument('--keep', action='store_true', help='keep the original PFB and SILO files')
+    args = parser.parse_args()
+    for filename in compact_run(args.run_dir, args.run_name, args.variables, not args.keep):
+        print(filename)
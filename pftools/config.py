@@ -0,0 +1,74 @@
+"""Read back the ParFlow keys a run was made with.
+
+Every run leaves ``<run>.pfidb`` in its directory: the number of keys on the
+first line, then for every key its length, the key, the value's length and
+the value, each on its own line.
+"""
+import os
+
+
+def read_pfidb(filename):
+    """Dict of key -> value (both str) from a ``.pfidb`` file."""
+    with open(filename) as f:
+        lines = f.read().split('\n')
+    keys = {}
+    for i in range(int(lines[0])):
+        keys[lines[1 + 4 * i + 1]] = lines[1 + 4 * i + 3]
+    return keys
+
+
+def write_pfidb(filename, keys):
+    """Write a dict of key -> value as a ``.pfidb`` file, keys sorted."""
+    lines = [str(len(keys))]
+    for key in sorted(keys):
+        value = str(keys[key])
+        lines += [str(len(key)), key, str(len(value)), value]
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def run_keys(run_dir, run_name):
+    """Keys of the run ``run_name`` that was made in ``run_dir``."""
+    return read_pfidb(os.path.join(run_dir, '{}.pfidb'.format(run_name)))
+
+
+def constant_value(keys, prefix):
+    """Value of a 'Constant' field such as ``TopoSlopesX`` or ``Mannings``.
+
+    Returns None when the field is not a single-geometry constant (e.g.
+    'PFBFile'), in which case the field has to be read from its output.
+    """
+    if keys.get(prefix + '.Type') != 'Constant':
+        return None
+    names = keys.get(prefix + '.GeomNames', '').split()
+    if len(names) != 1:
+        return None
+    value = keys.get('{}.Geom.{}.Value'.format(prefix, names[0]))
+    return None if value is None else float(value)
+
+
+def cycle_values(keys, cycle, values, times):
+    """Value of a time-cycled quantity at each of ``times``.
+
+    ``values`` maps interval names of ``cycle`` (e.g. 'rain', 'rec') to
+    values.  Interval lengths are in multiples of TimingInfo.BaseUnit and the
+    cycle repeats when its Repeat key is -1.
+    """
+    base_unit = float(keys['TimingInfo.BaseUnit'])
+    names = keys['Cycle.{}.Names'.format(cycle)].split()
+    ends = []
+    total = 0.0
+    for name in names:
+        total += int(keys['Cycle.{}.{}.Length'.format(cycle, name)]) * base_unit
+        ends.append(total)
+    repeat = int(keys.get('Cycle.{}.Repeat'.format(cycle), '-1'))
+
+    out = []
+    for t in times:
+        if repeat < 0 or t < total * max(repeat, 1):
+            t = t % total
+        for name, end in zip(names, ends):
+            if t < end:
+                break
+        out.append(values[name])
+    return out
@@ -0,0 +1,134 @@
+"""Dunne-style hillslope domains of any size, for scaling workloads.
+
+The Dunne case is a 100 x 1 x 15 hillslope cut out of its 20 x 1 x 300
+grid by ``tuff.pfsol``: the land surface rises linearly from a third of
+the grid depth at the outlet (x = 0) to the full depth at x = 100, and the
+water table starts at 0.3 of the depth, just below the outlet.
+``dunne_domain`` multiplies NX, NY and NZ of such a case, keeping the cell
+sizes, and writes the matching solid (the same shape stretched to the new
+extents, with the same patches) or switches to a box geometry with the
+same patch names.  Slopes, Manning's n, rain and everything else keep the
+case's values, so a generated domain behaves like the original at a larger
+size.  From the command line, starting from the Dunne run in
+``overland/dunne_over``::
+
+    python -m pftools.domain --factors 10 50 2 --out dunne_10x50x2
+
+writes ``dunne_10x50x2/Dunne.pfidb`` and ``Dunne.pfsol``, which
+``pftools.benchmark`` and ``pftools.scaling`` take as a case.
+"""
+import argparse
+import os
+
+import numpy as np
+
+from pftools.benchmark import CASES, _REPO_DIR, case_keys
+from pftools.config import write_pfidb
+from pftools.pfsol import write_pfsol
+
+# tuff.pfsol on the unit box: x and y over the grid extent, z over its depth
+DUNNE_VERTICES = np.array([
+    [0.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 1.0, 1 / 3], [0.0, 0.0, 1 / 3],
+    [0.5, 0.0, 2 / 3], [0.5, 1.0, 2 / 3], [1.0, 0.0, 0.0], [1.0, 1.0, 0.0],
+    [1.0, 1.0, 1.0], [1.0, 0.0, 1.0]])
+DUNNE_TRIANGLES = np.array([
+    [0, 9, 3], [0, 6, 9], [3, 5, 2], [3, 4, 5], [4, 8, 5], [4, 9, 8], [1, 2, 8],
+    [1, 8, 7], [1, 3, 2], [1, 0, 3], [7, 8, 9], [7, 9, 6], [0, 7, 6], [0, 1, 7]])
+# triangles of each patch, in the order of DUNNE_PATCH_NAMES
+DUNNE_PATCHES = [[2, 3, 4, 5], [8, 9], [0, 1], [10, 11], [6, 7], [12, 13]]
+DUNNE_PATCH_NAMES = 'z_upper x_lower y_lower x_upper y_upper z_lower'
+# ParFlow names the faces of a box geometry in this order
+BOX_PATCH_NAMES = 'x_lower x_upper y_lower y_upper z_lower z_upper'
+
+# initial water table height as a fraction of the depth
+WATER_TABLE = 0.3
+
+
+def _geometry_keys(keys):
+    # keys describing the current geometry inputs, dropped before new ones are set
+    names = str(keys.get('GeomInput.Names', '')).split()
+    return [key for key in keys if key == 'GeomInput.Names'
+            or any(key.startswith('GeomInput.{}.'.format(name)) for name in names)]
+
+
+def dunne_domain(keys, factors, out_dir, run_name, geometry='solid'):
+    """Keys of a Dunne-style case with NX, NY, NZ multiplied by ``factors``.
+
+    Args:
+        keys: keys of a Dunne-style run, e.g. from its ``.pfidb``
+        factors: (fx, fy, fz) integer multiples of NX, NY and NZ
+        out_dir: directory the solid file is written to
+        run_name: name of the generated run, the solid is
+            ``<out_dir>/<run_name>.pfsol``
+        geometry: 'solid' for the stretched hillslope solid, 'box' for a
+            box over the whole grid, with the hillslope in the slopes only
+
+    Returns:
+        the new keys; the solid file name in them is relative to ``out_dir``
+    """
+    fx, fy, fz = (int(f) for f in factors)
+    if min(fx, fy, fz) < 1:
+        raise ValueError('factors must be positive integers, got {}'.format(factors))
+    keys = dict(keys)
+    domain = str(keys.get('Domain.GeomName', 'domain'))
+    for axis, factor in zip('XYZ', (fx, fy, fz)):
+        keys['ComputationalGrid.N' + axis] = int(keys['ComputationalGrid.N' + axis]) * factor
+    lower = np.array([float(keys['ComputationalGrid.Lower.' + axis]) for axis in 'XYZ'])
+    extent = np.array([int(keys['ComputationalGrid.N' + axis]) * float(keys['ComputationalGrid.D' + axis])
+                       for axis in 'XYZ'])
+
+    for key in _geometry_keys(keys):
+        del keys[key]
+    if geometry == 'solid':
+        filename = run_name + '.pfsol'
+        write_pfsol(os.path.join(out_dir, filename), lower + DUNNE_VERTICES * extent,
+                    DUNNE_TRIANGLES, DUNNE_PATCHES)
+        keys.update({'GeomInput.Names': 'solidinput1',
+                     'GeomInput.solidinput1.InputType': 'SolidFile',
+                     'GeomInput.solidinput1.GeomNames': domain,
+                     'GeomInput.solidinput1.FileName': filename})
+        keys['Geom.{}.Patches'.format(domain)] = DUNNE_PATCH_NAMES
+    elif geometry == 'box':
+        keys.update({'GeomInput.Names': 'boxinput',
+                     'GeomInput.boxinput.InputType': 'Box',
+                     'GeomInput.boxinput.GeomName': domain})
+        for axis, lo, size in zip('XYZ', lower, extent):
+            keys['Geom.{}.Lower.{}'.format(domain, axis)] = lo
+            keys['Geom.{}.Upper.{}'.format(domain, axis)] = lo + size
+        keys['Geom.{}.Patches'.format(domain)] = BOX_PATCH_NAMES
+    else:
+        raise ValueError("geometry must be 'solid' or 'box', not {!r}".format(geometry))
+
+    # water table just below the outlet, as in dunne_flow.py
+    keys['Geom.{}.ICPressure.Value'.format(domain)] = WATER_TABLE * extent[2]
+    keys['Geom.{}.ICPressure.RefPatch'.format(domain)] = 'z_lower'
+    return keys
+
+
+def write_domain(out_dir, factors, geometry='solid', base_pfidb=None):
+    """Generate a scaled Dunne case in ``out_dir`` from ``base_pfidb``.
+
+    ``base_pfidb`` defaults to the Dunne case of ``pftools.benchmark``.
+    Writes ``<run>.pfidb`` (and ``<run>.pfsol``) and returns the ``.pfidb``
+    path.
+    """
+    if base_pfidb is None:
+        base_pfidb = os.path.join(_REPO_DIR, CASES['dunne']['pfidb'])
+    run_name = os.path.basename(base_pfidb)[:-len('.pfidb')]
+    os.makedirs(out_dir, exist_ok=True)
+    keys = dunne_domain(case_keys(base_pfidb), factors, out_dir, run_name, geometry)
+    pfidb = os.path.join(out_dir, run_name + '.pfidb')
+    write_pfidb(pfidb, keys)
+    return pfidb
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a larger Dunne-style hillslope case.')
+    parser.add_argument('--factors', type=int, nargs=3, metavar=('FX', 'FY', 'FZ'), default=[1, 1, 1],
+                        help='multiples of NX, NY and NZ')
+    parser.add_argument('--geometry', choices=['solid', 'box'], default='solid')
+    parser.add_argument('--base', default=None, help='.pfidb of the case to scale')
+    parser.add_argument('--out', required=True)
+    args = parser.parse_args()
+    pfidb = write_domain(args.out, args.factors, args.geometry, args.base)
+    print(pfidb)
@@ -0,0 +1,86 @@
+"""Run ensembles of ParFlow runs concurrently.
+
+Every member is a copy of a base ``Run`` with some keys overridden.  It is
+run in its own directory, with its own copy of the PFB inputs it splits
+for its topology, so members never share output or ``.dist`` files, by a
+bounded pool of worker processes.  The base run's keys are passed to the
+workers as a flat dict, so any ``Run`` built by a script can be swept
+without the script being re-imported by the workers.
+"""
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from parflow import Run
+
+from pftools.frames import _pool_context
+from pftools.topology import distribute_inputs
+
+
+def parameter_grid(grid):
+    """All combinations of a dict of name -> list of values, as a list of dicts."""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+
+def _run_member(name, keys, overrides, member_dir, post):
+    run = Run(name)
+    run.pfset(flat_map=keys)
+    for key, value in overrides.items():
+        run.pfset(key=key, value=value)
+    os.makedirs(member_dir, exist_ok=True)
+    # PFB inputs have to be split for the member's own topology
+    distribute_inputs(run, member_dir)
+    try:
+        run.run(working_directory=member_dir)
+    except SystemExit as e:
+        # Run.run exits the interpreter when ParFlow fails
+        raise RuntimeError('{} failed in {} (exit status {})'.format(name, member_dir, e.code))
+    return post(member_dir, name) if post is not None else None
+
+
+def member_dirname(root_dir, member):
+    """Directory member number ``member`` of an ensemble is run in."""
+    return os.path.join(root_dir, 'member_{:04d}'.format(member))
+
+
+def run_ensemble(run, members, root_dir, post=None, workers=None):
+    """Run a copy of ``run`` for every set of key overrides in ``members``.
+
+    Args:
+        run: base ``parflow.Run``
+        members: list of dicts of ParFlow key -> value, e.g.
+            ``{'Geom.domain.Perm.Value': 0.5}``
+        root_dir: directory the member directories are created in
+        post: optional function ``post(member_dir, run_name)`` called in the
+            worker after a member finished, e.g.
+            ``pftools.overland.keyed_hydrograph``; it must be picklable
+        workers: number of members run at once, defaults to the CPU count
+            divided by the processes each run uses
+
+    Returns:
+        a list with a dict per member holding 'member', 'dir', 'overrides',
+        'result' (the return value of ``post``) and 'error' (None, or the
+        message of a failed member).  A failed member does not stop the
+        others.
+    """
+    keys = run.to_dict()
+    if workers is None:
+        ranks = 1
+        for axis in 'PQR':
+            ranks *= int(keys.get('Process.Topology.' + axis, 1))
+        workers = max(1, (os.cpu_count() or 1) // ranks)
+    os.makedirs(root_dir, exist_ok=True)
+
+    records = [dict(member=m, dir=member_dirname(root_dir, m), overrides=dict(overrides),
+                    result=None, error=None)
+               for m, overrides in enumerate(members)]
+    with ProcessPoolExecutor(max(1, workers), mp_context=_pool_context()) as pool:
+        futures = [pool.submit(_run_member, run.get_name(), keys, r['overrides'], r['dir'], post)
+                   for r in records]
+        for record, future in zip(records, futures):
+            try:
+                record['result'] = future.result()
+            except Exception as e:
+                record['error'] = str(e)
+    return records
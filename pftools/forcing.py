@@ -0,0 +1,100 @@
+"""Cached loading of 1D CLM meteorological forcing files.
+
+The whitespace text forcing files (one hour per row, eight columns) are
+parsed once and cached as a binary ``.npy`` file named after a hash of the
+text file's content, so an edited forcing file is simply re-parsed and
+unchanged ones are never parsed twice.  Cached files are served through a
+read-only memory map, so many processes reading the same forcing share one
+copy in the page cache.
+"""
+import os
+
+import numpy as np
+
+from pftools.cache import content_hash
+from pftools.pfb import write_pfb
+
+# columns of a 1D CLM forcing file
+FORCING_COLUMNS = [
+    ('DSWR', 'Downward Visible or Short-Wave radiation', 'W/m2'),
+    ('DLWR', 'Downward Infa-Red or Long-Wave radiation', 'W/m2'),
+    ('APCP', 'Precipitation rate', 'mm/s'),
+    ('Temp', 'Air temperature', 'K'),
+    ('UGRD', 'West-to-East or U-component of wind', 'm/s'),
+    ('VGRD', 'South-to-North or V-component of wind', 'm/s'),
+    ('Press', 'Atmospheric Pressure', 'pa'),
+    ('SPFH', 'Water-vapor specific humidity', 'kg/kg'),
+]
+
+FORCING_DTYPE = np.dtype([(name, np.float64) for name, _, _ in FORCING_COLUMNS])
+
+
+def forcing_cache_file(filename, cache_dir=None):
+    """Binary cache file for the forcing text file ``filename``.
+
+    The cache lives in ``.forcing_cache/`` next to the forcing file unless
+    ``cache_dir`` is given.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(filename)), '.forcing_cache')
+    return os.path.join(cache_dir, '{}.{}.npy'.format(os.path.basename(filename), content_hash(filename)))
+
+
+def load_forcing(filename, start=None, stop=None, cache_dir=None):
+    """Load a 1D CLM forcing file, hours ``start`` to ``stop``.
+
+    Returns a read-only structured array with one field per column of
+    FORCING_COLUMNS, e.g. ``load_forcing(f, 0, 8760)['APCP']``.  Use
+    ``as_table`` for a plain (hours, 8) array.
+    """
+    cache_file = forcing_cache_file(filename, cache_dir)
+    if not os.path.exists(cache_file):
+        table = np.loadtxt(filename, ndmin=2)
+        if table.shape[1] != len(FORCING_COLUMNS):
+            raise ValueError('{} has {} columns, expected {}'
+                             .format(filename, table.shape[1], len(FORCING_COLUMNS)))
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        # several processes may build the same cache at once; each writes its
+        # own temporary file and the last rename wins with identical content
+        tmp_file = '{}.{}.tmp.npy'.format(cache_file[:-4], os.getpid())
+        np.save(tmp_file, np.ascontiguousarray(table).view(FORCING_DTYPE).ravel())
+        os.replace(tmp_file, cache_file)
+    return np.load(cache_file, mmap_mode='r')[start:stop]
+
+
+def as_table(forcing):
+    """View a structured forcing array as a plain (hours, 8) float64 array."""
+    return forcing.view(np.float64).reshape(len(forcing), len(FORCING_COLUMNS))
+
+
+def forcing_3d_filename(prefix, name, first_step, nt):
+    """Name of the 3D forcing file of column ``name`` starting at CLM step ``first_step``."""
+    return '{}.{}.{:06d}_to_{:06d}.pfb'.format(prefix, name, first_step, first_step + nt - 1)
+
+
+def write_3d_forcing(out_dir, prefix, forcing, first_step, nt, dx=1.0, dy=1.0):
+    """Write gridded forcing as ParFlow-CLM 3D forcing files.
+
+    Args:
+        out_dir: directory the files are written to (``Solver.CLM.MetFilePath``)
+        prefix: file name prefix (``Solver.CLM.MetFileName``)
+        forcing: structured array with the fields of FORCING_DTYPE, shaped
+            (steps, ny, nx); steps must be a multiple of ``nt``
+        first_step: CLM step of the first row, one more than a multiple of
+            ``nt``
+        nt: steps per file (``Solver.CLM.MetFileNT``), stored as the z
+            layers of each file
+
+    Returns the list of files written.
+    """
+    steps = len(forcing)
+    if steps % nt or (first_step - 1) % nt:
+        raise ValueError('{} steps from step {} do not fill whole files of {} steps'
+                         .format(steps, first_step, nt))
+    files = []
+    for start in range(0, steps, nt):
+        block = forcing[start:start + nt]
+        for name, _, _ in FORCING_COLUMNS:
+            files.append(os.path.join(out_dir, forcing_3d_filename(prefix, name, first_step + start, nt)))
+            write_pfb(files[-1], block[name], dx=dx, dy=dy)
+    return files
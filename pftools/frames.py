@@ -0,0 +1,109 @@
+"""Parallel loading of per-timestep PFB frames for animations.
+
+``load_frames`` splits a list of timesteps across a pool of worker
+processes.  Every worker reads its frames with ``read_pfb_slice`` and writes
+them straight into one shared-memory block preallocated by the parent, so
+no frame data is pickled back through the pool.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+import threading
+
+import numpy as np
+
+from pftools.archive import archive_filename, read_archive
+from pftools.pfb import read_pfb_header, read_pfb_slice
+from pftools.timeseries import list_timesteps, pfb_filename, read_frame
+
+# tasks handed to each worker; a few per worker evens out stragglers
+_TASKS_PER_WORKER = 4
+
+
+def _load_into(shm_name, shape, rows, filenames, index, header, clip):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        frames = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        for row, filename in zip(rows, filenames):
+            data = read_pfb_slice(filename, index, header)
+            if clip:
+                data = np.where(data <= 0.0, 0.0, data)
+            frames[row] = data
+        del frames
+    finally:
+        shm.close()
+
+
+def _pool_context():
+    # fork lets the workers start without re-importing the calling script,
+    # which matters for the top-level analysis scripts in this repo; but a
+    # process running other threads (Streamlit, a watcher thread) must not
+    # fork, as locks those threads hold stay locked in the workers
+    methods = multiprocessing.get_all_start_methods()
+    if 'fork' in methods and threading.active_count() == 1:
+        return multiprocessing.get_context('fork')
+    for method in ('forkserver', 'spawn'):
+        if method in methods:
+            return multiprocessing.get_context(method)
+    return multiprocessing.get_context()
+
+
+def load_frames(run_dir, run_name, variable, timesteps, index=(), clip=False, workers=None,
+                mp_context=None):
+    """Load ``variable`` for many timesteps into one array, in parallel.
+
+    Args:
+        run_dir: directory holding the run output
+        run_name: ParFlow run name, e.g. 'Dunne'
+        variable: output name, e.g. 'satur' or 'press'
+        timesteps: iterable of timestep numbers
+        index: (z, y, x) ints/slices selecting the part of each frame to
+            keep, as for ``read_pfb_slice``; the whole grid by default
+        clip: set values <= 0 to 0, as done for the saturation and
+            pressure animations
+        workers: number of worker processes, defaults to the CPU count
+        mp_context: multiprocessing context of the pool; fork if the
+            calling process runs no other threads, else forkserver or spawn
+
+    Returns:
+        (len(timesteps), ...) float64 array of frames
+    """
+    timesteps = list(timesteps)
+    filenames = [pfb_filename(run_dir, run_name, variable, t) for t in timesteps]
+    if not filenames:
+        # shaped like the frames of any timestep the run has
+        steps = list_timesteps(run_dir, run_name, variable)
+        if not steps:
+            raise FileNotFoundError('no {} output for {} in {}'.format(variable, run_name, run_dir))
+        return np.empty((0,) + read_frame(run_dir, run_name, variable, steps[0], index).shape)
+    missing = [not os.path.exists(filename) for filename in filenames]
+    if any(missing):
+        # compacted output: one sequential read of the archive is already
+        # faster than the pool
+        if all(missing):
+            frames = read_archive(archive_filename(run_dir, run_name, variable), timesteps, index)
+        else:
+            frames = np.stack([read_frame(run_dir, run_name, variable, t, index) for t in timesteps])
+        return np.where(frames <= 0.0, 0.0, frames) if clip else frames
+    header = read_pfb_header(filenames[0])
+    frame_shape = read_pfb_slice(filenames[0], index, header).shape
+    shape = (len(filenames),) + frame_shape
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(filenames)))
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, 8 * int(np.prod(shape))))
+    try:
+        ntasks = min(len(filenames), workers * _TASKS_PER_WORKER)
+        with ProcessPoolExecutor(workers, mp_context=mp_context or _pool_context()) as pool:
+            futures = [pool.submit(_load_into, shm.name, shape, rows,
+                                   [filenames[row] for row in rows], index, header, clip)
+                       for rows in np.array_split(np.arange(len(filenames)), ntasks)]
+            for future in futures:
+                future.result()
+        frames = np.ndarray(shape, dtype=np.float64, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return frames
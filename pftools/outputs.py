@@ -0,0 +1,138 @@
+"""Plan the output of a run from the quantities that will be analysed.
+
+``plan_outputs`` turns a list of derived quantities ('LH', 'SWE', 'ET',
+'runoff', ...) into the ParFlow print keys they need, switches every other
+PFB, SILO and CLM binary output off, and estimates the number of files and
+bytes the run will write::
+
+    plan = plan_outputs(run, ['LH', 'SWE', 'ET', 'runoff'])
+    print(format_plan(plan))
+"""
+from pftools.clm import CLM_LAYERS
+
+# print key -> (output name, per timestep, layers); layers is 'nz' for a
+# full 3D grid, 'clm' for the CLM layers or a number of layers
+_PRINT_OUTPUTS = {
+    'Solver.PrintPressure': [('press', True, 'nz')],
+    'Solver.PrintSaturation': [('satur', True, 'nz')],
+    'Solver.PrintCLM': [('clm_output', True, 'clm')],
+    'Solver.PrintEvapTrans': [('evaptrans', True, 'nz')],
+    'Solver.PrintEvapTransSum': [('evaptranssum', True, 'nz')],
+    'Solver.PrintOverlandSum': [('overlandsum', True, 1)],
+    'Solver.PrintLSMSink': [('lsm_sink', True, 'nz')],
+    'Solver.PrintSubsurfData': [('perm_x', False, 'nz'), ('perm_y', False, 'nz'),
+                                ('perm_z', False, 'nz'), ('porosity', False, 'nz')],
+    'Solver.PrintSpecificStorage': [('specific_storage', False, 'nz')],
+    'Solver.PrintMask': [('mask', False, 'nz')],
+    'Solver.PrintSlopes': [('slope_x', False, 1), ('slope_y', False, 1)],
+    'Solver.PrintMannings': [('mannings', False, 1)],
+}
+
+_CLM = ['Solver.PrintCLM']
+
+# derived quantity -> print keys it is computed from
+QUANTITIES = {
+    'LH': _CLM,
+    'SH': _CLM,
+    'G': _CLM,
+    'LW': _CLM,
+    'ET': _CLM,
+    'transpiration': _CLM,
+    'infiltration': _CLM,
+    'SWE': _CLM,
+    'ground_temperature': _CLM,
+    'soil_temperature': _CLM,
+    'runoff': ['Solver.PrintPressure'],
+    'pressure': ['Solver.PrintPressure'],
+    'saturation': ['Solver.PrintSaturation'],
+    'soil_moisture': ['Solver.PrintSaturation', 'Solver.PrintSubsurfData'],
+    'storage': ['Solver.PrintPressure', 'Solver.PrintSaturation', 'Solver.PrintSubsurfData',
+                'Solver.PrintSpecificStorage', 'Solver.PrintMask'],
+    'overland_flow': ['Solver.PrintPressure', 'Solver.PrintMask'],
+}
+
+# PFB header and subgrid header sizes, see pftools.pfb
+_HEADER_BYTES = 64
+_SUBGRID_HEADER_BYTES = 36
+
+
+def _dist_bytes(subgrids, size):
+    # the .pfb.dist ParFlow writes beside every PFB holds the byte offset of
+    # each rank's subgrids, one decimal number per line; ranks split the
+    # file about evenly
+    data = (size - _HEADER_BYTES) / subgrids
+    return sum(len(str(int(_HEADER_BYTES + i * data) if i else 0)) + 1 for i in range(subgrids))
+
+
+def plan_outputs(run, quantities, dump_interval=None, apply=True):
+    """Set the output keys of ``run`` to what ``quantities`` need.
+
+    Args:
+        run: ``parflow.Run``
+        quantities: names from QUANTITIES
+        dump_interval: output interval in time units for ParFlow and CLM
+            output; the run's TimingInfo.DumpInterval if None
+        apply: set the keys on ``run``; otherwise only report
+
+    Returns:
+        dict with 'keys' (key -> value set), 'outputs' (output name ->
+        (files, bytes)), 'files' and 'bytes' (totals); files and bytes
+        include the ``.pfb.dist`` written beside every PFB
+    """
+    unknown = sorted(set(quantities) - set(QUANTITIES))
+    if unknown:
+        raise ValueError('unknown quantities {}, choose from {}'
+                         .format(', '.join(unknown), ', '.join(sorted(QUANTITIES))))
+    needed = {key for q in quantities for key in QUANTITIES[q]}
+
+    keys = run.to_dict()
+    timestep = float(keys['TimeStep.Value'])
+    if dump_interval is None:
+        dump_interval = float(keys.get('TimingInfo.DumpInterval', timestep))
+        if dump_interval <= 0:
+            dump_interval = timestep
+    settings = {key: key in needed for key in _PRINT_OUTPUTS}
+    # every SILO and CLM binary output is off; the PFBs carry the same data
+    settings.update({key: False for key in keys
+                     if key.startswith('Solver.WriteSilo') or key == 'Solver.WriteCLMBinary'})
+    settings['TimingInfo.DumpInterval'] = dump_interval
+    if 'Solver.PrintCLM' in needed:
+        settings['Solver.CLM.CLMDumpInterval'] = max(1, int(round(dump_interval / timestep)))
+        # the CLM quantities are read from the clm_output file that holds
+        # every CLM variable, not from one file per variable and step
+        settings['Solver.CLM.SingleFile'] = True
+
+    nx = int(keys['ComputationalGrid.NX'])
+    ny = int(keys['ComputationalGrid.NY'])
+    nz = int(keys['ComputationalGrid.NZ'])
+    subgrids = 1
+    for axis in 'PQR':
+        subgrids *= int(keys.get('Process.Topology.' + axis, 1))
+    dumps = int(round((float(keys['TimingInfo.StopTime']) - float(keys['TimingInfo.StartTime']))
+                      / dump_interval))
+
+    outputs = {}
+    for key in sorted(needed):
+        for name, per_step, layers in _PRINT_OUTPUTS[key]:
+            layers = {'nz': nz, 'clm': len(CLM_LAYERS)}.get(layers, layers)
+            size = _HEADER_BYTES + subgrids * _SUBGRID_HEADER_BYTES + 8 * nx * ny * layers
+            size += _dist_bytes(subgrids, size)
+            # ParFlow also writes timestep 0, CLM starts at its first step
+            pfbs = (dumps + (name != 'clm_output')) if per_step else 1
+            outputs[name] = (2 * pfbs, pfbs * size)
+
+    if apply:
+        for key, value in settings.items():
+            run.pfset(key=key, value=value)
+    return dict(keys=settings, outputs=outputs,
+                files=sum(f for f, _ in outputs.values()),
+                bytes=sum(b for _, b in outputs.values()))
+
+
+def format_plan(plan):
+    """Human readable summary of a plan from ``plan_outputs``."""
+    lines = ['{:<18s} {:>8s} {:>12s}'.format('output', 'files', 'MB')]
+    for name, (files, nbytes) in sorted(plan['outputs'].items()):
+        lines.append('{:<18s} {:>8d} {:>12.2f}'.format(name, files, nbytes / 1e6))
+    lines.append('{:<18s} {:>8d} {:>12.2f}'.format('total', plan['files'], plan['bytes'] / 1e6))
+    return '\n'.join(lines)
@@ -0,0 +1,152 @@
+"""Vectorized overland flow and outlet hydrographs.
+
+The kernel follows ParFlow's original kinematic ``OverlandFlow`` boundary
+condition: with ponded depth h = max(p_top, 0) in the top active cell, the
+flux per unit width in x is
+
+    qx = -sign(Sx) * sqrt(|Sx|) / n * h**(5/3)
+
+(and likewise in y), so a positive slope drains toward lower x.  Fluxes are
+returned as volumetric rates, i.e. multiplied by the cell width, in the
+run's length and time units (m^3/h for the Dunne cases).  Every function
+works on a whole (time, y, x) stack at once.
+"""
+import argparse
+import os
+
+import numpy as np
+
+from pftools.config import constant_value, run_keys
+from pftools.pfb import read_pfb
+from pftools.timeseries import list_timesteps, read_timeseries
+
+
+def top_layer(mask):
+    """Index of the top active cell of every (y, x) column of a 3D mask, -1 if none."""
+    active = np.asarray(mask) > 0
+    nz = active.shape[0]
+    top = nz - 1 - np.argmax(active[::-1], axis=0)
+    return np.where(active.any(axis=0), top, -1)
+
+
+def read_surface_pressure(run_dir, run_name, timesteps, mask):
+    """Read the pressure of the top active cell of every column over time.
+
+    Only the top cells are read from each ``press`` PFB.  Returns a
+    (len(timesteps), ny, nx) array that is 0 in columns without active cells.
+    """
+    top = top_layer(mask)
+    jj, ii = np.nonzero(top >= 0)
+    surface = np.zeros((len(timesteps),) + top.shape)
+    surface[:, jj, ii] = read_timeseries(run_dir, run_name, 'press',
+                                         np.stack([top[jj, ii], jj, ii], axis=1), timesteps)
+    return surface
+
+
+def load_surface_parameters(run_dir, run_name, slope_x=None, slope_y=None, mannings=None):
+    """Slopes and Manning's n of a run as (ny, nx) arrays or scalars.
+
+    The ``slope_x``, ``slope_y`` and ``mannings`` PFBs ParFlow writes with
+    PrintSlopes / PrintMannings are used when present; otherwise the value
+    passed in (typically the run's constant ``TopoSlopesX.Geom.domain.Value``
+    etc.) is returned.  Note ``<run>.out.n.pfb`` is the van Genuchten n, not
+    Manning's n.
+    """
+    fields = []
+    for name, default in (('slope_x', slope_x), ('slope_y', slope_y), ('mannings', mannings)):
+        filename = os.path.join(run_dir, '{}.out.{}.pfb'.format(run_name, name))
+        if os.path.exists(filename):
+            fields.append(read_pfb(filename)[0])
+        elif default is not None:
+            fields.append(default)
+        else:
+            raise FileNotFoundError('{} not found and no default given'.format(filename))
+    return tuple(fields)
+
+
+def overland_flow(surface_pressure, slope_x, slope_y, mannings, dx, dy, active=None):
+    """Per-cell overland fluxes and the outlet hydrograph for every timestep.
+
+    Args:
+        surface_pressure: (nt, ny, nx) top-cell pressures, see
+            ``read_surface_pressure``
+        slope_x, slope_y, mannings: scalars or (ny, nx) arrays
+        dx, dy: cell sizes
+        active: (ny, nx) bool array of columns in the domain, all if None
+
+    Returns:
+        qx, qy: (nt, ny, nx) volumetric fluxes in x and y
+        outflow: (nt,) flow leaving the active surface across its edges
+    """
+    p = np.asarray(surface_pressure, dtype=np.float64)
+    ny, nx = p.shape[1:]
+    if active is None:
+        active = np.ones((ny, nx), dtype=bool)
+    sx = np.broadcast_to(np.asarray(slope_x, dtype=np.float64), (ny, nx))
+    sy = np.broadcast_to(np.asarray(slope_y, dtype=np.float64), (ny, nx))
+    n = np.broadcast_to(np.asarray(mannings, dtype=np.float64), (ny, nx))
+
+    depth = np.where(active, np.maximum(p, 0.0), 0.0) ** (5.0 / 3.0)
+    qx = -np.sign(sx) * np.sqrt(np.abs(sx)) / n * depth * dy
+    qy = -np.sign(sy) * np.sqrt(np.abs(sy)) / n * depth * dx
+
+    # a cell drains out of the domain when the neighbour it flows toward is
+    # outside the grid or inactive
+    padded = np.pad(active, 1, constant_values=False)
+    edge_x_lower = active & ~padded[1:-1, :-2]
+    edge_x_upper = active & ~padded[1:-1, 2:]
+    edge_y_lower = active & ~padded[:-2, 1:-1]
+    edge_y_upper = active & ~padded[2:, 1:-1]
+    outflow = (np.where(edge_x_lower, np.maximum(-qx, 0.0), 0.0)
+               + np.where(edge_x_upper, np.maximum(qx, 0.0), 0.0)
+               + np.where(edge_y_lower, np.maximum(-qy, 0.0), 0.0)
+               + np.where(edge_y_upper, np.maximum(qy, 0.0), 0.0)).sum(axis=(1, 2))
+    return qx, qy, outflow
+
+
+def run_hydrograph(run_dir, run_name, timesteps, dx, dy, slope_x=None, slope_y=None, mannings=None):
+    """Outlet hydrograph of a run, reading only what the kernel needs.
+
+    Uses ``<run>.out.mask.pfb`` for the surface, the top-cell pressures of
+    every timestep and ``load_surface_parameters`` for slopes and Manning's
+    n.  Returns (outflow, qx, qy) as from ``overland_flow``.
+    """
+    mask = read_pfb(os.path.join(run_dir, '{}.out.mask.pfb'.format(run_name)))
+    timesteps = list(timesteps)
+    surface = read_surface_pressure(run_dir, run_name, timesteps, mask)
+    sx, sy, n = load_surface_parameters(run_dir, run_name, slope_x, slope_y, mannings)
+    qx, qy, outflow = overland_flow(surface, sx, sy, n, dx, dy, active=top_layer(mask) >= 0)
+    return outflow, qx, qy
+
+
+def keyed_hydrograph(run_dir, run_name):
+    """Timesteps and outlet hydrograph of a finished run, configured from its keys.
+
+    Grid spacing, slopes and Manning's n are taken from the ``.pfidb`` the
+    run left in ``run_dir`` (or from its slope / Manning's PFBs).
+    """
+    keys = run_keys(run_dir, run_name)
+    timesteps = list_timesteps(run_dir, run_name, 'press')
+    outflow = run_hydrograph(run_dir, run_name, timesteps,
+                             float(keys['ComputationalGrid.DX']), float(keys['ComputationalGrid.DY']),
+                             constant_value(keys, 'TopoSlopesX'), constant_value(keys, 'TopoSlopesY'),
+                             constant_value(keys, 'Mannings'))[0]
+    return np.array(timesteps), outflow
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write the outlet hydrograph of a run as CSV.')
+    parser.add_argument('run_dir')
+    parser.add_argument('run_name')
+    parser.add_argument('--dx', type=float, required=True)
+    parser.add_argument('--dy', type=float, required=True)
+    parser.add_argument('--slope-x', type=float, default=None)
+    parser.add_argument('--slope-y', type=float, default=None)
+    parser.add_argument('--mannings', type=float, default=None)
+    args = parser.parse_args()
+    timesteps = list_timesteps(args.run_dir, args.run_name, 'press')
+    outflow = run_hydrograph(args.run_dir, args.run_name, timesteps, args.dx, args.dy,
+                             args.slope_x, args.slope_y, args.mannings)[0]
+    print('timestep,outflow')
+    for timestep, q in zip(timesteps, outflow):
+        print('{},{:g}'.format(timestep, q))
@@ -0,0 +1,195 @@
+"""Lightweight readers for ParFlow binary (PFB) files.
+
+A PFB file is a big-endian header (grid origin, size and spacing plus the
+number of subgrids) followed by one block per subgrid: nine int32 values
+(ix, iy, iz, nx, ny, nz, rx, ry, rz) and then the subgrid values as float64
+with x varying fastest.  Since the layout is fixed, the byte offset of any
+cell follows from the header alone, which is what lets these readers pull
+single cells out of a file without loading the whole grid.
+
+Arrays and indices use the same (z, y, x) order as
+``PFData.getDataAsArray()``.
+"""
+import operator
+import struct
+
+import numpy as np
+
+_HEADER = struct.Struct('>3d3i3di')
+_SUBGRID_HEADER = struct.Struct('>9i')
+
+# reading through a gap this small is cheaper than another seek + read
+_MAX_GAP = 64 * 1024
+
+
+def read_pfb_header(filename):
+    """Read the header and subgrid table of a PFB file.
+
+    Returns a dict with the grid origin ('x', 'y', 'z'), size ('nx', 'ny',
+    'nz') and spacing ('dx', 'dy', 'dz'), plus 'subgrids', an
+    (n_subgrids, 7) int64 array holding ix, iy, iz, nx, ny, nz and the byte
+    offset of the first value of each subgrid.
+    """
+    with open(filename, 'rb') as f:
+        x, y, z, nx, ny, nz, dx, dy, dz, n_subgrids = _HEADER.unpack(f.read(_HEADER.size))
+        subgrids = np.zeros((n_subgrids, 7), dtype=np.int64)
+        offset = _HEADER.size
+        for isub in range(n_subgrids):
+            f.seek(offset)
+            ix, iy, iz, snx, sny, snz = _SUBGRID_HEADER.unpack(f.read(_SUBGRID_HEADER.size))[:6]
+            offset += _SUBGRID_HEADER.size
+            subgrids[isub] = (ix, iy, iz, snx, sny, snz, offset)
+            offset += 8 * snx * sny * snz
+    return dict(x=x, y=y, z=z, nx=nx, ny=ny, nz=nz, dx=dx, dy=dy, dz=dz,
+                subgrids=subgrids)
+
+
+def pfb_size(header):
+    """Size in bytes of a PFB file with the given header."""
+    sg = header['subgrids']
+    if not len(sg):
+        return _HEADER.size
+    last = sg[-1]
+    return int(last[6] + 8 * last[3] * last[4] * last[5])
+
+
+def pfb_cell_offsets(header, indices):
+    """Byte offsets of the (z, y, x) cells in ``indices`` within a PFB file."""
+    idx = np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+    k, j, i = idx[:, 0], idx[:, 1], idx[:, 2]
+    if ((k < 0) | (k >= header['nz']) | (j < 0) | (j >= header['ny'])
+            | (i < 0) | (i >= header['nx'])).any():
+        raise IndexError('cell index outside the {nz}x{ny}x{nx} grid'.format(**header))
+
+    sg = header['subgrids']
+    inside = ((i[:, None] >= sg[:, 0]) & (i[:, None] < sg[:, 0] + sg[:, 3])
+              & (j[:, None] >= sg[:, 1]) & (j[:, None] < sg[:, 1] + sg[:, 4])
+              & (k[:, None] >= sg[:, 2]) & (k[:, None] < sg[:, 2] + sg[:, 5]))
+    s = sg[inside.argmax(axis=1)]
+    return s[:, 6] + 8 * (((k - s[:, 2]) * s[:, 4] + (j - s[:, 1])) * s[:, 3] + (i - s[:, 0]))
+
+
+def _gather(f, offsets):
+    # read the float64 values at the given byte offsets, coalescing nearby
+    # offsets into a single read
+    order = np.argsort(offsets, kind='stable')
+    ordered = offsets[order]
+    out = np.empty(len(offsets))
+    breaks = np.flatnonzero(np.diff(ordered) > _MAX_GAP) + 1
+    for group in np.split(np.arange(len(ordered)), breaks):
+        lo = ordered[group[0]]
+        hi = ordered[group[-1]] + 8
+        f.seek(lo)
+        buf = f.read(hi - lo)
+        if len(buf) < hi - lo:
+            raise EOFError('{} is truncated'.format(f.name))
+        rel = ordered[group] - lo
+        if (rel % 8).any():
+            # the group spans a subgrid header, which is not a multiple of
+            # 8 bytes long, so pick the values out byte by byte
+            raw = np.frombuffer(buf, dtype=np.uint8)
+            values = raw[rel[:, None] + np.arange(8)].copy().view('>f8').ravel()
+        else:
+            values = np.frombuffer(buf[:len(buf) // 8 * 8], dtype='>f8')[rel // 8]
+        out[order[group]] = values
+    return out
+
+
+def read_pfb_points(filename, indices, header=None):
+    """Read the values of the (z, y, x) cells in ``indices`` from a PFB file.
+
+    ``header`` may be passed to skip re-reading it when many files share the
+    same grid and subgrid layout, as all outputs of one run do.
+    """
+    if header is None:
+        header = read_pfb_header(filename)
+    offsets = pfb_cell_offsets(header, indices)
+    with open(filename, 'rb') as f:
+        return _gather(f, offsets)
+
+
+def _index_ranges(index, shape):
+    # turn a numpy-style (z, y, x) index of ints and unit-step slices into
+    # [start, stop) ranges, plus a flag per axis telling whether it is kept
+    if not isinstance(index, tuple):
+        index = (index,)
+    if len(index) > 3:
+        raise IndexError('too many indices for a 3D PFB grid')
+    index = index + (slice(None),) * (3 - len(index))
+    ranges = []
+    keep = []
+    for ix, n in zip(index, shape):
+        if isinstance(ix, slice):
+            start, stop, step = ix.indices(n)
+            if step != 1:
+                raise ValueError('only unit-step slices are supported')
+            ranges.append((start, max(start, stop)))
+            keep.append(True)
+        else:
+            ix = operator.index(ix)
+            if ix < 0:
+                ix += n
+            if not 0 <= ix < n:
+                raise IndexError('index {} is out of bounds for axis of size {}'.format(ix, n))
+            ranges.append((ix, ix + 1))
+            keep.append(False)
+    return ranges, keep
+
+
+def read_pfb_slice(filename, index=(), header=None):
+    """Read a point, column, plane or box of a PFB file.
+
+    ``index`` is a (z, y, x) tuple of ints and unit-step slices, interpreted
+    like numpy indexing of ``PFData.getDataAsArray()``, so for instance::
+
+        read_pfb_slice(f, (19, 0, 0))                      # one cell
+        read_pfb_slice(f, (slice(None), 0, 0))             # a column
+        read_pfb_slice(f, (299,))                          # a z-plane
+        read_pfb_slice(f, (slice(None), 0, slice(None)))   # data_arr[:,0,:]
+
+    Only the subgrids overlapping the requested box are touched, and within
+    each only the bytes of the box (plus small gaps that are cheaper to read
+    through than to seek over) are read.
+    """
+    if header is None:
+        header = read_pfb_header(filename)
+    ranges, keep = _index_ranges(index, (header['nz'], header['ny'], header['nx']))
+    (k0, k1), (j0, j1), (i0, i1) = ranges
+    out = np.empty((k1 - k0, j1 - j0, i1 - i0))
+
+    with open(filename, 'rb') as f:
+        for ix, iy, iz, snx, sny, snz, start in header['subgrids']:
+            ka, kb = max(k0, iz), min(k1, iz + snz)
+            ja, jb = max(j0, iy), min(j1, iy + sny)
+            ia, ib = max(i0, ix), min(i1, ix + snx)
+            if ka >= kb or ja >= jb or ia >= ib:
+                continue
+            kk = np.arange(ka, kb)[:, None, None] - iz
+            jj = np.arange(ja, jb)[None, :, None] - iy
+            ii = np.arange(ia, ib)[None, None, :] - ix
+            offsets = start + 8 * ((kk * sny + jj) * snx + ii)
+            out[ka - k0:kb - k0, ja - j0:jb - j0, ia - i0:ib - i0] = \
+                _gather(f, offsets.ravel()).reshape(offsets.shape)
+
+    return out[tuple(slice(None) if k else 0 for k in keep)]
+
+
+def read_pfb(filename):
+    """Read a whole PFB file into a (nz, ny, nx) array."""
+    return read_pfb_slice(filename)
+
+
+def write_pfb(filename, data, x=0.0, y=0.0, z=0.0, dx=1.0, dy=1.0, dz=1.0):
+    """Write a (nz, ny, nx) array as a PFB file with a single subgrid.
+
+    ``x``, ``y``, ``z`` are the lower corner of the grid and ``dx``, ``dy``,
+    ``dz`` the cell sizes, as in the header ``read_pfb_header`` returns.
+    """
+    data = np.asarray(data, dtype='>f8')
+    if data.ndim != 3:
+        raise ValueError('expected a (nz, ny, nx) array, got shape {}'.format(data.shape))
+    nz, ny, nx = data.shape
+    with open(filename, 'wb') as f:
+        f.write(_HEADER.pack(x, y, z, nx, ny, nz, dx, dy, dz, 1))
+        f.write(_SUBGRID_HEADER.pack(0, 0, 0, nx, ny, nz, 0, 0, 0))
+        f.write(np.ascontiguousarray(data).tobytes())
@@ -0,0 +1,409 @@
+"""ParFlow solid files (``.pfsol``): reading, checking and rasterizing.
+
+A solid file is plain text: a version line, the number of vertices and
+their x y z coordinates, the number of solids, and for every solid the
+number of triangles and their vertex indices, followed by the number of
+patches and, for every patch, its number of triangles and their indices.
+Patches are matched to the names in ``Geom.<name>.Patches`` by position.
+
+``check_solid`` finds the mistakes that otherwise only show up in a failed
+or wrong run: holes in the surface, inconsistently or inward oriented
+triangles and triangles in no or several patches.  ``solid_masks``
+rasterizes a solid and its patches onto a computational grid, a cell being
+inside when its centre is, and caches the masks next to the solid file::
+
+    python -m pftools.pfsol overland/tuff.pfsol --grid 20 1 300 --spacing 5 1 0.05
+"""
+import argparse
+import os
+
+import numpy as np
+
+from pftools.cache import content_hash
+
+# (triangle, column) pairs tested at once while rasterizing
+_CHUNK_PAIRS = 1 << 22
+
+# every cell centre is taken as moved by an infinitesimal step along -z,
+# then a far smaller one along +x and a yet smaller one along -y, as
+# (axis, direction) pairs.  No centre then lies on a triangle or an edge,
+# and the rays along x, y and z all agree on which side of the surface a
+# centre is, so the patches cover exactly the faces of the solid's mask
+_NUDGE = [(2, -1.0), (0, 1.0), (1, -1.0)]
+
+# bumped whenever the rasterization changes, so stale cached masks are not reused
+_CACHE_VERSION = 2
+
+
+def read_pfsol(filename):
+    """Read a solid file.
+
+    Returns:
+        (vertices, solids): an (n, 3) array of x, y, z coordinates and a
+        list with a dict per solid holding 'triangles', an (m, 3) array of
+        vertex indices, and 'patches', a list of arrays of triangle indices
+    """
+    with open(filename) as f:
+        tokens = f.read().split()
+    nvertices = int(tokens[1])
+    vertices = np.array(tokens[2:2 + 3 * nvertices], dtype=float).reshape(nvertices, 3)
+    values = np.array(tokens[2 + 3 * nvertices:], dtype=np.int64)
+    solids = []
+    pos = 1
+    for _ in range(values[0]):
+        ntriangles = values[pos]
+        triangles = values[pos + 1:pos + 1 + 3 * ntriangles].reshape(ntriangles, 3)
+        pos += 1 + 3 * ntriangles
+        patches = []
+        for _ in range(values[pos]):
+            count = values[pos + 1]
+            patches.append(values[pos + 2:pos + 2 + count])
+            pos += 1 + count
+        pos += 1
+        solids.append(dict(triangles=triangles, patches=patches))
+    if pos != len(values):
+        raise ValueError('{} has {} values after its last patch'.format(filename, len(values) - pos))
+    return vertices, solids
+
+
+def write_pfsol(filename, vertices, triangles, patches):
+    """Write a single solid.
+
+    Args:
+        vertices: (n, 3) x, y, z coordinates
+        triangles: (m, 3) vertex indices, counter-clockwise seen from
+            outside the solid
+        patches: list of lists of triangle indices, in the order of the
+            solid's patch names
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    triangles = np.asarray(triangles, dtype=int)
+    with open(filename, 'w') as f:
+        f.write('1\n{}\n'.format(len(vertices)))
+        for x, y, z in vertices:
+            f.write('{:.6f} {:.6f} {:.6f}\n'.format(x, y, z))
+        f.write('1\n{}\n'.format(len(triangles)))
+        for a, b, c in triangles:
+            f.write('{} {} {}\n'.format(a, b, c))
+        f.write('{}\n'.format(len(patches)))
+        for patch in patches:
+            f.write('{}\n{}\n'.format(len(patch), ' '.join(str(t) for t in patch)))
+
+
+def _split_edges(vertices, edges):
+    # edges that are not shared by two triangles split at the vertices of
+    # other such edges lying on them, so a triangle edge running past the
+    # corner of two smaller triangles (as the sides of tuff.pfsol do along
+    # the surface) matches their edges
+    undirected, inverse, counts = np.unique(np.sort(edges, axis=1), axis=0, return_inverse=True,
+                                            return_counts=True)
+    odd = counts[inverse.ravel()] != 2
+    if not odd.any():
+        return edges
+    candidates = np.unique(edges[odd])
+    points = vertices[candidates]
+    split = [edges[~odd]]
+    for a, b in edges[odd]:
+        direction = vertices[b] - vertices[a]
+        length2 = direction @ direction
+        offsets = points - vertices[a]
+        t = offsets @ direction / length2
+        distance2 = np.einsum('ij,ij->i', offsets, offsets) - t * t * length2
+        on_edge = (t > 1e-9) & (t < 1 - 1e-9) & (distance2 <= 1e-12 * length2)
+        chain = np.concatenate([[a], candidates[on_edge][np.argsort(t[on_edge])], [b]])
+        split.append(np.stack([chain[:-1], chain[1:]], axis=1))
+    return np.concatenate(split)
+
+
+def check_solid(vertices, triangles, patches, patch_names=None):
+    """Problems of one solid, as a list of messages; empty if there are none.
+
+    Checks that the vertex indices exist, that no triangle is degenerate,
+    that the surface is closed (every edge shared by exactly two
+    triangles), that neighbouring triangles are oriented alike and
+    outwards (counter-clockwise seen from outside, so the enclosed volume
+    is positive), that every triangle is in exactly one patch and, if
+    ``patch_names`` is given, that there is a patch for every name.
+    """
+    triangles = np.asarray(triangles)
+    if triangles.size and (triangles.min() < 0 or triangles.max() >= len(vertices)):
+        return ['vertex indices outside 0-{}'.format(len(vertices) - 1)]
+    problems = []
+    a, b, c = (vertices[triangles[:, i]] for i in range(3))
+    cross = np.cross(b - a, c - a)
+    degenerate = np.flatnonzero(np.linalg.norm(cross, axis=1) == 0)
+    if len(degenerate):
+        problems.append('degenerate triangles {}'.format(degenerate.tolist()))
+
+    # directed edges; a closed, consistently oriented surface has every
+    # edge once in each direction
+    edges = _split_edges(vertices, np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]],
+                                                   triangles[:, [2, 0]]]))
+    directed, directed_counts = np.unique(edges, axis=0, return_counts=True)
+    undirected, counts = np.unique(np.sort(edges, axis=1), axis=0, return_counts=True)
+    open_edges = undirected[counts == 1]
+    if len(open_edges):
+        problems.append('not closed, {} edges have one triangle, e.g. {}'
+                        .format(len(open_edges), open_edges[0].tolist()))
+    shared = undirected[counts > 2]
+    if len(shared):
+        problems.append('{} edges have more than two triangles, e.g. {}'
+                        .format(len(shared), shared[0].tolist()))
+    flipped = directed[directed_counts > 1]
+    if len(flipped):
+        problems.append('inconsistent orientation, {} edges run the same way in two triangles, e.g. {}'
+                        .format(len(flipped), flipped[0].tolist()))
+    elif not len(open_edges):
+        volume = np.einsum('ij,ij->', a, np.cross(b, c)) / 6
+        if volume <= 0:
+            problems.append('triangles face inwards (enclosed volume {:g})'.format(volume))
+
+    in_patches = np.bincount(np.concatenate(patches).astype(np.int64) if patches else np.zeros(0, int),
+                             minlength=len(triangles))
+    if len(in_patches) > len(triangles):
+        problems.append('patches list triangles that do not exist')
+    elif (in_patches != 1).any():
+        problems.append('triangles in no patch {}, in several patches {}'.format(
+            np.flatnonzero(in_patches == 0).tolist(), np.flatnonzero(in_patches > 1).tolist()))
+    if patch_names is not None and len(patch_names) != len(patches):
+        problems.append('{} patches for {} patch names'.format(len(patches), len(patch_names)))
+    return problems
+
+
+def computational_grid(keys):
+    """The computational grid of a dict of run keys.
+
+    Returns a dict with the lower corner 'x', 'y', 'z', the size 'nx',
+    'ny', 'nz' and the spacing 'dx', 'dy', 'dz', as ``read_pfb_header``.
+    """
+    grid = {}
+    for axis in 'XYZ':
+        grid[axis.lower()] = float(keys['ComputationalGrid.Lower.' + axis])
+        grid['n' + axis.lower()] = int(keys['ComputationalGrid.N' + axis])
+        grid['d' + axis.lower()] = float(keys['ComputationalGrid.D' + axis])
+    return grid
+
+
+def _crossings(vertices, triangles, grid, axis):
+    # crossings of the rays through the cell centres along ``axis`` (0, 1,
+    # 2 for x, y, z) with the triangles: (ray, position along the ray,
+    # triangle, index of the first cell whose centre is past the crossing,
+    # 0 to n).  Rays are numbered over the other two axes, the later one
+    # fastest.  Ties are broken by _NUDGE, so a ray through a shared edge
+    # crosses only one of the triangles
+    u, v = [i for i in range(3) if i != axis]
+    nudge = [(a, d) for a, d in _NUDGE if a != axis]
+    lower = np.array([grid['x'], grid['y'], grid['z']])
+    size = np.array([grid['nx'], grid['ny'], grid['nz']])
+    spacing = np.array([grid['dx'], grid['dy'], grid['dz']])
+    corners = vertices[triangles]
+    # first and last cell centre in each triangle's bounding box
+    low = np.ceil((corners[:, :, [u, v]].min(axis=1) - lower[[u, v]]) / spacing[[u, v]] - 0.5)
+    high = np.floor((corners[:, :, [u, v]].max(axis=1) - lower[[u, v]]) / spacing[[u, v]] - 0.5)
+    low = np.maximum(low, 0).astype(np.int64)
+    high = np.minimum(high, size[[u, v]] - 1).astype(np.int64)
+    extent = np.maximum(high - low + 1, 0)
+    counts = extent[:, 0] * extent[:, 1]
+
+    rays, positions, crossed, first_past = [], [], [], []
+    ends = np.cumsum(counts)
+    start = 0
+    while start < len(triangles):
+        stop = max(start + 1, int(np.searchsorted(ends, ends[start] - counts[start] + _CHUNK_PAIRS, 'right')))
+        tri = np.repeat(np.arange(start, stop), counts[start:stop])
+        offset = np.arange(len(tri)) - np.repeat(ends[start:stop] - counts[start:stop] - (ends[start] - counts[start]),
+                                                  counts[start:stop])
+        iu = low[tri, 0] + offset // extent[tri, 1]
+        iv = low[tri, 1] + offset % extent[tri, 1]
+        pu = lower[u] + (iu + 0.5) * spacing[u]
+        pv = lower[v] + (iv + 0.5) * spacing[v]
+        start = stop
+
+        # edge functions, computed from the lower vertex index of each edge
+        # so that a shared edge gives exactly opposite values
+        weights = []
+        for i, j in ((1, 2), (2, 0), (0, 1)):
+            first, second = triangles[tri, i], triangles[tri, j]
+            sign = np.where(first < second, 1.0, -1.0)
+            lo = np.where(first < second, first, second)
+            hi = np.where(first < second, second, first)
+            eu = vertices[hi, u] - vertices[lo, u]
+            ev = vertices[hi, v] - vertices[lo, v]
+            w = sign * (eu * (pv - vertices[lo, v]) - ev * (pu - vertices[lo, u]))
+            weights.append((w, sign * eu, sign * ev))
+        area = weights[0][0] + weights[1][0] + weights[2][0]
+        orientation = np.sign(area)
+        inside = area != 0
+        for w, eu, ev in weights:
+            eu, ev = eu * orientation, ev * orientation
+            # change of the edge function when the centre is nudged
+            first, second = [eu * d if a == v else -ev * d for a, d in nudge]
+            inside &= (w * orientation > 0) | ((w == 0) & ((first > 0) | ((first == 0) & (second > 0))))
+        tri, iu, iv = tri[inside], iu[inside], iv[inside]
+        area = area[inside]
+        position = sum(w[inside] * corners[tri, k, axis] for (w, _, _), k in zip(weights, range(3))) / area
+        # the centres next to the crossing are placed by the side of the
+        # triangle's plane they are on, computed the same way for every ray
+        # axis; a centre on the plane is past it when the nudge moves it
+        # there: the first nonzero of the nudge along the ray and the
+        # plane's rise under the nudges across it
+        normal = np.cross(corners[tri, 1] - corners[tri, 0], corners[tri, 2] - corners[tri, 0])
+        towards = np.sign(normal[:, axis])
+        nudged = np.zeros(len(tri))
+        for a, d in _NUDGE:
+            step = np.full(len(tri), d) if a == axis else d * normal[:, a] / normal[:, axis]
+            nudged = np.where(nudged == 0, step, nudged)
+        centre = np.empty((len(tri), 3))
+        centre[:, u], centre[:, v] = pu[inside], pv[inside]
+
+        def is_past(k):
+            centre[:, axis] = lower[axis] + (k + 0.5) * spacing[axis]
+            side = (normal * (centre - corners[tri, 0])).sum(axis=1) * towards
+            return (side > 0) | ((side == 0) & (nudged > 0))
+
+        k = np.floor((position - lower[axis]) / spacing[axis] - 0.5).astype(np.int64) + 1
+        k = np.where(is_past(k - 1), k - 1, np.where(is_past(k), k, k + 1))
+        rays.append(iu * size[v] + iv)
+        positions.append(position)
+        crossed.append(tri)
+        first_past.append(np.clip(k, 0, size[axis]))
+    if not rays:
+        return np.zeros(0, np.int64), np.zeros(0), np.zeros(0, np.int64), np.zeros(0, np.int64)
+    return np.concatenate(rays), np.concatenate(positions), np.concatenate(crossed), np.concatenate(first_past)
+
+
+def rasterize_solid(vertices, triangles, grid):
+    """(nz, ny, nx) boolean mask of the cells whose centres are inside a solid.
+
+    Rays through the cell centres along z are crossed with all triangles
+    at once; a centre is inside when an odd number of crossings lie below
+    it.
+    """
+    nx, ny, nz = grid['nx'], grid['ny'], grid['nz']
+    rays, _, _, k = _crossings(vertices, triangles, grid, 2)
+    # one byte per cell: flip the parity at each crossing, then carry it up
+    # each column
+    parity = np.zeros((nx, ny, nz + 1), dtype=np.uint8)
+    np.bitwise_xor.at(parity.reshape(-1), rays * (nz + 1) + k, 1)
+    np.bitwise_xor.accumulate(parity, axis=2, out=parity)
+    return np.ascontiguousarray(parity[:, :, :nz].view(bool).transpose(2, 1, 0))
+
+
+def rasterize_patches(vertices, triangles, patches, grid, mask=None):
+    """Boolean (nz, ny, nx) masks of the cells on each patch of a solid.
+
+    A cell inside the solid is on a patch where a patch triangle separates
+    its centre from that of a neighbour outside the solid, or from the
+    outer face of the grid, along x, y or z.  ``mask`` is the
+    solid's mask, computed if not given.  Raises ValueError if a face of
+    the mask, towards a cell outside the solid or the outer face of the
+    grid, is on no patch: a triangle in no patch, or a solid reaching
+    past the grid.
+    """
+    if mask is None:
+        mask = rasterize_solid(vertices, triangles, grid)
+    patch_of = np.full(len(triangles), -1, dtype=np.int64)
+    for number, patch in enumerate(patches):
+        patch_of[np.asarray(patch, dtype=np.int64)] = number
+    masks = np.zeros((len(patches),) + mask.shape, dtype=bool)
+    lower = [grid['x'], grid['y'], grid['z']]
+    spacing = [grid['dx'], grid['dy'], grid['dz']]
+    size = [grid['nx'], grid['ny'], grid['nz']]
+    # mask indexed (x, y, z) so the ray axis can be moved last
+    xyz = mask.transpose(2, 1, 0)
+    uncovered = []
+    for axis in range(3):
+        rays, positions, crossed, k = _crossings(vertices, triangles, grid, axis)
+        n = size[axis]
+        # crossings on the grid, including its outer faces
+        on_grid = np.abs(positions - lower[axis] - n * spacing[axis] / 2) <= n * spacing[axis] * (0.5 + 1e-9)
+        rays, crossed, k = rays[on_grid], crossed[on_grid], k[on_grid]
+        along = np.moveaxis(xyz, axis, 2).reshape(-1, n)
+        before = (k > 0) & along[rays, np.maximum(k - 1, 0)]
+        after = (k < n) & along[rays, np.minimum(k, n - 1)]
+        keep = (before != after) & (patch_of[crossed] >= 0)
+        # faces of the mask along the rays, before cell 0 to after cell n - 1
+        padded = np.zeros((len(along), n + 2), dtype=bool)
+        padded[:, 1:-1] = along
+        faces = padded[:, 1:] != padded[:, :-1]
+        faces[rays[keep], k[keep]] = False
+        uncovered.append(int(faces.sum()))
+        cell = np.where(before, k - 1, k)[keep]
+        rays, crossed = rays[keep], crossed[keep]
+        u, v = [i for i in range(3) if i != axis]
+        index = [None, None, None]
+        index[axis], index[u], index[v] = cell, rays // size[v], rays % size[v]
+        masks[patch_of[crossed], index[2], index[1], index[0]] = True
+    if any(uncovered):
+        raise ValueError('faces of the mask on no patch: ' + ', '.join(
+            '{} along {}'.format(count, name) for count, name in zip(uncovered, 'xyz') if count))
+    return masks
+
+
+def _cache_filename(filename, grid, solid, cache_dir):
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(filename)), '.pfsol_cache')
+    shape = '{nx}x{ny}x{nz}_{x:g}_{y:g}_{z:g}_{dx:g}_{dy:g}_{dz:g}'.format(**grid)
+    return os.path.join(cache_dir, '{}.{}.{}.{}.v{}.npz'.format(os.path.basename(filename), content_hash(filename),
+                                                              solid, shape, _CACHE_VERSION))
+
+
+def solid_masks(filename, grid, solid=0, cache_dir=None):
+    """Masks of a solid in a solid file and of its patches on ``grid``.
+
+    Args:
+        filename: ``.pfsol`` file
+        grid: dict as returned by ``computational_grid``
+        solid: index of the solid in the file
+        cache_dir: where the masks are cached, ``.pfsol_cache/`` next to
+            the solid file by default; the cache is keyed on the file's
+            content and the grid
+
+    Returns:
+        (mask, patch_masks): a boolean (nz, ny, nx) array and a boolean
+        (npatches, nz, ny, nx) array, in the order of the patches in the file
+    """
+    cache_file = _cache_filename(filename, grid, solid, cache_dir)
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            return cached['mask'], cached['patches']
+    vertices, solids = read_pfsol(filename)
+    triangles, patches = solids[solid]['triangles'], solids[solid]['patches']
+    mask = rasterize_solid(vertices, triangles, grid)
+    patch_masks = rasterize_patches(vertices, triangles, patches, grid, mask)
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    # several processes may build the same masks at once; each writes its
+    # own temporary file and the last rename wins with identical content
+    tmp_file = '{}.{}.tmp.npz'.format(cache_file[:-4], os.getpid())
+    np.savez_compressed(tmp_file, mask=mask, patches=patch_masks)
+    os.replace(tmp_file, cache_file)
+    return mask, patch_masks
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check a ParFlow solid file and rasterize it.')
+    parser.add_argument('pfsol')
+    parser.add_argument('--patches', default=None, help='patch names, e.g. "z_upper x_lower ..."')
+    parser.add_argument('--grid', type=int, nargs=3, metavar=('NX', 'NY', 'NZ'), default=None)
+    parser.add_argument('--spacing', type=float, nargs=3, metavar=('DX', 'DY', 'DZ'), default=[1.0, 1.0, 1.0])
+    parser.add_argument('--lower', type=float, nargs=3, metavar=('X', 'Y', 'Z'), default=[0.0, 0.0, 0.0])
+    args = parser.parse_args()
+
+    vertices, solids = read_pfsol(args.pfsol)
+    names = args.patches.split() if args.patches else None
+    failed = False
+    for number, solid in enumerate(solids):
+        problems = check_solid(vertices, solid['triangles'], solid['patches'], names)
+        print('solid {}: {} triangles, {} patches, {}'.format(
+            number, len(solid['triangles']), len(solid['patches']),
+            'ok' if not problems else '; '.join(problems)))
+        failed = failed or bool(problems)
+        if args.grid and not problems:
+            grid = dict(zip(['x', 'y', 'z', 'nx', 'ny', 'nz', 'dx', 'dy', 'dz'],
+                            args.lower + args.grid + args.spacing))
+            mask, patch_masks = solid_masks(args.pfsol, grid, number)
+            print('  {} of {} cells inside; cells per patch: {}'.format(
+                int(mask.sum()), mask.size,
+                ' '.join('{}={}'.format(names[i] if names else i, int(m.sum()))
+                         for i, m in enumerate(patch_masks))))
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,203 @@
+"""Plotly figures that animate in the browser.
+
+``animated_heatmap`` puts a whole stack of frames into a single figure with
+one ``go.Frame`` per frame, so the figure is sent to the browser once and
+played there instead of re-rendering every frame on the server.  To keep
+the figure small the frames are rounded to a few decimals, which plotly
+encodes as short JSON numbers, and frames and cells can be decimated.
+
+``write_webgl_html`` writes long time-series figures as WebGL traces
+downsampled with ``lttb``, with full resolution restored on zoom.
+"""
+import base64
+import json
+
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+
+
+def decimate(frames, frame_step=1, max_cells=None):
+    """Every ``frame_step``-th frame of a (nt, ny, nx) stack, with the grid
+    strided in y and x so a frame has at most ``max_cells`` cells."""
+    frames = np.asarray(frames)[::frame_step]
+    if max_cells is None:
+        return frames
+    ny, nx = frames.shape[1:]
+    stride = max(1, int(np.ceil(np.sqrt(ny * nx / float(max_cells)))))
+    return frames[:, ::stride, ::stride]
+
+
+def animated_heatmap(frames, zmin=None, zmax=None, frame_step=1, max_cells=None, decimals=3,
+                     colorscale='Blues', title='Timestep {}', duration=50):
+    """Plotly figure playing a (nt, ny, nx) stack of frames as a heatmap.
+
+    Args:
+        frames: (nt, ny, nx) array, row 0 at the bottom as with
+            ``imshow(..., origin='lower')``
+        zmin, zmax: fixed color range for all frames
+        frame_step: keep every ``frame_step``-th frame
+        max_cells: stride the grid so each frame has at most this many cells
+        decimals: values are rounded to this many decimals, which keeps the
+            encoded figure small; they stay float64, as a float32 value
+            is written out with all the digits of its float64 widening
+        colorscale: plotly colorscale name
+        title: format string for the frame title, given the timestep
+        duration: milliseconds per frame when playing
+
+    Returns:
+        a ``go.Figure`` with Play / Pause buttons and a timestep slider
+    """
+    steps = np.arange(len(frames))[::frame_step]
+    z = np.round(np.asarray(decimate(frames, frame_step, max_cells), dtype=np.float64), decimals)
+
+    def heatmap(zi):
+        return go.Heatmap(z=zi, zmin=zmin, zmax=zmax, colorscale=colorscale)
+
+    play = dict(frame=dict(duration=duration, redraw=True), fromcurrent=True,
+                transition=dict(duration=0))
+    pause = dict(frame=dict(duration=0, redraw=False), mode='immediate',
+                 transition=dict(duration=0))
+    slider = dict(active=0, currentvalue=dict(prefix='Timestep '),
+                  steps=[dict(label=str(t), method='animate',
+                              args=[[str(t)], dict(pause, frame=dict(duration=0, redraw=True))])
+                         for t in steps])
+    return go.Figure(
+        data=[heatmap(z[0])],
+        layout=go.Layout(
+            title=title.format(steps[0]),
+            updatemenus=[dict(type='buttons',
+                              buttons=[dict(label='Play', method='animate', args=[None, play]),
+                                       dict(label='Pause', method='animate', args=[[None], pause])])],
+            sliders=[slider]),
+        frames=[go.Frame(data=[heatmap(zi)], name=str(t), layout=go.Layout(title_text=title.format(t)))
+                for t, zi in zip(steps, z)])
+
+
+def lttb(x, y, n_out):
+    """Indices of the points kept by largest-triangle-three-buckets downsampling.
+
+    The first and last points are always kept; the others are split into
+    ``n_out - 2`` buckets and from each the point making the largest
+    triangle with the previously kept point and the mean of the next bucket
+    is kept, which preserves peaks and the shape of the curve.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        nlo, nhi = (edges[b + 1], edges[b + 2]) if b + 2 < len(edges) else (n - 1, n)
+        xc, yc = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - xc) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (yc - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[b + 1] = a
+    return keep
+
+
+def _typed_array(a):
+    # plotly.js (2.28+) typed-array spec: base64 of the raw little-endian values
+    a = np.ascontiguousarray(a, dtype='<f4')
+    return dict(dtype='f4', bdata=base64.b64encode(a.tobytes()).decode('ascii'))
+
+
+# restyles the downsampled traces from the full-resolution data whenever an
+# x axis is zoomed, panned or reset
+_ZOOM_SCRIPT = '''
+(function() {
+  var gd = document.getElementById('{plot_id}');
+  var traces = %(traces)s, maxPoints = %(max_points)d;
+  function decode(b64) {
+    var s = atob(b64), b = new Uint8Array(s.length);
+    for (var i = 0; i < s.length; i++) b[i] = s.charCodeAt(i);
+    return new Float32Array(b.buffer);
+  }
+  function lttb(x, y, lo, hi, n) {
+    var len = hi - lo;
+    if (n >= len || n < 3) return [Array.from(x.subarray(lo, hi)), Array.from(y.subarray(lo, hi))];
+    var xs = [x[lo]], ys = [y[lo]], a = lo, every = (len - 2) / (n - 2);
+    for (var b = 0; b < n - 2; b++) {
+      var s = lo + 1 + Math.floor(b * every), e = lo + 1 + Math.floor((b + 1) * every);
+      var ns = e, ne = Math.min(lo + 1 + Math.floor((b + 2) * every), hi);
+      if (b == n - 3) { ns = hi - 1; ne = hi; }
+      var xc = 0, yc = 0;
+      for (var j = ns; j < ne; j++) { xc += x[j]; yc += y[j]; }
+      xc /= (ne - ns); yc /= (ne - ns);
+      var best = s, area = -1;
+      for (var j = s; j < e; j++) {
+        var t = Math.abs((x[a] - xc) * (y[j] - y[a]) - (x[a] - x[j]) * (yc - y[a]));
+        if (t > area) { area = t; best = j; }
+      }
+      xs.push(x[best]); ys.push(y[best]); a = best;
+    }
+    xs.push(x[hi - 1]); ys.push(y[hi - 1]);
+    return [xs, ys];
+  }
+  function bisect(x, v) {
+    var lo = 0, hi = x.length;
+    while (lo < hi) { var mid = (lo + hi) >> 1; if (x[mid] < v) lo = mid + 1; else hi = mid; }
+    return lo;
+  }
+  traces.forEach(function(t) { t.x = decode(t.x); t.y = decode(t.y); });
+  gd.on('plotly_relayout', function(ev) {
+    traces.forEach(function(t) {
+      var r0 = ev[t.axis + '.range[0]'], r1 = ev[t.axis + '.range[1]'];
+      if (ev[t.axis + '.range']) { r0 = ev[t.axis + '.range'][0]; r1 = ev[t.axis + '.range'][1]; }
+      var lo = 0, hi = t.x.length;
+      if (r0 !== undefined) {
+        lo = Math.max(0, bisect(t.x, r0) - 1);
+        hi = Math.min(t.x.length, bisect(t.x, r1) + 1);
+      } else if (!ev[t.axis + '.autorange']) {
+        return;
+      }
+      var d = lttb(t.x, t.y, lo, hi, maxPoints);
+      Plotly.restyle(gd, {x: [d[0]], y: [d[1]]}, [t.index]);
+    });
+  });
+})();
+'''
+
+
+def write_webgl_html(fig, file, max_points=2000, **kwargs):
+    """Write ``fig`` to HTML with long line traces downsampled and drawn with WebGL.
+
+    Every numeric ``go.Scatter`` trace with more than ``max_points`` points is
+    drawn as a ``go.Scattergl`` of its ``lttb`` downsampled points.  The full
+    resolution data is embedded once and, when an x axis is zoomed, the
+    visible range is downsampled again from it in the browser, so zooming in
+    shows every point.  All trace arrays are written as base64 float32
+    typed arrays, which needs plotly.js 2.28 or newer.  Other keyword
+    arguments are passed to ``plotly.io.write_html``.
+    """
+    fig_dict = fig.to_dict()
+    traces = []
+    for index, trace in enumerate(fig_dict['data']):
+        if trace.get('type') != 'scatter' or 'x' not in trace or 'y' not in trace:
+            continue
+        try:
+            x = np.asarray(trace['x'], dtype=np.float64)
+            y = np.asarray(trace['y'], dtype=np.float64)
+        except (TypeError, ValueError):
+            continue
+        if len(x) > max_points:
+            keep = lttb(x, y, max_points)
+            traces.append(dict(index=index, axis='xaxis' + trace.get('xaxis', 'x')[1:],
+                               x=_typed_array(x)['bdata'], y=_typed_array(y)['bdata']))
+            x, y = x[keep], y[keep]
+            trace['type'] = 'scattergl'
+        trace['x'] = _typed_array(x)
+        trace['y'] = _typed_array(y)
+
+    post_script = kwargs.pop('post_script', None) or []
+    if isinstance(post_script, str):
+        post_script = [post_script]
+    if traces:
+        post_script = [_ZOOM_SCRIPT % dict(traces=json.dumps(traces), max_points=max_points)] + post_script
+    pio.write_html(fig_dict, file=file, validate=False, post_script=post_script or None, **kwargs)
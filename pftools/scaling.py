@@ -0,0 +1,112 @@
+"""Strong and weak scaling curves of the cases in ``pftools.benchmark``.
+
+For strong scaling the case is run unchanged over increasing numbers of
+ranks; for weak scaling the grid is refined along one axis by the number
+of ranks (NX doubles and DX halves for twice the ranks, so the domain and
+its solid file stay the same) to keep the cells per rank constant.  Every
+point gets its topology from ``pftools.topology`` and is run and measured
+like a benchmark.  The curves are written as CSV::
+
+    python -m pftools.scaling dunne --ranks 1 2 4 8 --mode strong weak --stop 1.0
+"""
+import argparse
+import csv
+import os
+
+from pftools.benchmark import load_case, run_measured
+from pftools.topology import grid_size, topology_keys
+
+SCALING_FIELDS = ['case', 'mode', 'ranks', 'P', 'Q', 'R', 'nx', 'ny', 'nz', 'cells_per_rank',
+                  'wall_time', 'solver_time', 'nonlinear_iterations', 'linear_iterations',
+                  'peak_memory_mb', 'speedup', 'efficiency', 'error']
+
+
+def refine_grid(keys, factor, axis='x'):
+    """Grid keys refining the grid in ``keys`` ``factor`` times along ``axis``."""
+    axis = axis.upper()
+    return {'ComputationalGrid.N' + axis: int(keys['ComputationalGrid.N' + axis]) * factor,
+            'ComputationalGrid.D' + axis: float(keys['ComputationalGrid.D' + axis]) / factor}
+
+
+def scaling_curve(case, ranks, mode='strong', root_dir='scaling_runs', stop=None, axis='x'):
+    """Run ``case`` on each number of ``ranks`` and measure it.
+
+    Args:
+        case: name in ``pftools.benchmark.CASES`` or a ``.pfidb`` file
+        ranks: increasing numbers of ranks, the first is the baseline;
+            for weak scaling they should be multiples of the first
+        mode: 'strong' (same grid) or 'weak' (grid refined by the ranks
+            along ``axis``)
+        root_dir: directory the runs are made in
+        stop: stop time, defaults to the case's
+
+    Returns:
+        a list of dicts with the SCALING_FIELDS; 'speedup' and 'efficiency'
+        are relative to the first number of ranks (for weak scaling the
+        speedup is that of the work done per unit time)
+    """
+    if mode not in ('strong', 'weak'):
+        raise ValueError("mode must be 'strong' or 'weak', not {!r}".format(mode))
+    name, keys, inputs = load_case(case, stop)
+    records = []
+    for n in ranks:
+        overrides = refine_grid(keys, n // ranks[0], axis) if mode == 'weak' else {}
+        overrides.update(topology_keys(dict(keys, **overrides), n))
+        nx, ny, nz = grid_size(dict(keys, **overrides))
+        record = dict(case=case, mode=mode, ranks=n, nx=nx, ny=ny, nz=nz,
+                      cells_per_rank=nx * ny * nz // n,
+                      P=overrides['Process.Topology.P'], Q=overrides['Process.Topology.Q'],
+                      R=overrides['Process.Topology.R'])
+        case_dir = os.path.abspath(os.path.join(root_dir, case, '{}_{:04d}'.format(mode, n)))
+        record.update(run_measured(name, keys, overrides, case_dir, inputs))
+        records.append(record)
+
+    base = records[0]
+    for record in records:
+        if record['error'] is not None or base['error'] is not None:
+            continue
+        ratio = base['wall_time'] / record['wall_time']
+        if mode == 'strong':
+            record['speedup'] = ratio
+            record['efficiency'] = ratio * base['ranks'] / record['ranks']
+        else:
+            record['speedup'] = ratio * record['ranks'] / base['ranks']
+            record['efficiency'] = ratio
+    return records
+
+
+def write_curve(filename, records):
+    """Write scaling records as CSV, blank where a value is missing."""
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, SCALING_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for record in records:
+            writer.writerow({field: '' if record.get(field) is None else record[field]
+                             for field in SCALING_FIELDS})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Strong and weak scaling of a benchmark case.')
+    parser.add_argument('case')
+    parser.add_argument('--ranks', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--mode', nargs='+', choices=['strong', 'weak'], default=['strong', 'weak'])
+    parser.add_argument('--axis', default='x', choices=['x', 'y', 'z'],
+                        help='axis the grid is refined along for weak scaling')
+    parser.add_argument('--stop', type=float, default=None, help='stop time of every run')
+    parser.add_argument('--runs', default='scaling_runs', help='directory the runs are made in')
+    parser.add_argument('--out', default='scaling.csv')
+    args = parser.parse_args()
+
+    records = []
+    for mode in args.mode:
+        records += scaling_curve(args.case, sorted(args.ranks), mode, args.runs, args.stop, args.axis)
+    write_curve(args.out, records)
+    print('{:<7s} {:>6s} {:>9s} {:>12s} {:>9s} {:>8s} {:>10s}'.format(
+        'mode', 'ranks', 'P,Q,R', 'cells/rank', 'wall s', 'speedup', 'efficiency'))
+    for r in records:
+        if r['error'] is not None:
+            print('{:<7s} {:>6d} failed: {}'.format(r['mode'], r['ranks'], r['error']))
+            continue
+        print('{:<7s} {:>6d} {:>9s} {:>12d} {:>9.2f} {:>8.2f} {:>10.2f}'.format(
+            r['mode'], r['ranks'], '{P},{Q},{R}'.format(**r), r['cells_per_rank'], r['wall_time'],
+            r.get('speedup') or 0.0, r.get('efficiency') or 0.0))
@@ -0,0 +1,169 @@
+"""Run a long single column simulation as a chain of restarted segments.
+
+A long forcing record (e.g. several water years) is run one segment at a
+time.  Each segment restarts from the pressure and CLM restart the previous
+one ended with (see ``pftools.spinup``), and its hourly PFBs are packed
+into one store per segment and removed before the next segment starts, so
+disk usage and file counts stay bounded.  Progress is kept in
+``<run>.segments.json`` in the run directory, and calling ``run_segments``
+again after a failure resumes after the last completed segment.  Once
+every segment is done, ``merge_segments`` joins the segment stores along
+time into the run's usual ``<run>.out.timeseries.nc``, so the plotting
+scripts read a segmented run like any other.
+"""
+import json
+import os
+
+import netCDF4
+import numpy as np
+
+from pftools.spinup import save_state, start_from_state
+from pftools.store import _CHUNK_BYTES, _rows, pack_run, read_store, store_filename
+from pftools.timeseries import pfb_filename, pfb_timesteps
+
+# hours in a (non-leap) water year
+WATER_YEAR_HOURS = 8760
+
+
+def segment_bounds(hours, segment_hours=WATER_YEAR_HOURS):
+    """(start, stop) hours of consecutive segments covering ``hours`` hours."""
+    starts = range(0, int(hours), int(segment_hours))
+    return [(start, min(start + int(segment_hours), int(hours))) for start in starts]
+
+
+def segment_store(run_dir, run_name, start, stop):
+    """Store a segment's output is packed into."""
+    return os.path.join(run_dir, '{}.out.timeseries.{:05d}-{:05d}.nc'.format(run_name, start, stop))
+
+
+def _progress_file(run_dir, run_name):
+    return os.path.join(run_dir, '{}.segments.json'.format(run_name))
+
+
+def read_progress(run_dir, run_name):
+    """Completed segments of a segmented run, as a list of dicts."""
+    filename = _progress_file(run_dir, run_name)
+    if not os.path.exists(filename):
+        return []
+    with open(filename) as f:
+        return json.load(f)['segments']
+
+
+def _write_progress(run_dir, run_name, segments):
+    filename = _progress_file(run_dir, run_name)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(dict(run_name=run_name, segments=segments), f, indent=1)
+    os.replace(filename + '.tmp', filename)
+
+
+def compact_segment(run_dir, run_name, variables, start, stop):
+    """Pack the output of one segment into its store and remove the PFBs.
+
+    The PFBs are only removed once the store has been read back and holds
+    every packed timestep.  Returns the store file name.
+    """
+    filename = pack_run(run_dir, run_name, variables, segment_store(run_dir, run_name, start, stop))
+    steps = {var: pfb_timesteps(run_dir, run_name, var) for var in variables}
+    packed = read_store(filename, [])['time']
+    for var, var_steps in steps.items():
+        missing = np.setdiff1d(var_steps, packed)
+        if len(missing):
+            raise RuntimeError('{} is missing {} timesteps of {}'.format(filename, len(missing), var))
+    for var, var_steps in steps.items():
+        for timestep in var_steps:
+            name = pfb_filename(run_dir, run_name, var, timestep)
+            os.remove(name)
+            if os.path.exists(name + '.dist'):
+                os.remove(name + '.dist')
+    return filename
+
+
+def run_segments(run, run_dir, bounds, variables=('clm_output', 'press', 'satur')):
+    """Run ``run`` over consecutive (start, stop) hour segments.
+
+    Each segment sets the run's start / stop time, StartCount and
+    ``Solver.CLM.IstepStart`` so timesteps and the position in the forcing
+    file continue across segments, and starts from the state the previous
+    segment ended with; the first segment starts from the run's own initial
+    condition.  Segments already recorded in ``<run>.segments.json`` are
+    skipped.  Returns the list of completed segments, each a dict with
+    'start', 'stop', 'store' and 'state'.
+    """
+    run_name = run.get_name()
+    states_dir = os.path.join(run_dir, '{}.segments'.format(run_name))
+    done = read_progress(run_dir, run_name)
+    if done:
+        start_from_state(run, done[-1]['state'], run_dir)
+
+    for start, stop in bounds:
+        if any(segment['start'] == start and segment['stop'] == stop for segment in done):
+            continue
+        run.TimingInfo.StartTime = start
+        run.TimingInfo.StopTime = stop
+        run.TimingInfo.StartCount = start
+        run.Solver.CLM.IstepStart = start + 1
+        run.run(working_directory=os.path.abspath(run_dir))
+
+        # hand off to the next segment before the output is compacted
+        state = save_state(states_dir, 'hour_{:05d}'.format(stop), run_dir, run_name, stop)
+        store = compact_segment(run_dir, run_name, variables, start, stop)
+        done.append(dict(start=start, stop=stop, store=store, state=state))
+        _write_progress(run_dir, run_name, done)
+        start_from_state(run, state, run_dir)
+    return done
+
+
+def merge_segments(run_dir, run_name, segments, filename=None):
+    """Join the stores of ``segments`` along time into one store.
+
+    ``segments`` is the list ``run_segments`` returns.  A timestep written
+    by two segments (each segment writes the pressure it starts from) is
+    taken from the earlier one, which also holds its CLM output.  The
+    result has the layout of ``pftools.store.pack_run`` and defaults to
+    ``store_filename(run_dir, run_name)``.  Returns the store file name.
+    """
+    if filename is None:
+        filename = store_filename(run_dir, run_name)
+    stores = [segment['store'] for segment in segments]
+    if not stores:
+        raise ValueError('no segments to merge')
+    times = [read_store(store, [])['time'] for store in stores]
+    time = np.unique(np.concatenate(times))
+
+    tmp_filename = filename + '.tmp'
+    with netCDF4.Dataset(tmp_filename, 'w') as ds:
+        ds.run_name = run_name
+        ds.createDimension('time', len(time))
+        time_var = ds.createVariable('time', 'i4', ('time',))
+        time_var.long_name = 'timestep'
+        time_var[:] = time
+        with netCDF4.Dataset(stores[0]) as src:
+            for name, size in src.dimensions.items():
+                if name != 'time':
+                    ds.createDimension(name, len(size))
+            for name, var in src.variables.items():
+                if name == 'time':
+                    continue
+                frame = int(np.prod(var.shape[1:]))
+                tchunk = max(1, min(len(time), _CHUNK_BYTES // (8 * frame)))
+                nc_var = ds.createVariable(name, var.dtype, var.dimensions, zlib=True,
+                                           chunksizes=(tchunk,) + var.shape[1:], fill_value=np.nan)
+                nc_var.setncatts({key: var.getncattr(key) for key in var.ncattrs() if key != '_FillValue'})
+
+        written = np.zeros(len(time), dtype=bool)
+        for store, store_time in zip(stores, times):
+            rows = np.searchsorted(time, store_time)
+            keep = np.flatnonzero(~written[rows])
+            written[rows] = True
+            with netCDF4.Dataset(store) as src:
+                src.set_auto_mask(False)
+                for name, nc_var in ds.variables.items():
+                    if name == 'time':
+                        continue
+                    # copy one time chunk at a time
+                    tchunk = nc_var.chunking()[0]
+                    for start in range(0, len(keep), tchunk):
+                        block = keep[start:start + tchunk]
+                        nc_var[_rows(rows[block])] = src[name][_rows(block)]
+    os.replace(tmp_filename, filename)
+    return filename
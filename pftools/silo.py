@@ -0,0 +1,245 @@
+"""Read ParFlow SILO output without the Silo library.
+
+ParFlow writes each SILO output as a small root file,
+``<run>.out.<variable>.<timestep>.silo``, holding the global grid
+('origin' of the first cell centre, 'delta', 'size') and a multi-block
+variable whose ';'-separated block names point at files under
+``<run>.out/<variable>/``.  Each block file holds the block's values as a
+``<Var>_<block>_data`` array (x fastest) and the node coordinates of its
+mesh.  All of these are PDB files: a text header giving the addresses of
+the structure chart and the symbol table, whose entries give the type,
+length, address and dimensions of every array.  Only the plain arrays are
+needed, so the structures are never decoded.
+
+``read_silo`` returns the same (z, y, x) array as ``PFData.getDataAsArray()``
+on the matching PFB.  ``convert_silo_run`` writes PFBs for every SILO file
+of a run in parallel, so SILO-only outputs can be used with the rest of
+``pftools``::
+
+    python -m pftools.silo heterog-dunne heterog-dunne
+"""
+import argparse
+import glob
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pftools.frames import _pool_context
+from pftools.pfb import read_pfb, write_pfb
+
+_PDB_MAGIC = b'!<<PDB:II>>!'
+
+# addresses of the structure chart and symbol table in the PDB header
+_ADDRESSES = re.compile(rb'\x01\n(\d+)\x01(\d+)\x01\n')
+
+
+def _primitive_dtypes(extras):
+    # numpy dtypes of the primitive types listed in the PDB extras block;
+    # integers carry an order flag (1 big, 2 little endian), floats a byte
+    # order list that starts with the size for little endian
+    dtypes = {}
+    section = extras.split(b'Primitive-Types:\n', 1)[1].split(b'\n\x02\n', 1)[0]
+    for line in section.split(b'\n'):
+        fields = line.rstrip(b'\x01').split(b'\x01')
+        if len(fields) < 5:
+            continue
+        name, size, flag = fields[0].decode(), int(fields[1]), int(fields[3])
+        if fields[4] == b'ORDER':
+            little = int(fields[5]) == size
+            kind = 'f'
+        elif flag in (1, 2) and name != 'char':
+            little = flag == 2
+            kind = 'i'
+        else:
+            continue
+        dtypes[name] = np.dtype('{}{}{}'.format('<' if little else '>', kind, size))
+    dtypes['char'] = np.dtype('S1')
+    return dtypes
+
+
+def read_pdb(filename):
+    """Symbol table of a PDB file plus a function to read its arrays.
+
+    Returns (symbols, read): ``symbols`` maps names (without the leading
+    '/') to (type, count, address, dims) and ``read(name)`` returns that
+    array, with ``dims`` (x first) the extents given in the file.
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if not data.startswith(_PDB_MAGIC):
+        raise ValueError('{} is not a PDB (SILO) file'.format(filename))
+    chart, symtab = (int(a) for a in _ADDRESSES.search(data, 0, 512).groups())
+    end = data.index(b'\n\n', symtab)
+    dtypes = _primitive_dtypes(data[end:])
+
+    symbols = {}
+    for line in data[symtab:end].split(b'\n'):
+        fields = line.rstrip(b'\x01').split(b'\x01')
+        if len(fields) < 4:
+            continue
+        name = fields[0].decode().lstrip('/')
+        extents = [int(v) for v in fields[4:]]
+        symbols[name] = (fields[1].decode(), int(fields[2]), int(fields[3]), tuple(extents[1::2]))
+
+    def read(name):
+        vtype, count, address, dims = symbols[name]
+        if vtype not in dtypes:
+            raise TypeError('{} in {} has unsupported type {}'.format(name, filename, vtype))
+        values = np.frombuffer(data, dtype=dtypes[vtype], count=count, offset=address)
+        if vtype == 'char':
+            return values.tobytes().decode('ascii', 'replace').rstrip('\x00')
+        return values.astype(np.float64 if dtypes[vtype].kind == 'f' else np.int64)
+
+    return symbols, read
+
+
+def silo_grid(filename):
+    """Grid of a ParFlow SILO root file as a dict like ``read_pfb_header``.
+
+    Has 'x', 'y', 'z' (lower corner), 'nx', 'ny', 'nz' and 'dx', 'dy', 'dz'.
+    'nz' is that of the 3D grid even for 2D outputs.
+    """
+    _, read = read_pdb(filename)
+    origin, delta, size = read('origin'), read('delta'), read('size')
+    lower = origin - 0.5 * delta
+    return dict(x=lower[0], y=lower[1], z=lower[2],
+                nx=int(size[0]), ny=int(size[1]), nz=int(size[2]),
+                dx=delta[0], dy=delta[1], dz=delta[2])
+
+
+def read_silo(filename):
+    """Read a ParFlow SILO output into a (nz, ny, nx) array."""
+    symbols, read = read_pdb(filename)
+    grid = silo_grid(filename)
+    varnames = [name for name in symbols if name.endswith('_varnames')]
+    if not varnames:
+        raise ValueError('{} holds no multi-block variable'.format(filename))
+    blocks = [b for b in read(varnames[0]).split(';') if b]
+
+    root_dir = os.path.dirname(filename)
+    lower = np.array([grid['x'], grid['y'], grid['z']])
+    delta = np.array([grid['dx'], grid['dy'], grid['dz']])
+    pieces = []
+    for block in blocks:
+        block_file, var = block.rsplit(':', 1)
+        block_symbols, block_read = read_pdb(os.path.join(root_dir, block_file))
+        nx, ny, nz = block_symbols[var + '_data'][3]
+        values = block_read(var + '_data').reshape(nz, ny, nx)
+        mesh = 'mesh_' + var.rsplit('_', 1)[1]
+        # the first node of the block mesh gives its place in the grid
+        first = np.array([block_read('{}_coord{}'.format(mesh, i))[0] for i in range(3)])
+        i0, j0, k0 = np.rint((first - lower) / delta).astype(int)
+        pieces.append(((k0, j0, i0), values))
+
+    # 2D outputs (slopes, mannings, overlandsum) keep the 3D grid size in
+    # the root file but hold a single layer, as their PFBs do
+    nz = max(k0 + values.shape[0] for (k0, _, _), values in pieces)
+    out = np.empty((nz, grid['ny'], grid['nx']))
+    for (k0, j0, i0), values in pieces:
+        out[k0:k0 + values.shape[0], j0:j0 + values.shape[1], i0:i0 + values.shape[2]] = values
+    return out
+
+
+def silo_files(run_dir, run_name, static=False):
+    """Root SILO files of a run in ``run_dir``.
+
+    With ``static`` only those of outputs written once per run (mask,
+    porosity, ...), without a timestep number.
+    """
+    pattern = os.path.join(glob.escape(run_dir), glob.escape(run_name) + '.out.*.silo')
+    files = sorted(glob.glob(pattern))
+    if static:
+        files = [f for f in files if not re.search(r'\.\d{5}\.silo$', f)]
+    return files
+
+
+def silo_filename(run_dir, run_name, variable, timestep):
+    """Path of the SILO root file of ``variable`` at ``timestep``."""
+    return os.path.join(run_dir, '{}.out.{}.{:05d}.silo'.format(run_name, variable, timestep))
+
+
+def silo_timesteps(run_dir, run_name, variable):
+    """Sorted timestep numbers for which ``variable`` has a SILO file in ``run_dir``."""
+    prefix = '{}.out.{}.'.format(run_name, variable)
+    pattern = re.compile(re.escape(prefix) + r'(\d+)\.silo')
+    steps = []
+    for name in glob.glob(os.path.join(glob.escape(run_dir), glob.escape(prefix) + '*.silo')):
+        match = pattern.fullmatch(os.path.basename(name))
+        if match:
+            steps.append(int(match.group(1)))
+    return sorted(steps)
+
+
+def silo_block_files(filename):
+    """Block files a SILO root file points at."""
+    symbols, read = read_pdb(filename)
+    root_dir = os.path.dirname(filename)
+    names = set()
+    for name in symbols:
+        if name.endswith('_varnames') or name.endswith('_meshnames'):
+            names.update(b.rsplit(':', 1)[0] for b in read(name).split(';') if b)
+    return sorted(os.path.join(root_dir, name) for name in names)
+
+
+def remove_silo(filename):
+    """Remove a SILO root file and its block files."""
+    for block_file in silo_block_files(filename):
+        os.remove(block_file)
+    os.remove(filename)
+
+
+def remove_empty_dirs(run_dir, run_name):
+    """Remove the emptied ``<run>.out/<variable>/<block>/`` directories of a run."""
+    for dirpath, _, _ in sorted(os.walk(os.path.join(run_dir, run_name + '.out')), reverse=True):
+        if not os.listdir(dirpath):
+            os.rmdir(dirpath)
+
+
+def _convert(filename, overwrite):
+    pfb_file = filename[:-len('.silo')] + '.pfb'
+    data = read_silo(filename)
+    if os.path.exists(pfb_file) and not overwrite:
+        # already written by ParFlow; only check it holds the same values
+        if not np.array_equal(read_pfb(pfb_file), data):
+            raise RuntimeError('{} and {} differ'.format(filename, pfb_file))
+        return pfb_file, False
+    grid = silo_grid(filename)
+    write_pfb(pfb_file, data, grid['x'], grid['y'], grid['z'], grid['dx'], grid['dy'], grid['dz'])
+    return pfb_file, True
+
+
+def convert_silo_run(run_dir, run_name, remove=False, overwrite=False, workers=None, static=False):
+    """Write a PFB next to every SILO output of a run, in parallel.
+
+    SILO files with a PFB already written by ParFlow are checked against it
+    instead.  With ``remove`` the SILO root and block files are removed once
+    their PFB is written or checked.  With ``static`` only the outputs
+    written once per run are converted; ``pftools.compact`` archives the
+    per-timestep ones.  Returns the list of PFBs written.
+    """
+    files = silo_files(run_dir, run_name, static)
+    if not files:
+        return []
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with ProcessPoolExecutor(max(1, min(workers, len(files))), mp_context=_pool_context()) as pool:
+        results = list(pool.map(_convert, files, [overwrite] * len(files),
+                                chunksize=max(1, len(files) // (4 * workers))))
+    if remove:
+        for filename in files:
+            remove_silo(filename)
+        remove_empty_dirs(run_dir, run_name)
+    return [pfb_file for pfb_file, written in results if written]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert the SILO output of a run to PFB.')
+    parser.add_argument('run_dir')
+    parser.add_argument('run_name')
+    parser.add_argument('--remove', action='store_true', help='remove the SILO files afterwards')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    written = convert_silo_run(args.run_dir, args.run_name, args.remove, workers=args.workers)
+    print('{} PFB files written'.format(len(written)))
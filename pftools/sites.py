@@ -0,0 +1,273 @@
+"""Run the single column CLM case at many sites concurrently.
+
+``PFCLM_SC.py`` runs one site in the shared ``single_column_CLM/output``
+directory.  ``run_sites`` takes the run as recorded in its ``.pfidb`` and a
+table of sites, and runs every site in its own directory, with its own
+``drv_*.dat`` files, forcing, location, vegetation and soil, in a bounded
+pool of worker processes.  Every site's output is packed into a store
+(``pftools.store``) as soon as it finishes, and the stores of all sites
+are combined into one file with a 'site' axis::
+
+    python -m pftools.sites sites.csv --runs site_runs --out sites.nc
+
+The sites table is a CSV with a 'name' and a 'forcing' column (a 1D
+forcing file, relative to the table) and optional columns 'lat', 'lon',
+'sand', 'clay', 'color', 'vegetation' (IGBP class 1-18), the soil
+parameters in SOIL_PARAMETERS and any ParFlow key (a column name with a
+dot, e.g. 'TimingInfo.StopTime').  Columns left empty keep the values of
+the base run and of ``single_column_CLM/inputs``.
+"""
+import argparse
+import csv
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import netCDF4
+import numpy as np
+
+from parflow import Run
+
+from pftools.benchmark import CASES, _REPO_DIR, case_keys
+from pftools.clm import read_vegm, set_clmin_values, vegetation_fractions, write_vegm
+from pftools.frames import _pool_context
+from pftools.spinup import spin_up, spinup_key, start_from_state
+from pftools.store import _CHUNK_BYTES, _dimension, _rows, pack_run, read_store
+
+# soil column -> keys of the domain geometry it sets
+SOIL_PARAMETERS = {
+    'perm': ['Perm.Value'],
+    'porosity': ['Porosity.Value'],
+    'alpha': ['RelPerm.Alpha', 'Saturation.Alpha'],
+    'n': ['RelPerm.N', 'Saturation.N'],
+    'sres': ['Saturation.SRes'],
+    'ssat': ['Saturation.SSat'],
+}
+
+# vegm columns a site can set
+_VEGM_FIELDS = ('lat', 'lon', 'sand', 'clay', 'color')
+
+# CLM inputs every site gets a copy of
+CLM_INPUTS = ('drv_clmin.dat', 'drv_vegm.dat', 'drv_vegp.dat')
+
+
+def read_sites(filename):
+    """Sites of a sites table as a list of dicts, empty cells left out.
+
+    Forcing file names are made absolute relative to the table.
+    """
+    table_dir = os.path.dirname(os.path.abspath(filename))
+    with open(filename, newline='') as f:
+        sites = [{column: value.strip() for column, value in row.items() if value and value.strip()}
+                 for row in csv.DictReader(f)]
+    for number, site in enumerate(sites):
+        for column in ('name', 'forcing'):
+            if column not in site:
+                raise ValueError('site {} in {} has no {}'.format(number + 1, filename, column))
+        site['forcing'] = os.path.normpath(os.path.join(table_dir, site['forcing']))
+    names = [site['name'] for site in sites]
+    if len(set(names)) != len(names):
+        raise ValueError('site names in {} are not unique'.format(filename))
+    return sites
+
+
+def site_keys(keys, site):
+    """Keys of the base run ``keys`` set up for ``site``.
+
+    The run starts cold from the hydrostatic initial condition of
+    ``PFCLM_SC.py`` (the base run may have started from a spun-up state)
+    and reads the site's forcing.
+    """
+    keys = dict(keys)
+    geom = str(keys.get('Domain.GeomName', 'domain'))
+    keys.pop('Geom.{}.ICPressure.FileName'.format(geom), None)
+    keys.update({'ICPressure.Type': 'HydroStaticPatch',
+                 'ICPressure.GeomNames': geom,
+                 'Geom.{}.ICPressure.Value'.format(geom): -1.0,
+                 'Geom.{}.ICPressure.RefGeom'.format(geom): geom,
+                 'Geom.{}.ICPressure.RefPatch'.format(geom): 'z_upper',
+                 'Solver.CLM.MetFilePath': os.path.dirname(site['forcing']),
+                 'Solver.CLM.MetFileName': os.path.basename(site['forcing'])})
+    for column, names in SOIL_PARAMETERS.items():
+        if column in site:
+            for name in names:
+                keys['Geom.{}.{}'.format(geom, name)] = float(site[column])
+    keys.update({column: value for column, value in site.items() if '.' in column})
+    return keys
+
+
+def site_cell(cell, site):
+    """Copy of the ``drv_vegm.dat`` cell ``cell`` with the site's location and cover."""
+    cell = dict(cell)
+    for field in _VEGM_FIELDS:
+        if field in site:
+            cell[field] = float(site[field])
+    if 'vegetation' in site:
+        cell['fractions'] = vegetation_fractions(site['vegetation'])
+    return cell
+
+
+def write_site_inputs(site, site_dir, inputs_dir):
+    """Copy the CLM inputs into ``site_dir``, with the site's location and cover.
+
+    Returns the paths of the written ``drv_*.dat`` files.
+    """
+    files = []
+    for filename in CLM_INPUTS:
+        files.append(os.path.join(site_dir, filename))
+        shutil.copyfile(os.path.join(inputs_dir, filename), files[-1])
+    # a cold start, as with the hydrostatic initial condition
+    set_clmin_values(os.path.join(site_dir, 'drv_clmin.dat'), startcode=2, clm_ic=2)
+
+    vegm = os.path.join(site_dir, 'drv_vegm.dat')
+    write_vegm(vegm, [site_cell(cell, site) for cell in read_vegm(vegm)])
+    return files
+
+
+def _run_site(name, keys, site, site_dir, inputs_dir, spinup_cache):
+    shutil.rmtree(site_dir, ignore_errors=True)
+    os.makedirs(site_dir)
+    input_files = write_site_inputs(site, site_dir, inputs_dir)
+    keys = site_keys(keys, site)
+    for key, value in keys.items():
+        # CLM writes into these directories relative to the run directory
+        if key.endswith('FileDir') and isinstance(value, str) and value and not os.path.isabs(value):
+            os.makedirs(os.path.join(site_dir, value), exist_ok=True)
+
+    run = Run(name)
+    run.pfset(flat_map=keys)
+    try:
+        if spinup_cache is not None:
+            # sites with the same inputs share a spun-up state
+            key = spinup_key(run, input_files + [site['forcing']])
+            start_from_state(run, spin_up(run, site_dir, spinup_cache, key), site_dir)
+        run.run(working_directory=site_dir)
+    except SystemExit as e:
+        # Run.run exits the interpreter when ParFlow fails
+        raise RuntimeError('{} failed in {} (exit status {})'.format(site['name'], site_dir, e.code))
+    return pack_run(site_dir, name)
+
+
+def run_sites(sites, root_dir='site_runs', base_pfidb=None, inputs_dir=None, spinup=False,
+              workers=None):
+    """Run the single column case at every site, ``workers`` at a time.
+
+    Args:
+        sites: list of site dicts, as returned by ``read_sites``
+        root_dir: directory the site directories ``<root_dir>/<name>`` are
+            created in; a site's directory is emptied first
+        base_pfidb: ``.pfidb`` of the single column run, defaults to the
+            one ``PFCLM_SC.py`` leaves in ``single_column_CLM/output``
+        inputs_dir: directory with the ``drv_*.dat`` files the sites start
+            from, defaults to ``single_column_CLM/inputs``
+        spinup: start each site from its spun-up state, cached in
+            ``<root_dir>/spinup_cache``
+        workers: number of sites run at once, defaults to the CPU count
+
+    Returns:
+        a list with a dict per site holding 'site', 'dir', 'store' (the
+        site's packed output) and 'error' (None, or the message of a failed
+        site).  A failed site does not stop the others.
+    """
+    base_pfidb = base_pfidb or os.path.join(_REPO_DIR, CASES['pfclm_sc']['pfidb'])
+    if not os.path.exists(base_pfidb):
+        raise FileNotFoundError('{} not found, run PFCLM_SC.py once first'.format(base_pfidb))
+    inputs_dir = inputs_dir or os.path.join(_REPO_DIR, 'single_column_CLM', 'inputs')
+    name = os.path.basename(base_pfidb)[:-len('.pfidb')]
+    keys = case_keys(base_pfidb)
+    root_dir = os.path.abspath(root_dir)
+    spinup_cache = os.path.join(root_dir, 'spinup_cache') if spinup else None
+    os.makedirs(root_dir, exist_ok=True)
+
+    records = [dict(site=site, dir=os.path.join(root_dir, site['name']), store=None, error=None)
+               for site in sites]
+    with ProcessPoolExecutor(max(1, workers or os.cpu_count() or 1), mp_context=_pool_context()) as pool:
+        futures = [pool.submit(_run_site, name, keys, r['site'], r['dir'], inputs_dir, spinup_cache)
+                   for r in records]
+        for record, future in zip(records, futures):
+            try:
+                record['store'] = future.result()
+            except Exception as e:
+                record['error'] = str(e)
+    return records
+
+
+def _create_site_store(ds, run_name, time, names, lat, lon):
+    # time and site axes of a store combining several sites
+    ds.run_name = run_name
+    ds.createDimension('time', len(time))
+    ds.createDimension('site', len(names))
+    ds.createVariable('time', 'i4', ('time',))[:] = time
+    ds.createVariable('name', str, ('site',))[:] = np.array(names, dtype=object)
+    for field, values in (('lat', lat), ('lon', lon)):
+        ds.createVariable(field, 'f8', ('site',))[:] = values
+
+
+def _create_site_variable(ds, name, dims, shape, attributes):
+    # a time series of every site, cells shaped ``shape`` along ``dims``
+    for dim, size in zip(dims, shape):
+        _dimension(ds, dim, size)
+    sites = len(ds.dimensions['site'])
+    tchunk = max(1, min(len(ds.dimensions['time']), _CHUNK_BYTES // (8 * sites * int(np.prod(shape)))))
+    nc_var = ds.createVariable(name, 'f8', ('time', 'site') + tuple(dims), zlib=True,
+                               chunksizes=(tchunk, sites) + tuple(shape), fill_value=np.nan)
+    nc_var.setncatts(attributes)
+    return nc_var
+
+
+def _attributes(nc_var):
+    return {name: nc_var.getncattr(name) for name in nc_var.ncattrs() if name != '_FillValue'}
+
+
+def combine_stores(records, filename):
+    """Combine the stores of the finished sites of ``run_sites`` into one file.
+
+    Every variable gets a 'site' axis after 'time'; the time axis is the
+    union of the sites' timesteps, NaN where a site has none.  The sites'
+    'name', 'lat' and 'lon' are stored along 'site'.  ``read_store`` reads
+    the combined file like a single site's store.  Returns ``filename``.
+    """
+    records = [r for r in records if r['error'] is None]
+    if not records:
+        raise ValueError('no site finished')
+    time = np.array(sorted(set().union(*(read_store(r['store'], [])['time'] for r in records))))
+    cells = [read_vegm(os.path.join(r['dir'], 'drv_vegm.dat'))[0] for r in records]
+    with netCDF4.Dataset(records[0]['store']) as src:
+        run_name = src.run_name
+        variables = [(name, var.dimensions[1:], var.shape[1:], _attributes(var))
+                     for name, var in src.variables.items()
+                     if name != 'time' and var.dimensions[:1] == ('time',)]
+
+    tmp_filename = filename + '.tmp'
+    with netCDF4.Dataset(tmp_filename, 'w') as ds:
+        _create_site_store(ds, run_name, time, [r['site']['name'] for r in records],
+                           [cell['lat'] for cell in cells], [cell['lon'] for cell in cells])
+        for variable in variables:
+            _create_site_variable(ds, *variable)
+        for number, record in enumerate(records):
+            data = read_store(record['store'], [variable[0] for variable in variables])
+            rows = _rows(np.searchsorted(time, data.pop('time')))
+            for var, values in data.items():
+                ds[var][rows, number] = values
+    os.replace(tmp_filename, filename)
+    return filename
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the single column CLM case at many sites.')
+    parser.add_argument('sites', help='CSV table of sites')
+    parser.add_argument('--runs', default='site_runs', help='directory the sites are run in')
+    parser.add_argument('--out', default='sites.nc', help='combined store of all sites')
+    parser.add_argument('--base', default=None, help='.pfidb of the single column run')
+    parser.add_argument('--inputs', default=None, help='directory with the drv_*.dat files')
+    parser.add_argument('--spinup', action='store_true', help='start every site spun up')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    records = run_sites(read_sites(args.sites), args.runs, args.base, args.inputs, args.spinup,
+                        args.workers)
+    for r in records:
+        print('{:<20s} {}'.format(r['site']['name'], r['store'] if r['error'] is None
+                                  else 'failed: ' + r['error']))
+    if any(r['error'] is None for r in records):
+        print(combine_stores(records, args.out))
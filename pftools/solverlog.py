@@ -0,0 +1,219 @@
+"""Read the solver logs ParFlow writes next to a run's output.
+
+``<run>.out.kinsol.log`` holds a block of nonlinear solver statistics for
+every solver attempt, each ending with a table of per-step and running
+totals; ``<run>.out.log`` the sequence of timesteps taken, with their time,
+step size and dump number; ``<run>.out.timing.csv`` the wall clock time of
+ParFlow's timers and ``<run>.out.pfmetadata`` the ParFlow build that made
+the run.
+
+``solver_steps`` joins the first two into one row per solver attempt, with
+the interval of every time cycle the step starts in, so the steps where the
+solver cost spikes (e.g. rain onset in ``rainrec``) can be picked out and
+exported for dashboards::
+
+    python -m pftools.solverlog dunne_over Dunne --csv steps.csv --top 10
+"""
+import argparse
+import csv
+import json
+import os
+import re
+
+from pftools.config import cycle_values, run_keys
+
+# rows of the statistics table after every KINSOL step, and the names
+# they are returned under
+_KINSOL_COUNTERS = {
+    'Nonlin. Its.': 'nonlinear_iterations',
+    'Lin. Its.': 'linear_iterations',
+    'Func. Evals.': 'function_evaluations',
+    'PC Evals.': 'preconditioner_evaluations',
+    'PC Solves': 'preconditioner_solves',
+    'Lin. Conv. Fails': 'linear_convergence_failures',
+    'Beta Cond. Fails': 'beta_condition_failures',
+    'Backtracks': 'backtracks',
+}
+
+_COUNTER_LINE = re.compile(r'^({}):\s+(\d+)\s+(\d+)\s*$'.format(
+    '|'.join(re.escape(name) for name in _KINSOL_COUNTERS)), re.M)
+
+_STEP_START = re.compile(r'^KINSOL starting step for time (\S+)', re.M)
+_FNORM = re.compile(r'^KINSol(?:Init)? nni=\s*(\d+)\s+fnorm=\s*(\S+)', re.M)
+_RETURN = re.compile(r'^KINSol return value (-?\d+)', re.M)
+
+# sequence #, time, step size, kind, dump number, recompute? in out.log
+_SEQUENCE_LINE = re.compile(r'^\s*(\d+)\s+(\S+)\s+(\S+)\s+([a-z])\s+(\d+)\s+[yn]\s*$', re.M)
+
+STEP_FIELDS = (['attempt', 'timestep', 'start_time', 'time', 'dt', 'dump', 'return_value',
+                'converged', 'initial_fnorm', 'final_fnorm'] + list(_KINSOL_COUNTERS.values()))
+
+
+def log_filename(run_dir, run_name, log):
+    """Path of one of the logs of a run, e.g. ``log='kinsol.log'``."""
+    return os.path.join(run_dir, '{}.out.{}'.format(run_name, log))
+
+
+def kinsol_totals(filename):
+    """Running totals of the KINSOL counters at the end of a kinsol log.
+
+    Returns a dict of counter name ('nonlinear_iterations',
+    'linear_iterations', 'function_evaluations', ...) -> int, empty if the
+    log holds no completed step.
+    """
+    with open(filename) as f:
+        text = f.read()
+    totals = {}
+    for name, _, total in _COUNTER_LINE.findall(text):
+        totals[_KINSOL_COUNTERS[name]] = int(total)
+    return totals
+
+
+def read_timing(filename):
+    """Dict of ParFlow timer name -> wall clock seconds from ``timing.csv``."""
+    with open(filename, newline='') as f:
+        return {row['Timer']: float(row['Time (s)']) for row in csv.DictReader(f)}
+
+
+def parflow_version(run_dir, run_name):
+    """ParFlow build version recorded in a run's ``pfmetadata``, or None."""
+    filename = log_filename(run_dir, run_name, 'pfmetadata')
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as f:
+        return json.load(f).get('parflow', {}).get('build', {}).get('version')
+
+
+def read_kinsol_log(filename):
+    """One dict per KINSOL attempt in a kinsol log, in order.
+
+    Each has 'time' (the time the attempt solves for), 'return_value'
+    (None if the log ends before it), 'initial_fnorm', 'final_fnorm' and
+    the per-step counters ('nonlinear_iterations', ...).
+    """
+    with open(filename) as f:
+        text = f.read()
+    starts = [m for m in _STEP_START.finditer(text)]
+    attempts = []
+    for i, match in enumerate(starts):
+        block = text[match.end():starts[i + 1].start() if i + 1 < len(starts) else len(text)]
+        attempt = dict(time=float(match.group(1)), return_value=None,
+                       initial_fnorm=None, final_fnorm=None)
+        norms = _FNORM.findall(block)
+        if norms:
+            attempt['initial_fnorm'] = float(norms[0][1])
+            attempt['final_fnorm'] = float(norms[-1][1])
+        returned = _RETURN.search(block)
+        if returned:
+            attempt['return_value'] = int(returned.group(1))
+        for name, step, _ in _COUNTER_LINE.findall(block):
+            attempt[_KINSOL_COUNTERS[name]] = int(step)
+        attempts.append(attempt)
+    return attempts
+
+
+def read_sequence(filename):
+    """Timesteps taken by a run from its ``out.log``.
+
+    Returns a list of dicts with 'timestep', 'time', 'dt', 'kind' ('i'
+    initial, 'p' printed, 'f' final, ...) and 'dump'.
+    """
+    with open(filename) as f:
+        text = f.read()
+    # the overland flow table repeats the sequence without the other columns
+    rows = []
+    for match in _SEQUENCE_LINE.finditer(text):
+        timestep, time, dt, kind, dump = match.groups()
+        rows.append(dict(timestep=int(timestep), time=float(time), dt=float(dt),
+                         kind=kind, dump=int(dump)))
+    return rows
+
+
+def solver_steps(run_dir, run_name):
+    """Per-attempt solver table of a run.
+
+    Joins the kinsol log with the timestep sequence of ``out.log`` by time:
+    attempts ParFlow rejected (a convergence failure followed by a smaller
+    step) have no timestep.  Every row has the STEP_FIELDS, where
+    'start_time' is the time of the last converged step, plus a
+    'cycle_<name>' column for every time cycle of the run with more than
+    one interval, holding the interval at 'start_time'.
+    """
+    attempts = read_kinsol_log(log_filename(run_dir, run_name, 'kinsol.log'))
+    taken = []
+    if os.path.exists(log_filename(run_dir, run_name, 'log')):
+        taken = [row for row in read_sequence(log_filename(run_dir, run_name, 'log')) if row['kind'] != 'i']
+
+    rows = []
+    start_time = 0.0
+    next_step = 0
+    for number, attempt in enumerate(attempts):
+        row = {field: None for field in STEP_FIELDS}
+        row.update(attempt)
+        row['attempt'] = number
+        row['start_time'] = start_time
+        if attempt['return_value'] is not None:
+            row['converged'] = attempt['return_value'] >= 0
+        # the kinsol log prints times to 6 decimals; the final step can
+        # repeat the time of the one before it, so steps are matched in order
+        if (row['converged'] is not False and next_step < len(taken)
+                and round(taken[next_step]['time'], 6) == round(attempt['time'], 6)):
+            step = taken[next_step]
+            row.update(timestep=step['timestep'], dt=step['dt'], dump=step['dump'])
+            start_time = attempt['time']
+            next_step += 1
+        rows.append(row)
+
+    pfidb = os.path.join(run_dir, '{}.pfidb'.format(run_name))
+    if rows and os.path.exists(pfidb):
+        keys = run_keys(run_dir, run_name)
+        for cycle in keys.get('Cycle.Names', '').split():
+            names = keys['Cycle.{}.Names'.format(cycle)].split()
+            if len(names) < 2:
+                continue
+            intervals = cycle_values(keys, cycle, {name: name for name in names},
+                                     [row['start_time'] for row in rows])
+            for row, interval in zip(rows, intervals):
+                row['cycle_' + cycle] = interval
+    return rows
+
+
+def write_csv(rows, filename):
+    """Write rows from ``solver_steps`` as CSV, blank where a value is None."""
+    fields = list(rows[0]) if rows else STEP_FIELDS
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fields)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: '' if v is None else v for k, v in row.items()})
+
+
+def write_json(rows, filename):
+    """Write rows from ``solver_steps`` as a JSON list of objects."""
+    with open(filename, 'w') as f:
+        json.dump(rows, f, indent=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-step solver statistics of a ParFlow run.')
+    parser.add_argument('run_dir')
+    parser.add_argument('run_name')
+    parser.add_argument('--csv', default=None, help='write the table as CSV')
+    parser.add_argument('--json', default=None, help='write the table as JSON')
+    parser.add_argument('--top', type=int, default=10, help='print the costliest attempts')
+    args = parser.parse_args()
+
+    rows = solver_steps(args.run_dir, args.run_name)
+    if args.csv:
+        write_csv(rows, args.csv)
+    if args.json:
+        write_json(rows, args.json)
+    cycles = [k for k in (rows[0] if rows else {}) if k.startswith('cycle_')]
+    print('{:>7s} {:>8s} {:>10s} {:>7s} {:>7s} {:>6s} {}'.format(
+        'attempt', 'timestep', 'time', 'nonlin', 'lin', 'fevals', ' '.join(cycles)))
+    costliest = sorted(rows, key=lambda r: -(r['linear_iterations'] or 0))[:args.top]
+    for r in sorted(costliest, key=lambda r: r['attempt']):
+        print('{:>7d} {:>8s} {:>10g} {:>7} {:>7} {:>6} {}{}'.format(
+            r['attempt'], '' if r['timestep'] is None else str(r['timestep']), r['time'],
+            r['nonlinear_iterations'], r['linear_iterations'], r['function_evaluations'],
+            ' '.join(str(r[c]) for c in cycles), '  (not converged)' if r['converged'] is False else ''))
@@ -0,0 +1,163 @@
+"""Spin-up state cache for single column CLM runs.
+
+A spun-up state is the final pressure field and the CLM restart files of a
+run that was repeated over its forcing period until it came back to the
+same state.  States are cached in ``<cache_dir>/<key>/``, where the key is
+a hash of every ParFlow key that affects the solution (soil, grid,
+boundary conditions, timing, CLM options) and of the contents of the CLM
+input files and forcing, so a run whose inputs match a cached state starts
+from it instead of spinning up again::
+
+    key = spinup_key(run, ['drv_vegp.dat', 'drv_vegm.dat', 'drv_clmin.dat', forcing])
+    state_dir = spin_up(run, '.', '../spinup_cache', key)
+    start_from_state(run, state_dir, '.')
+    run.run()
+"""
+import glob
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from pftools.cache import content_hash
+from pftools.clm import set_clmin_values
+from pftools.pfb import read_pfb
+from pftools.timeseries import pfb_filename
+
+# keys that only control what is written and where, not the solution
+_OUTPUT_KEYS = ('Solver.Print', 'Solver.WriteSilo', 'Solver.WriteCLMBinary',
+                'Solver.CLM.CLMDumpInterval', 'Solver.CLM.CLMFileDir', 'Solver.CLM.BinaryOutDir',
+                'Solver.CLM.WriteLogs', 'Solver.CLM.WriteLastRST', 'Solver.CLM.DailyRST',
+                'Solver.CLM.SingleFile', 'TimingInfo.DumpInterval', 'Process.Topology')
+
+# name of the initial pressure file written into the run directory
+IC_PRESSURE_FILE = 'spinup.press.pfb'
+
+
+def spinup_key(run, input_files):
+    """Cache key of the spun-up state of ``run`` with the given input files.
+
+    ``input_files`` are the CLM inputs (``drv_vegp.dat``, ``drv_vegm.dat``,
+    ``drv_clmin.dat``) and the forcing file, as they are before a run
+    changes them.
+    """
+    digest = hashlib.sha256()
+    keys = run.to_dict()
+    for key in sorted(keys):
+        if not key.startswith(_OUTPUT_KEYS):
+            digest.update('{}={}\n'.format(key, keys[key]).encode())
+    for filename in input_files:
+        digest.update('{}:{}\n'.format(os.path.basename(filename), content_hash(filename)).encode())
+    return digest.hexdigest()[:16]
+
+
+def cached_state(cache_dir, key):
+    """Directory of the cached spun-up state for ``key``, or None if there is none.
+
+    States not marked as converged in their ``state.json`` are ignored.
+    """
+    state_dir = os.path.join(cache_dir, key)
+    state_file = os.path.join(state_dir, 'state.json')
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file) as f:
+        return state_dir if json.load(f).get('converged') else None
+
+
+def save_state(cache_dir, key, run_dir, run_name, timestep, info=None):
+    """Cache the pressure at ``timestep`` and the CLM restart of a finished run.
+
+    The run must have been made with ``Solver.CLM.WriteLastRST``.  ``info``
+    is an optional dict stored with the state in ``state.json``.  Returns
+    the state directory.
+    """
+    restart_files = glob.glob(os.path.join(run_dir, 'clm.rst.*'))
+    if not restart_files:
+        raise FileNotFoundError('no CLM restart in {}, set Solver.CLM.WriteLastRST'.format(run_dir))
+    state_dir = os.path.join(cache_dir, key)
+    # build the state next to its final place and rename it in one step, so
+    # a half-written state is never picked up
+    tmp_dir = '{}.{}.tmp'.format(state_dir, os.getpid())
+    os.makedirs(tmp_dir)
+    shutil.copyfile(pfb_filename(run_dir, run_name, 'press', timestep),
+                    os.path.join(tmp_dir, 'press.pfb'))
+    for filename in restart_files:
+        shutil.copy(filename, tmp_dir)
+    with open(os.path.join(tmp_dir, 'state.json'), 'w') as f:
+        json.dump(dict(info or {}, key=key, run_name=run_name, timestep=timestep), f, indent=1)
+    try:
+        os.replace(tmp_dir, state_dir)
+    except OSError:
+        # another run cached the same state first
+        shutil.rmtree(tmp_dir)
+    return state_dir
+
+
+def start_from_state(run, state_dir, run_dir):
+    """Set up ``run`` to start from the state in ``state_dir``.
+
+    Copies the pressure and CLM restart into ``run_dir``, switches the
+    initial condition to that pressure file and sets ``startcode`` and
+    ``clm_ic`` to 1 (restart) in ``run_dir/drv_clmin.dat``.
+    """
+    ic_file = os.path.join(os.path.abspath(run_dir), IC_PRESSURE_FILE)
+    shutil.copyfile(os.path.join(state_dir, 'press.pfb'), ic_file)
+    for filename in glob.glob(os.path.join(state_dir, 'clm.rst.*')):
+        shutil.copy(filename, run_dir)
+
+    geom = run.Domain.GeomName
+    run.ICPressure.Type = 'PFBFile'
+    run.ICPressure.GeomNames = geom
+    run.pfset(key='Geom.{}.ICPressure.FileName'.format(geom), value=ic_file)
+    run.dist(ic_file)
+    set_clmin_values(os.path.join(run_dir, 'drv_clmin.dat'), startcode=1, clm_ic=1)
+
+
+def spin_up(run, run_dir, cache_dir, key, max_years=10, tolerance=0.01):
+    """Spun-up state of ``run``, from the cache or by spinning it up.
+
+    Without a cached state for ``key`` the run is repeated over its forcing
+    period in ``run_dir``, each pass starting from the end of the previous
+    one and writing only its final timestep, until the largest change in
+    pressure between the ends of two passes is below ``tolerance``.  The
+    final state is cached and its directory returned; its output settings
+    are restored, but ``run`` still has to be pointed at the state with
+    ``start_from_state``.  Raises RuntimeError, caching nothing, if the
+    state has not converged after ``max_years`` passes.
+    """
+    state_dir = cached_state(cache_dir, key)
+    if state_dir is not None:
+        return state_dir
+
+    start = float(run.TimingInfo.StartTime)
+    stop = float(run.TimingInfo.StopTime)
+    dump, clm_dump = run.TimingInfo.DumpInterval, run.Solver.CLM.CLMDumpInterval
+    run.TimingInfo.DumpInterval = stop - start
+    run.Solver.CLM.CLMDumpInterval = int(round(stop - start))
+    last = int(run.TimingInfo.StartCount) + 1
+
+    run_name = run.get_name()
+    work_dir = '{}.spinup.{}'.format(os.path.join(cache_dir, key), os.getpid())
+    previous = None
+    try:
+        for year in range(1, max_years + 1):
+            run.run(working_directory=os.path.abspath(run_dir))
+            press = read_pfb(pfb_filename(run_dir, run_name, 'press', last))
+            change = np.inf if previous is None else float(np.abs(press - previous).max())
+            previous = press
+            info = dict(years=year, change=change, converged=change < tolerance)
+            if info['converged']:
+                state_dir = save_state(cache_dir, key, run_dir, run_name, last, info)
+                break
+            if year == max_years:
+                raise RuntimeError('{} not spun up after {} years, the pressure still changed by {:g}'
+                                   .format(run_name, max_years, change))
+            state_dir = save_state(work_dir, str(year), run_dir, run_name, last, info)
+            start_from_state(run, state_dir, run_dir)
+    finally:
+        run.TimingInfo.DumpInterval = dump
+        run.Solver.CLM.CLMDumpInterval = clm_dump
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return state_dir
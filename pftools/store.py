@@ -0,0 +1,150 @@
+"""Consolidated time-series store for a finished run.
+
+``pack_run`` folds every per-timestep PFB of a run into a single netCDF4
+file next to the output, time-major and chunked along time, with each CLM
+layer stored as its own named variable (see ``pftools.clm.CLM_LAYERS``).
+``read_store`` then returns whole time series from that one file instead of
+re-parsing thousands of small PFBs.
+
+From the command line::
+
+    python -m pftools.store output PFCLM_SC
+"""
+import argparse
+import os
+
+import netCDF4
+import numpy as np
+
+from pftools.clm import clm_layers
+from pftools.timeseries import list_timesteps, read_frame
+
+# size of one chunk; a full time series of one variable then takes only a
+# few reads
+_CHUNK_BYTES = 1 << 20
+
+
+def store_filename(run_dir, run_name):
+    """Path of the store ``pack_run`` writes for ``run_name``."""
+    return os.path.join(run_dir, '{}.out.timeseries.nc'.format(run_name))
+
+
+def _rows(rows):
+    # netCDF handles a slice far better than an index list
+    if len(rows) and rows[-1] - rows[0] == len(rows) - 1:
+        return slice(int(rows[0]), int(rows[-1]) + 1)
+    return rows
+
+
+def _dimension(ds, name, size):
+    if name not in ds.dimensions:
+        ds.createDimension(name, size)
+    elif len(ds.dimensions[name]) != size:
+        raise ValueError('{} has {} cells in one output and {} in another'
+                         .format(name, len(ds.dimensions[name]), size))
+
+
+def pack_run(run_dir, run_name, variables=('clm_output', 'press', 'satur'), filename=None):
+    """Pack the per-timestep output of a run into one netCDF4 file.
+
+    Args:
+        run_dir: directory holding the run output
+        run_name: ParFlow run name, e.g. 'PFCLM_SC'
+        variables: per-timestep outputs to pack; any without files in
+            ``run_dir`` are skipped
+        filename: store to write, defaults to ``store_filename()``
+
+    The time axis is the union of the timesteps of all packed variables, so
+    timesteps a variable was not written for (clm_output has no step 0) are
+    NaN.  Returns the store file name.
+    """
+    if filename is None:
+        filename = store_filename(run_dir, run_name)
+    steps = {var: list_timesteps(run_dir, run_name, var) for var in variables}
+    steps = {var: var_steps for var, var_steps in steps.items() if var_steps}
+    if not steps:
+        raise FileNotFoundError('no per-timestep output for {} in {}'.format(run_name, run_dir))
+    time = np.array(sorted(set().union(*steps.values())))
+
+    # write next to the final name and move into place, so readers never see
+    # a half written store
+    tmp_filename = filename + '.tmp'
+    with netCDF4.Dataset(tmp_filename, 'w') as ds:
+        ds.run_name = run_name
+        ds.createDimension('time', len(time))
+        time_var = ds.createVariable('time', 'i4', ('time',))
+        time_var.long_name = 'timestep'
+        time_var[:] = time
+
+        for var, var_steps in steps.items():
+            nz, ny, nx = read_frame(run_dir, run_name, var, var_steps[0]).shape
+            _dimension(ds, 'y', ny)
+            _dimension(ds, 'x', nx)
+            if var == 'clm_output':
+                tchunk = max(1, min(len(time), _CHUNK_BYTES // (8 * ny * nx)))
+                targets = []
+                for name, description, units in clm_layers(nz):
+                    nc_var = ds.createVariable(name, 'f8', ('time', 'y', 'x'), zlib=True,
+                                               chunksizes=(tchunk, ny, nx), fill_value=np.nan)
+                    nc_var.long_name = description
+                    nc_var.units = units
+                    targets.append(nc_var)
+            else:
+                _dimension(ds, 'z', nz)
+                tchunk = max(1, min(len(time), _CHUNK_BYTES // (8 * nz * ny * nx)))
+                targets = ds.createVariable(var, 'f8', ('time', 'z', 'y', 'x'), zlib=True,
+                                            chunksizes=(tchunk, nz, ny, nx), fill_value=np.nan)
+
+            # fill one time chunk at a time
+            rows = np.searchsorted(time, var_steps)
+            for start in range(0, len(var_steps), tchunk):
+                block = np.stack([read_frame(run_dir, run_name, var, t)
+                                  for t in var_steps[start:start + tchunk]])
+                block_rows = _rows(rows[start:start + tchunk])
+                if var == 'clm_output':
+                    for layer, nc_var in enumerate(targets):
+                        nc_var[block_rows] = block[:, layer]
+                else:
+                    targets[block_rows] = block
+    os.replace(tmp_filename, filename)
+    return filename
+
+
+def read_store(filename, names=None, timesteps=None):
+    """Read variables from a store written by ``pack_run``.
+
+    Args:
+        filename: store file
+        names: variables to read ('press', 'eflx_lh_tot', ...); all time
+            series if None
+        timesteps: timesteps to return, e.g. range(1, 8760); all if None
+
+    Returns:
+        dict of arrays keyed on variable name, plus 'time'
+    """
+    with netCDF4.Dataset(filename) as ds:
+        ds.set_auto_mask(False)
+        time = ds['time'][:]
+        if timesteps is None:
+            rows = slice(None)
+        else:
+            timesteps = np.asarray(list(timesteps))
+            rows = np.searchsorted(time, timesteps)
+            if (rows >= len(time)).any() or (time[np.minimum(rows, len(time) - 1)] != timesteps).any():
+                raise KeyError('{} does not hold all of the requested timesteps'.format(filename))
+            rows = _rows(rows)
+        if names is None:
+            names = [name for name in ds.variables
+                     if name != 'time' and ds[name].dimensions[:1] == ('time',)]
+        data = {name: ds[name][rows] for name in names}
+        data['time'] = time[rows]
+    return data
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('run_dir')
+    parser.add_argument('run_name')
+    parser.add_argument('--variables', nargs='+', default=['clm_output', 'press', 'satur'])
+    args = parser.parse_args()
+    print(pack_run(args.run_dir, args.run_name, args.variables))
@@ -0,0 +1,105 @@
+"""Batched time-series extraction from per-timestep ParFlow output.
+
+Instead of opening and fully loading one ``PFData`` object per timestep, the
+grid layout is read once from the first file and every later file is only
+touched at the byte offsets of the requested cells.  Timesteps whose PFB has
+been folded into a per-variable archive by ``pftools.compact`` are read from
+the archive instead.
+"""
+import glob
+import os
+import re
+
+import numpy as np
+
+from pftools.archive import archive_filename, archive_timesteps, read_archive, read_archive_points
+from pftools.pfb import _gather, pfb_cell_offsets, read_pfb_header, read_pfb_slice
+
+
+def pfb_filename(run_dir, run_name, variable, timestep):
+    """Path of the PFB written by ``run_name`` for ``variable`` at ``timestep``.
+
+    CLM single-file output (``variable='clm_output'``) carries the extra
+    ``.C`` suffix ParFlow gives it.
+    """
+    if variable == 'clm_output':
+        name = '{}.out.clm_output.{:05d}.C.pfb'.format(run_name, timestep)
+    else:
+        name = '{}.out.{}.{:05d}.pfb'.format(run_name, variable, timestep)
+    return os.path.join(run_dir, name)
+
+
+def pfb_timesteps(run_dir, run_name, variable):
+    """Sorted timestep numbers for which ``variable`` has a PFB in ``run_dir``."""
+    prefix, suffix = os.path.basename(pfb_filename('', run_name, variable, 0)).split('00000')
+    pattern = re.compile(re.escape(prefix) + r'(\d+)' + re.escape(suffix))
+    steps = []
+    for name in glob.glob(os.path.join(glob.escape(run_dir), glob.escape(prefix) + '*' + suffix)):
+        match = pattern.fullmatch(os.path.basename(name))
+        if match:
+            steps.append(int(match.group(1)))
+    return sorted(steps)
+
+
+def list_timesteps(run_dir, run_name, variable):
+    """Sorted timestep numbers for which ``variable`` was written, as a PFB
+    in ``run_dir`` or in the variable's archive."""
+    steps = set(pfb_timesteps(run_dir, run_name, variable))
+    archive = archive_filename(run_dir, run_name, variable)
+    if os.path.exists(archive):
+        steps.update(archive_timesteps(archive))
+    return sorted(steps)
+
+
+def _archived(run_dir, run_name, variable, timesteps):
+    # rows of ``timesteps`` whose PFB is gone and that have to come from the
+    # archive
+    return [row for row, timestep in enumerate(timesteps)
+            if not os.path.exists(pfb_filename(run_dir, run_name, variable, timestep))]
+
+
+def read_frame(run_dir, run_name, variable, timestep, index=()):
+    """Read ``variable`` at one timestep, from its PFB or from the archive.
+
+    ``index`` selects part of the grid as for ``pftools.pfb.read_pfb_slice``.
+    """
+    filename = pfb_filename(run_dir, run_name, variable, timestep)
+    if os.path.exists(filename):
+        return read_pfb_slice(filename, index)
+    return read_archive(archive_filename(run_dir, run_name, variable), [timestep], index)[0]
+
+
+def read_timeseries(run_dir, run_name, variable, indices, timesteps):
+    """Read ``variable`` at a set of cells over a range of timesteps.
+
+    Args:
+        run_dir: directory holding the run output, e.g. 'output'
+        run_name: ParFlow run name, e.g. 'PFCLM_SC'
+        variable: output name as it appears in the file name ('press',
+            'satur', 'clm_output', ...)
+        indices: list of (z, y, x) cells; for CLM output z is the layer
+        timesteps: iterable of timestep numbers, e.g. range(1, 8760)
+
+    Returns:
+        (len(timesteps), len(indices)) float64 array
+    """
+    timesteps = list(timesteps)
+    data = np.empty((len(timesteps), len(indices)))
+    if not timesteps:
+        return data
+
+    archived = _archived(run_dir, run_name, variable, timesteps)
+    if archived:
+        data[archived] = read_archive_points(archive_filename(run_dir, run_name, variable), indices,
+                                             [timesteps[row] for row in archived])
+    rows = sorted(set(range(len(timesteps))) - set(archived))
+    if not rows:
+        return data
+
+    # all files of a run share one layout, so the offsets are computed once
+    header = read_pfb_header(pfb_filename(run_dir, run_name, variable, timesteps[rows[0]]))
+    offsets = pfb_cell_offsets(header, indices)
+    for it in rows:
+        with open(pfb_filename(run_dir, run_name, variable, timesteps[it]), 'rb') as f:
+            data[it] = _gather(f, offsets)
+    return data
@@ -0,0 +1,98 @@
+"""Choose the ParFlow process topology for a run.
+
+ParFlow splits the computational grid into P x Q x R subgrids, one per MPI
+rank, and ``Run.run`` starts P * Q * R ranks through ParFlow's run script
+and the MPI launcher ParFlow was built with.  ``choose_topology`` picks the
+split of a number of ranks that exchanges the fewest faces between
+subgrids, keeping the subgrids balanced; ``set_topology`` applies it to a
+``Run`` and redistributes its PFB inputs to match::
+
+    set_topology(Dunne, 4)      # 20x1x300 -> P, Q, R = 1, 1, 4
+    Dunne.run(run_dir)
+"""
+import os
+import shutil
+
+
+def _factorizations(n):
+    # all (P, Q, R) with P * Q * R == n
+    for p in range(1, n + 1):
+        if n % p:
+            continue
+        for q in range(1, n // p + 1):
+            if (n // p) % q == 0:
+                yield p, q, n // (p * q)
+
+
+def choose_topology(nx, ny, nz, ranks, max_r=None):
+    """(P, Q, R) splitting an nx x ny x nz grid over ``ranks`` ranks.
+
+    Every subgrid gets at least one cell along each axis.  Among the
+    splits the one with the smallest total area of faces between subgrids
+    is chosen, ties going to the most even subgrid sizes.  ``max_r`` caps
+    R, e.g. at 1 for CLM runs, which need whole columns on a rank.
+    Raises ValueError if ``ranks`` cannot be split over the grid.
+    """
+    best = None
+    for p, q, r in _factorizations(int(ranks)):
+        if p > nx or q > ny or r > nz or (max_r is not None and r > max_r):
+            continue
+        faces = (p - 1) * ny * nz + (q - 1) * nx * nz + (r - 1) * nx * ny
+        # cells of the largest subgrid, ParFlow gives the remainder to the first ones
+        largest = -(-nx // p) * -(-ny // q) * -(-nz // r)
+        if best is None or (faces, largest) < best[0]:
+            best = ((faces, largest), (p, q, r))
+    if best is None:
+        raise ValueError('{} ranks cannot be split over a {}x{}x{} grid'.format(ranks, nx, ny, nz))
+    return best[1]
+
+
+def grid_size(keys):
+    """(nx, ny, nz) of the computational grid in a dict of run keys."""
+    return tuple(int(keys['ComputationalGrid.N' + axis]) for axis in 'XYZ')
+
+
+def topology_keys(keys, ranks):
+    """Process.Topology keys splitting the grid in ``keys`` over ``ranks``."""
+    max_r = 1 if str(keys.get('Solver.LSM', 'none')).upper() == 'CLM' else None
+    p, q, r = choose_topology(*grid_size(keys), ranks, max_r=max_r)
+    return {'Process.Topology.P': p, 'Process.Topology.Q': q, 'Process.Topology.R': r}
+
+
+def distribute_inputs(run, run_dir='.'):
+    """Split the PFB input files of ``run`` for its current topology.
+
+    PFB file names are resolved from ``run_dir``; files that do not exist
+    (yet) are skipped.  Files outside ``run_dir`` (e.g. the absolute input
+    paths of ``pftools.benchmark.case_keys``, shared by the members of an
+    ensemble) are copied into it first and the run pointed at the copy, so
+    runs with their own topologies never split the same file at once.
+    Returns the files distributed.
+    """
+    files = []
+    for key, value in run.to_dict().items():
+        if key.endswith('FileName') and isinstance(value, str) and value.endswith('.pfb'):
+            path = os.path.join(run_dir, value)
+            if not os.path.exists(path):
+                continue
+            if os.path.dirname(os.path.abspath(path)) != os.path.abspath(run_dir):
+                local = os.path.join(run_dir, os.path.basename(path))
+                shutil.copyfile(path, local)
+                run.pfset(key=key, value=os.path.basename(path))
+                path = local
+            run.dist(path)
+            files.append(path)
+    return files
+
+
+def set_topology(run, ranks=None, run_dir='.'):
+    """Split ``run`` over ``ranks`` ranks, the CPU count by default.
+
+    Sets Process.Topology.P/Q/R and redistributes the run's PFB inputs.
+    Returns (P, Q, R).
+    """
+    keys = topology_keys(run.to_dict(), ranks or os.cpu_count() or 1)
+    for key, value in keys.items():
+        run.pfset(key=key, value=value)
+    distribute_inputs(run, run_dir)
+    return keys['Process.Topology.P'], keys['Process.Topology.Q'], keys['Process.Topology.R']
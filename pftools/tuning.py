@@ -0,0 +1,185 @@
+"""Pick solver settings for a run from short trial runs.
+
+``tune_solver`` cuts a ``Run`` short (e.g. to the first rain pulse of
+``Cycle.rainrec``), runs it once with its own solver settings as the
+reference and then with candidate values of the options in
+``pftools.benchmark.SOLVER_OPTIONS``, one option at a time, keeping a
+value when the run is faster and its pressures stay within a tolerance of
+the reference.  The chosen settings are set on the ``Run`` and can be
+saved and applied to later runs::
+
+    result = tune_solver(Dunne, 'dunne_over', stop=pulse_stop(Dunne.to_dict(), 'rainrec'))
+    save_tuned('Dunne.solver.json', result)
+    ...
+    apply_tuned(Dunne, 'Dunne.solver.json')
+"""
+import json
+import os
+
+import numpy as np
+
+from pftools.benchmark import (SOLVER_OPTIONS, absolute_inputs, defined_key, format_settings, run_measured,
+                               solver_overrides)
+from pftools.timeseries import pfb_timesteps, read_frame
+
+# candidate values tried for each option, in this order
+DEFAULT_CANDIDATES = {
+    'krylov': ['10', '20', '50', '100'],
+    'restarts': ['0', '2', '5'],
+    'precond': ['PFMG', 'PFMGOctree', 'SMG'],
+    'jacobian': ['True', 'False'],
+    'eta_choice': ['EtaConstant', 'Walker1', 'Walker2'],
+    'eta': ['0.1', '0.01', '0.001'],
+}
+
+
+def pulse_stop(keys, cycle='rainrec', intervals=1):
+    """Time at the end of the first ``intervals`` intervals of ``cycle``."""
+    base_unit = float(keys['TimingInfo.BaseUnit'])
+    names = str(keys['Cycle.{}.Names'.format(cycle)]).split()
+    start = float(keys.get('TimingInfo.StartTime', 0.0))
+    return start + base_unit * sum(int(keys['Cycle.{}.{}.Length'.format(cycle, name)])
+                                   for name in names[:intervals])
+
+
+def _sets(keys, option):
+    # whether ``keys`` sets the key of SOLVER_OPTIONS ``option``, in any spelling
+    try:
+        defined_key(keys, SOLVER_OPTIONS[option])
+    except ValueError:
+        return False
+    return True
+
+
+def _trial(name, keys, settings, case_dir, inputs):
+    overrides = solver_overrides(keys, settings)
+    record = dict(settings=dict(settings), dir=case_dir, wall_time=None, difference=None,
+                  accepted=False)
+    record.update(run_measured(name, keys, overrides, case_dir, inputs))
+    return record
+
+
+def pressure_difference(ref_dir, run_dir, run_name):
+    """Largest absolute pressure difference between two runs of ``run_name``.
+
+    Compares every pressure output the reference run wrote; a run missing
+    any of them differs by infinity.
+    """
+    steps = pfb_timesteps(ref_dir, run_name, 'press')
+    if pfb_timesteps(run_dir, run_name, 'press')[:len(steps)] != steps:
+        return np.inf
+    difference = 0.0
+    for timestep in steps:
+        ref = read_frame(ref_dir, run_name, 'press', timestep)
+        difference = max(difference, float(np.abs(read_frame(run_dir, run_name, 'press', timestep)
+                                                  - ref).max()))
+    return difference
+
+
+def tune_solver(run, source_dir, stop, candidates=None, inputs=(), root_dir='tuning_runs',
+                tolerance=1e-3, min_speedup=0.05, apply=True):
+    """Choose the fastest solver settings for ``run`` from short trial runs.
+
+    Args:
+        run: ``parflow.Run``; its own solver settings are the reference
+        source_dir: directory ``run`` is normally run in, relative input
+            paths are resolved from it
+        stop: stop time of the trial runs, e.g. ``pulse_stop(keys)``
+        candidates: dict of SOLVER_OPTIONS name -> values to try, defaults
+            to the DEFAULT_CANDIDATES of the options ``run`` sets; raises
+            ValueError for an option whose key ``run`` does not set
+        inputs: files copied into every trial directory (CLM ``drv_*.dat``,
+            restart files, ...)
+        root_dir: directory the trials are run in
+        tolerance: largest absolute pressure difference from the reference
+        min_speedup: fraction of wall time a candidate has to save to be
+            kept, so timing noise does not pick settings
+        apply: set the chosen settings on ``run``
+
+    Options are tuned one at a time in the order of ``candidates``, each
+    starting from the best settings found so far.
+
+    Returns:
+        dict with 'settings' (option -> value chosen), 'keys' (solver key ->
+        value), 'reference' and 'trials' (records with 'settings',
+        'wall_time', 'nonlinear_iterations', 'difference', 'accepted' and
+        'error')
+    """
+    name = run.get_name()
+    keys = absolute_inputs(run.to_dict(), source_dir)
+    keys['TimingInfo.StopTime'] = stop
+    if candidates is None:
+        candidates = {option: values for option, values in DEFAULT_CANDIDATES.items()
+                      if _sets(keys, option)}
+    # the keys as the run spells them, e.g. MaxRestart or MaxRestarts
+    current = {option: str(keys[defined_key(keys, SOLVER_OPTIONS[option])]) for option in candidates}
+
+    def case_dir(number):
+        return os.path.abspath(os.path.join(root_dir, name, 'trial_{:03d}'.format(number)))
+
+    reference = _trial(name, keys, current, case_dir(0), inputs)
+    if reference['error'] is not None:
+        raise RuntimeError('reference run failed: {}'.format(reference['error']))
+    reference.update(difference=0.0, accepted=True)
+    trials = [reference]
+    best = reference
+    for option, values in candidates.items():
+        for value in values:
+            value = str(value)
+            if value == best['settings'][option]:
+                continue
+            settings = dict(best['settings'], **{option: value})
+            trial = _trial(name, keys, settings, case_dir(len(trials)), inputs)
+            if trial['error'] is None:
+                trial['difference'] = pressure_difference(reference['dir'], trial['dir'], name)
+                trial['accepted'] = (trial['difference'] <= tolerance
+                                     and trial['wall_time'] < (1 - min_speedup) * best['wall_time'])
+            trials.append(trial)
+            if trial['accepted']:
+                best = trial
+
+    chosen = dict(best['settings'])
+    tuned_keys = solver_overrides(keys, chosen)
+    if apply:
+        for key, value in tuned_keys.items():
+            run.pfset(key=key, value=value)
+    return dict(settings=chosen, keys=tuned_keys, reference=reference, trials=trials)
+
+
+def format_trials(result):
+    """Table of the trials of a ``tune_solver`` result."""
+    lines = ['{:<5s} {:<70s} {:>8s} {:>7s} {:>10s}'.format('', 'settings', 'wall s', 'nonlin', 'max dp')]
+    for trial in result['trials']:
+        mark = '*' if trial is result['reference'] else ('+' if trial['accepted'] else '')
+        settings = format_settings({k: v for k, v in trial['settings'].items() if v is not None})
+        if trial['error'] is not None:
+            lines.append('{:<5s} {:<70s} failed: {}'.format(mark, settings, trial['error']))
+            continue
+        lines.append('{:<5s} {:<70s} {:>8.2f} {:>7} {:>10.2e}'.format(
+            mark, settings, trial['wall_time'], trial['nonlinear_iterations'], trial['difference']))
+    lines.append('chosen: ' + format_settings(result['settings']))
+    return '\n'.join(lines)
+
+
+def save_tuned(filename, result):
+    """Save the solver keys chosen by ``tune_solver`` as JSON."""
+    with open(filename, 'w') as f:
+        json.dump(result['keys'], f, indent=1, sort_keys=True)
+
+
+def apply_tuned(run, filename):
+    """Set the solver keys saved by ``save_tuned`` on ``run``.
+
+    Each saved key overwrites the spelling of it ``run`` already sets (see
+    ``pftools.benchmark.defined_key``), never adding a parallel key.
+    Returns the dict of keys set, empty if ``filename`` does not exist.
+    """
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as f:
+        saved = json.load(f)
+    run_keys = run.to_dict()
+    keys = {defined_key(run_keys, key): value for key, value in saved.items()}
+    for key, value in keys.items():
+        run.pfset(key=key, value=value)
+    return keys
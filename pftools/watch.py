@@ -0,0 +1,148 @@
+"""Follow a running single column simulation and post-process as it goes.
+
+``iter_timesteps`` polls a run directory and yields each timestep as soon as
+all of its PFBs are completely written; a PFB is complete once its size
+matches the size implied by its own header.  ``follow_column_run`` feeds
+those timesteps into running LH / SWE / ET / runoff aggregates and appends
+them to ``<run>.out.live.csv``, so partial hydrographs are available while
+ParFlow is still running.  From a second shell::
+
+    python -m pftools.watch output PFCLM_SC --stop 8760
+"""
+import argparse
+import os
+import struct
+import time
+
+import numpy as np
+
+from pftools.clm import CLM_LAYER_INDEX
+from pftools.pfb import pfb_size, read_pfb, read_pfb_header, read_pfb_points
+from pftools.timeseries import pfb_filename
+
+
+def pfb_complete(filename):
+    """True once ``filename`` exists and has been written out in full."""
+    try:
+        return os.path.getsize(filename) == pfb_size(read_pfb_header(filename))
+    except (OSError, struct.error):
+        # missing, or the header itself is still being written
+        return False
+
+
+def iter_timesteps(run_dir, run_name, variables, start=0, stop=None, poll=2.0, idle_timeout=None,
+                   done=None):
+    """Yield timesteps in order as soon as every variable's PFB is complete.
+
+    Args:
+        run_dir: directory ParFlow writes to
+        run_name: ParFlow run name
+        variables: outputs that must be complete, e.g. ['clm_output', 'press']
+        start: first timestep to wait for
+        stop: last timestep; follow forever if None
+        poll: seconds between checks of the directory
+        idle_timeout: give up after this many seconds without a new
+            timestep (e.g. because the run died); wait forever if None
+        done: ``threading.Event`` set once the run has returned; the
+            timesteps complete by then are still yielded, then iteration
+            stops
+    """
+    timestep = start
+    last_seen = time.monotonic()
+    while stop is None or timestep <= stop:
+        # read the flag before looking at the files, so output written
+        # just before the run returned is never missed
+        finished = done is not None and done.is_set()
+        if all(pfb_complete(pfb_filename(run_dir, run_name, var, timestep)) for var in variables):
+            yield timestep
+            timestep += 1
+            last_seen = time.monotonic()
+            continue
+        if finished or idle_timeout is not None and time.monotonic() - last_seen > idle_timeout:
+            return
+        if done is not None:
+            done.wait(poll)
+        else:
+            time.sleep(poll)
+
+
+class ColumnAggregates:
+    """Running LH, SWE, ET and Manning's runoff for a single column run.
+
+    Runoff uses the same kinematic estimate as CLM_plots.py,
+    sqrt(slope)/mannings * max(p_top, 0)**(5/3), and ET is converted from
+    mm/s to m/h.  Cumulative totals assume ``dt`` hours per timestep.
+    """
+
+    columns = ['time', 'LH', 'SWE', 'ET', 'runoff', 'cum_ET', 'cum_runoff']
+
+    def __init__(self, slope, mannings, dt=1.0):
+        self.slope = slope
+        self.mannings = mannings
+        self.dt = dt
+        self.rows = []
+        self.cum_et = 0.0
+        self.cum_runoff = 0.0
+
+    def update(self, timestep, clm, top_pressure):
+        """Add one timestep; ``clm`` holds the clm_output layers of the column."""
+        et = clm[CLM_LAYER_INDEX['qflx_evap_tot']] * 3.6
+        runoff = (np.sqrt(self.slope) / self.mannings) * max(top_pressure, 0.0) ** (5.0 / 3.0)
+        self.cum_et += et * self.dt
+        self.cum_runoff += runoff * self.dt
+        row = [timestep, clm[CLM_LAYER_INDEX['eflx_lh_tot']], clm[CLM_LAYER_INDEX['swe_out']],
+               et, runoff, self.cum_et, self.cum_runoff]
+        self.rows.append(row)
+        return row
+
+    def as_array(self):
+        """(n_timesteps, len(columns)) array of everything seen so far."""
+        return np.array(self.rows).reshape(-1, len(self.columns))
+
+
+def follow_column_run(run_dir, run_name, slope, mannings, dt=1.0, start=1, stop=None,
+                      poll=2.0, idle_timeout=None, csv_file=None, verbose=False, done=None):
+    """Post-process a single column run incrementally while it is running.
+
+    Every completed timestep updates a ``ColumnAggregates`` and is appended
+    to ``csv_file`` (``<run_dir>/<run_name>.out.live.csv`` by default).
+    Returns the aggregates once ``stop`` is reached, the run goes idle or,
+    when following from a thread, the ``done`` event is set after the run
+    returned (see ``iter_timesteps``).
+    """
+    if csv_file is None:
+        csv_file = os.path.join(run_dir, '{}.out.live.csv'.format(run_name))
+    aggregates = ColumnAggregates(slope, mannings, dt)
+    press_header = None
+    with open(csv_file, 'w') as f:
+        f.write(','.join(aggregates.columns) + '\n')
+        for timestep in iter_timesteps(run_dir, run_name, ['clm_output', 'press'],
+                                       start, stop, poll, idle_timeout, done):
+            clm = read_pfb(pfb_filename(run_dir, run_name, 'clm_output', timestep))[:, 0, 0]
+            press_file = pfb_filename(run_dir, run_name, 'press', timestep)
+            if press_header is None:
+                press_header = read_pfb_header(press_file)
+            top = read_pfb_points(press_file, [(press_header['nz'] - 1, 0, 0)], press_header)[0]
+            row = aggregates.update(timestep, clm, top)
+            f.write(','.join('{:g}'.format(v) for v in row) + '\n')
+            f.flush()
+            if verbose:
+                print('step {:5d}  LH {:8.2f}  SWE {:8.2f}  cum ET {:9.4f}  cum runoff {:9.4f}'
+                      .format(timestep, row[1], row[2], row[5], row[6]))
+    return aggregates
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('run_dir')
+    parser.add_argument('run_name')
+    parser.add_argument('--slope', type=float, default=0.05)
+    parser.add_argument('--mannings', type=float, default=2.e-6)
+    parser.add_argument('--start', type=int, default=1)
+    parser.add_argument('--stop', type=int, default=None)
+    parser.add_argument('--poll', type=float, default=2.0)
+    parser.add_argument('--idle-timeout', type=float, default=None)
+    args = parser.parse_args()
+    follow_column_run(args.run_dir, args.run_name, args.slope, args.mannings,
+                      start=args.start, stop=args.stop, poll=args.poll,
+                      idle_timeout=args.idle_timeout, verbose=True)
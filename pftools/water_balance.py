@@ -0,0 +1,147 @@
+"""Rain in, water out and storage change for the overland cases.
+
+For every output timestep the budget is built from array operations over
+the whole (time, z, y, x) stack:
+
+* subsurface storage: sum of (S * phi + p * S * Ss) * dV over active cells
+* surface storage: sum of max(p_top, 0) * dx * dy over the surface
+* outflow: the outlet hydrograph from ``pftools.overland``
+* rain: the overland-flow patch flux from the run's time cycle
+
+The run's keys come from its ``.pfidb``; porosity, specific storage and mask
+come from the static PFBs ParFlow writes at the start of the run.  From the
+command line::
+
+    python -m pftools.water_balance dunne_over Dunne
+"""
+import argparse
+import os
+
+import numpy as np
+
+from pftools.config import constant_value, cycle_values, run_keys
+from pftools.overland import load_surface_parameters, overland_flow, top_layer
+from pftools.pfb import read_pfb
+from pftools.timeseries import list_timesteps, read_frame
+
+# timesteps held in memory at once
+_BLOCK = 64
+
+
+def subsurface_storage(press, satur, porosity, specific_storage, cell_volume):
+    """Subsurface water volume for each time in a (nt, nz, ny, nx) stack.
+
+    ``cell_volume`` is the (nz, ny, nx) volume of each cell and 0 outside
+    the domain.
+    """
+    water = satur * porosity + press * satur * specific_storage
+    return (water * cell_volume).sum(axis=(1, 2, 3))
+
+
+def surface_storage(surface_pressure, dx, dy, active):
+    """Ponded water volume for each time in a (nt, ny, nx) stack of top-cell pressures."""
+    return (np.where(active, np.maximum(surface_pressure, 0.0), 0.0) * dx * dy).sum(axis=(1, 2))
+
+
+def _static(run_dir, run_name, name):
+    return read_pfb(os.path.join(run_dir, '{}.out.{}.pfb'.format(run_name, name)))
+
+
+def _rain_rate(keys, times, area):
+    # flux into the domain through the overland flow patch; ParFlow fluxes
+    # are negative into the domain
+    for patch in keys['BCPressure.PatchNames'].split():
+        prefix = 'Patch.{}.BCPressure'.format(patch)
+        if keys.get(prefix + '.Type') == 'OverlandFlow':
+            cycle = keys[prefix + '.Cycle']
+            names = keys['Cycle.{}.Names'.format(cycle)].split()
+            values = {name: float(keys['{}.{}.Value'.format(prefix, name)]) for name in names}
+            return -np.array(cycle_values(keys, cycle, values, times)) * area
+    return np.zeros(len(times))
+
+
+def water_balance(run_dir, run_name, timesteps=None):
+    """Full water budget of an overland run for every output timestep.
+
+    Returns a dict of (nt,) arrays: 'timestep', 'time', 'subsurface_storage',
+    'surface_storage', 'outflow' (rate), 'cumulative_outflow', 'rain' (rate),
+    'cumulative_rain' and 'balance_error', the storage change not explained
+    by rain minus outflow.  Rain is the nominal patch flux over the plan
+    area of the active surface, so 'balance_error' also picks up any
+    difference between that and the flux the solver actually applied on a
+    stepped solid-file surface.  Volumes are in the run's length units cubed.
+    """
+    keys = run_keys(run_dir, run_name)
+    if timesteps is None:
+        timesteps = list_timesteps(run_dir, run_name, 'press')
+    timesteps = np.asarray(list(timesteps))
+
+    mask = _static(run_dir, run_name, 'mask') > 0
+    porosity = _static(run_dir, run_name, 'porosity')
+    specific_storage = _static(run_dir, run_name, 'specific_storage')
+    dx = float(keys['ComputationalGrid.DX'])
+    dy = float(keys['ComputationalGrid.DY'])
+    dz = float(keys['ComputationalGrid.DZ'])
+    dz_mult_file = os.path.join(run_dir, '{}.out.dz_mult.pfb'.format(run_name))
+    dz_mult = read_pfb(dz_mult_file) if os.path.exists(dz_mult_file) else 1.0
+    cell_volume = np.where(mask, dx * dy * dz * dz_mult, 0.0)
+
+    top = top_layer(mask)
+    active = top >= 0
+    jj, ii = np.nonzero(active)
+    sx, sy, n = load_surface_parameters(run_dir, run_name,
+                                        constant_value(keys, 'TopoSlopesX'),
+                                        constant_value(keys, 'TopoSlopesY'),
+                                        constant_value(keys, 'Mannings'))
+
+    nt = len(timesteps)
+    sub = np.empty(nt)
+    surf = np.empty(nt)
+    outflow = np.empty(nt)
+    for start in range(0, nt, _BLOCK):
+        block = timesteps[start:start + _BLOCK]
+        press = np.stack([read_frame(run_dir, run_name, 'press', t) for t in block])
+        satur = np.stack([read_frame(run_dir, run_name, 'satur', t) for t in block])
+        # inactive cells hold a large negative fill value
+        press = np.where(mask, press, 0.0)
+        satur = np.where(mask, satur, 0.0)
+        surface = np.zeros((len(block),) + top.shape)
+        surface[:, jj, ii] = press[:, top[jj, ii], jj, ii]
+
+        rows = slice(start, start + len(block))
+        sub[rows] = subsurface_storage(press, satur, porosity, specific_storage, cell_volume)
+        surf[rows] = surface_storage(surface, dx, dy, active)
+        outflow[rows] = overland_flow(surface, sx, sy, n, dx, dy, active)[2]
+
+    # output times; with DumpInterval <= 0 every timestep is written
+    dump = float(keys.get('TimingInfo.DumpInterval', '-1'))
+    step = float(keys['TimeStep.Value']) if dump <= 0 else dump
+    time = float(keys.get('TimingInfo.StartTime', '0')) + timesteps * step
+    dt = np.diff(time, prepend=time[0])
+    # the rain rate over each output interval is taken at its midpoint, and
+    # outflow, only known at the dumps, is averaged over the interval's two
+    # ends (trapezoid rule)
+    rain = _rain_rate(keys, time - 0.5 * dt, dx * dy * active.sum())
+    previous_outflow = np.concatenate([outflow[:1], outflow[:-1]])
+
+    cumulative_outflow = np.cumsum(0.5 * (previous_outflow + outflow) * dt)
+    cumulative_rain = np.cumsum(rain * dt)
+    storage = sub + surf
+    return dict(timestep=timesteps, time=time,
+                subsurface_storage=sub, surface_storage=surf,
+                outflow=outflow, cumulative_outflow=cumulative_outflow,
+                rain=rain, cumulative_rain=cumulative_rain,
+                balance_error=(storage - storage[0]) - (cumulative_rain - cumulative_outflow))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the water budget of an overland run.')
+    parser.add_argument('run_dir')
+    parser.add_argument('run_name')
+    args = parser.parse_args()
+    budget = water_balance(args.run_dir, args.run_name)
+    names = list(budget)
+    print(','.join(names))
+    for row in zip(*(budget[name] for name in names)):
+        # + 0.0 turns the -0 of an empty sum into 0
+        print(','.join('{:g}'.format(v + 0.0) for v in row))
@@ -1,13 +1,27 @@
 ## load PFCLM output and make plots / do anaylsis
 
 from parflow.tools.fs import get_absolute_path
-from parflowio.pyParflowio import PFData
 import matplotlib.pyplot as plt
+import argparse
 import numpy as np
+import os
+import sys
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import plotly.io as pio
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pftools.forcing import as_table, load_forcing
+from pftools.plotting import write_webgl_html
+from pftools.store import pack_run, read_store, store_filename
+
+# --webgl writes a smaller report: WebGL traces downsampled to --max-points
+# points (full resolution on zoom) with binary-encoded arrays
+parser = argparse.ArgumentParser(description='Plot the single column CLM output to clm_sc.html.')
+parser.add_argument('--webgl', action='store_true')
+parser.add_argument('--max-points', type=int, default=2000)
+args = parser.parse_args()
+
 # intialize data and time arrays
 data    = np.zeros([8,8760])  # an array where we store the PF output as columns
 time    = np.zeros([8760])    # time array, we will probably want to swap with a date
@@ -25,7 +39,8 @@ forcing = np.zeros([8,8760])  # array to load in the meterological forcing
 # 7 SPFH: Water-vapor specific humidity [kg/kg]
 #
 ffname = 'forcing/narr_1hr.txt'
-forcing = np.loadtxt(ffname,max_rows=8760)
+# parsed once, then served from a binary cache (see pftools.forcing)
+forcing = as_table(load_forcing(ffname, 0, 8760))
 print(forcing[2,0:10])
 # reading the CLM file PFCLM_SC.out.clm_output.<file number>.C.pfb
 # variables are by layer:
@@ -47,32 +62,22 @@ print(forcing[2,0:10])
 slope    = 0.05
 mannings = 2.e-6
 
-# loop over a year of files (8760 hours) and load in the CLM output
-# then map specific variables to the data array which holds things for analysis
-# and plotting
-for icount in range(1, 8760):
-    base = "output/PFCLM_SC.out.clm_output.{:05d}.C.pfb"
-    filename = base.format(icount)
-    data_obj = PFData(filename)
-    data_obj.loadHeader()
-    data_obj.loadData()
-    data_arr = data_obj.getDataAsArray()
-    data_obj.close()
-    data[1,icount] = data_arr[0,0,0]  #net latent heat flux (Wm-2)
-    data[2,icount] = data_arr[4,0,0]  #net veg. evaporation and transpiration and soil evaporation (mms-1)
-    data[3,icount] = data_arr[10,0,0] #SWE (mm)
-    data[5,icount] = data_arr[2,0,0]  #net sensible heat flux (Wm-2)
-    data[6,icount] = data_arr[3,0,0]  #net sensible heat flux (Wm-2)
-    base = "output/PFCLM_SC.out.press.{:05d}.pfb"
-    filename = base.format(icount)
-    data_obj = PFData(filename)
-    data_obj.loadHeader()
-    data_obj.loadData()
-    data_arr = data_obj.getDataAsArray()
-    data_obj.close()
-    data[4,icount] = (np.sqrt(slope)/mannings) * np.maximum(data_arr[19,0,0],0.0)**(5.0/3.0)
-    time[icount] = icount
-
+# read a year (8760 hours) of CLM and pressure output from the packed
+# time-series store, packing the per-hour PFBs into it on first use, and map
+# specific variables to the data array which holds things for analysis and
+# plotting
+store_file = store_filename('output', 'PFCLM_SC')
+if not os.path.exists(store_file):
+    pack_run('output', 'PFCLM_SC')
+ts = read_store(store_file, ['eflx_lh_tot', 'qflx_evap_tot', 'swe_out',
+                            'eflx_sh_tot', 'eflx_soil_grnd', 'press'], range(1, 8760))
+data[1,1:8760] = ts['eflx_lh_tot'][:,0,0]     #net latent heat flux (Wm-2)
+data[2,1:8760] = ts['qflx_evap_tot'][:,0,0]   #net veg. evaporation and transpiration and soil evaporation (mms-1)
+data[3,1:8760] = ts['swe_out'][:,0,0]         #SWE (mm)
+data[5,1:8760] = ts['eflx_sh_tot'][:,0,0]     #net sensible heat flux (Wm-2)
+data[6,1:8760] = ts['eflx_soil_grnd'][:,0,0]  #ground heat flux (Wm-2)
+data[4,1:8760] = (np.sqrt(slope)/mannings) * np.maximum(ts['press'][:,19,0,0],0.0)**(5.0/3.0)
+time[1:8760]   = np.arange(1, 8760)
 
 # Plot LH Flux, SWE and Runoff
 #fig, ax = plt.subplots()
@@ -135,4 +140,7 @@ fig.update_layout(
 #        t=30,
 #        pad=0
 #    ))
-pio.write_html(fig, file='clm_sc.html')
+if args.webgl:
+    write_webgl_html(fig, 'clm_sc.html', max_points=args.max_points)
+else:
+    pio.write_html(fig, file='clm_sc.html')
@@ -1,9 +1,13 @@
 ## load PFCLM output and make plots / do anaylsis
 
 from parflow.tools.fs import get_absolute_path
-from parflowio.pyParflowio import PFData
 import matplotlib.pyplot as plt
 import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pftools.store import pack_run, read_store, store_filename
 
 # intialize data and time arrays
 data    = np.zeros([8,8760])
@@ -29,30 +33,19 @@ time    = np.zeros([8760])
 slope    = 0.05
 mannings = 2.e-6
 
-# loop over a year of files (8760 hours) and load in the CLM output
-# then map specific variables to the data array which holds things for analysis
-# and plotting
-for icount in range(1, 8760):
-    base = "output/PFCLM_SC.out.clm_output.{:05d}.C.pfb"
-    filename = base.format(icount)
-    data_obj = PFData(filename)
-    data_obj.loadHeader()
-    data_obj.loadData()
-    data_arr = data_obj.getDataAsArray()
-    data_obj.close()
-    data[1,icount] = data_arr[0,0,0]  #total (really, it is net) latent heat flux (Wm-2)
-    data[2,icount] = data_arr[4,0,0]  #net veg. evaporation and transpiration and soil evaporation (mms-1)
-    data[3,icount] = data_arr[10,0,0] #SWE (mm)
-    base = "output/PFCLM_SC.out.press.{:05d}.pfb"
-    filename = base.format(icount)
-    data_obj = PFData(filename)
-    data_obj.loadHeader()
-    data_obj.loadData()
-    data_arr = data_obj.getDataAsArray()
-    data_obj.close()
-    data[4,icount] = (np.sqrt(slope)/mannings) * np.maximum(data_arr[19,0,0],0.0)**(5.0/3.0)
-    time[icount] = icount
-
+# read a year (8760 hours) of CLM and pressure output from the packed
+# time-series store, packing the per-hour PFBs into it on first use, and map
+# specific variables to the data array which holds things for analysis and
+# plotting
+store_file = store_filename('output', 'PFCLM_SC')
+if not os.path.exists(store_file):
+    pack_run('output', 'PFCLM_SC')
+ts = read_store(store_file, ['eflx_lh_tot', 'qflx_evap_tot', 'swe_out', 'press'], range(1, 8760))
+data[1,1:8760] = ts['eflx_lh_tot'][:,0,0]    #total (really, it is net) latent heat flux (Wm-2)
+data[2,1:8760] = ts['qflx_evap_tot'][:,0,0]  #net veg. evaporation and transpiration and soil evaporation (mms-1)
+data[3,1:8760] = ts['swe_out'][:,0,0]        #SWE (mm)
+data[4,1:8760] = (np.sqrt(slope)/mannings) * np.maximum(ts['press'][:,19,0,0],0.0)**(5.0/3.0)
+time[1:8760]   = np.arange(1, 8760)
 
 # Plot LH Flux, SWE and Runoff
 fig, ax = plt.subplots()
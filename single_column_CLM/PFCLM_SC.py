@@ -3,6 +3,16 @@
 from parflow import Run
 import os
 import shutil 
+import sys
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pftools.outputs import format_plan, plan_outputs
+from pftools.segments import WATER_YEAR_HOURS, merge_segments, run_segments, segment_bounds
+from pftools.spinup import spin_up, spinup_key, start_from_state
+from pftools.store import pack_run
+from pftools.tuning import apply_tuned, format_trials, save_tuned, tune_solver
+from pftools.watch import follow_column_run
 
 
 #preliminaries
@@ -19,6 +29,11 @@ PFCLM_SC = Run("PFCLM_SC", __file__)
 
 stopt = 8760
 
+# runs longer than one segment (e.g. stopt = 26280 with the three water years
+# of pumphouse_forcing_wy17_wy19.txt) are made one segment at a time, see
+# the end of this script
+segment_hours = WATER_YEAR_HOURS
+
 #-----------------------------------------------------------------------------
 # File input version number
 #-----------------------------------------------------------------------------
@@ -359,6 +374,16 @@ PFCLM_SC.Solver.CLM.WriteLastRST    = True
 PFCLM_SC.Solver.CLM.DailyRST        = False
 PFCLM_SC.Solver.CLM.SingleFile      = True
 
+#---------------------------------------------------
+# Output plan
+#---------------------------------------------------
+
+# only write what the analyses need: the quantities plotted by CLM_plots.py
+# and CLM_plotly.py (and followed live by pftools.watch) come from the CLM
+# output and the pressure; this overrides the print flags above
+plan = plan_outputs(PFCLM_SC, ['LH', 'SH', 'G', 'ET', 'SWE', 'runoff'])
+print(format_plan(plan))
+
 #---------------------------------------------------
 # Initial conditions: water pressure
 #---------------------------------------------------
@@ -369,8 +394,71 @@ PFCLM_SC.Geom.domain.ICPressure.Value    = -1.0
 PFCLM_SC.Geom.domain.ICPressure.RefGeom  = 'domain'
 PFCLM_SC.Geom.domain.ICPressure.RefPatch = 'z_upper'
 
+#-----------------------------------------------------------------------------
+# Spin-up
+#-----------------------------------------------------------------------------
+
+# set spinup = True to start from the spun-up state of this configuration
+# instead of the hydrostatic cold start above; the first run with a given
+# set of soil, vegetation and forcing inputs repeats the year until the
+# state stops changing and caches it in ../spinup_cache, later runs start
+# from the cached state
+spinup = False
+if spinup:
+    key = spinup_key(PFCLM_SC, ['../inputs/drv_vegp.dat', '../inputs/drv_vegm.dat',
+                                '../inputs/drv_clmin.dat',
+                                os.path.join(PFCLM_SC.Solver.CLM.MetFilePath,
+                                             PFCLM_SC.Solver.CLM.MetFileName)])
+    state_dir = spin_up(PFCLM_SC, '.', '../spinup_cache', key)
+    start_from_state(PFCLM_SC, state_dir, '.')
+
+#-----------------------------------------------------------------------------
+# Solver tuning
+#-----------------------------------------------------------------------------
+
+# set tune = True once for a new site or domain: solver settings are tried
+# on runs over the first two days of forcing and the fastest whose
+# pressures match the current settings are saved to ../PFCLM_SC.solver.json,
+# which every later run picks up
+tune = False
+tuned_file = '../PFCLM_SC.solver.json'
+if tune:
+    result = tune_solver(PFCLM_SC, '.', 48,
+                         inputs=['drv_clmin.dat', 'drv_vegm.dat', 'drv_vegp.dat']
+                         + [f for f in os.listdir('.') if f.startswith('clm.rst.')],
+                         root_dir='../tuning_runs')
+    print(format_trials(result))
+    save_tuned(tuned_file, result)
+apply_tuned(PFCLM_SC, tuned_file)
+
 #-----------------------------------------------------------------------------
 # Run ParFlow 
 #-----------------------------------------------------------------------------
 
-PFCLM_SC.run()
+if stopt > segment_hours:
+    # run segment by segment, handing the pressure and CLM restart on and
+    # packing each segment's output into
+    # PFCLM_SC.out.timeseries.<start>-<stop>.nc before the next one starts;
+    # running the script again resumes after the last completed segment.
+    # The segment stores are then joined into the one time-series store
+    # the plotting scripts read
+    segments = run_segments(PFCLM_SC, '.', segment_bounds(stopt, segment_hours))
+    merge_segments('.', 'PFCLM_SC', segments)
+else:
+    # follow the output while ParFlow runs, so running LH, SWE, ET and runoff
+    # (and a partial hydrograph in PFCLM_SC.out.live.csv) are available before
+    # the year is finished; the watcher stops once the run has returned
+    run_done = threading.Event()
+    watcher = threading.Thread(target=follow_column_run, args=('.', 'PFCLM_SC'),
+                               kwargs=dict(slope=0.05, mannings=2.e-6, stop=stopt, done=run_done),
+                               daemon=True)
+    watcher.start()
+
+    try:
+        PFCLM_SC.run()
+    finally:
+        run_done.set()
+        watcher.join()
+
+    # pack the hourly output into one time-series store for the plotting scripts
+    pack_run('.', 'PFCLM_SC')
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import pftools from the repository root, as the case scripts do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
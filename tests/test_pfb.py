@@ -0,0 +1,65 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from pftools.pfb import read_pfb, read_pfb_header, read_pfb_points, read_pfb_slice, write_pfb
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+# one subgrid, and four subgrids with a .dist file
+FIXTURES = [os.path.join(TESTS_DIR, 'test.pfb'), os.path.join(TESTS_DIR, 'test2.pfb')]
+
+
+def sequential_read(filename):
+    # plain front-to-back parse of the PFB layout, independent of pftools.pfb
+    with open(filename, 'rb') as f:
+        x, y, z, nx, ny, nz, dx, dy, dz, nsubgrids = struct.unpack('>3d3i3di', f.read(64))
+        data = np.empty((nz, ny, nx))
+        for _ in range(nsubgrids):
+            ix, iy, iz, snx, sny, snz, rx, ry, rz = struct.unpack('>9i', f.read(36))
+            values = np.frombuffer(f.read(8 * snx * sny * snz), dtype='>f8')
+            data[iz:iz + snz, iy:iy + sny, ix:ix + snx] = values.reshape(snz, sny, snx)
+    return data
+
+
+@pytest.mark.parametrize('filename', FIXTURES)
+def test_read_pfb(filename):
+    np.testing.assert_array_equal(read_pfb(filename), sequential_read(filename))
+
+
+@pytest.mark.parametrize('filename', FIXTURES)
+@pytest.mark.parametrize('index', [
+    (3, 5, 7),
+    (slice(None), 0, 0),
+    (slice(None), 12, 3),
+    (9,),
+    (slice(None), 0, slice(None)),
+    (slice(2, 8), slice(5, 15), slice(8, 12)),
+    (slice(None), slice(9, 11), slice(9, 11)),
+    (-1, -1, slice(None)),
+])
+def test_read_pfb_slice(filename, index):
+    expected = sequential_read(filename)[index]
+    np.testing.assert_array_equal(read_pfb_slice(filename, index), expected)
+    np.testing.assert_array_equal(read_pfb_slice(filename, index, read_pfb_header(filename)), expected)
+
+
+@pytest.mark.parametrize('filename', FIXTURES)
+def test_read_pfb_points(filename):
+    data = sequential_read(filename)
+    # cells in every subgrid, out of order and repeated
+    indices = [(0, 0, 0), (9, 19, 19), (4, 10, 9), (4, 9, 10), (0, 0, 0), (7, 15, 2), (1, 2, 18)]
+    np.testing.assert_array_equal(read_pfb_points(filename, indices), [data[i] for i in indices])
+
+
+def test_write_pfb_round_trip(tmp_path):
+    data = np.random.default_rng(0).normal(size=(4, 3, 5))
+    filename = str(tmp_path / 'round_trip.pfb')
+    write_pfb(filename, data, 1.0, 2.0, 3.0, 10.0, 20.0, 0.5)
+    np.testing.assert_array_equal(read_pfb(filename), data)
+    np.testing.assert_array_equal(sequential_read(filename), data)
+    header = read_pfb_header(filename)
+    assert (header['nx'], header['ny'], header['nz']) == (5, 3, 4)
+    assert (header['x'], header['y'], header['z'], header['dx'], header['dy'], header['dz']) == \
+        (1.0, 2.0, 3.0, 10.0, 20.0, 0.5)
@@ -0,0 +1,36 @@
+import os
+
+import numpy as np
+
+from pftools.pfsol import check_solid, rasterize_patches, rasterize_solid, read_pfsol, write_pfsol
+
+TUFF = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'overland', 'tuff.pfsol')
+PATCH_NAMES = ['z_upper', 'x_lower', 'y_lower', 'x_upper', 'y_upper', 'z_lower']
+# the grid of the tuff runs: 20 x 1 x 300 cells of 5 x 1 x 0.05
+GRID = {'x': 0.0, 'y': 0.0, 'z': 0.0, 'nx': 20, 'ny': 1, 'nz': 300, 'dx': 5.0, 'dy': 1.0, 'dz': 0.05}
+
+
+def test_check_solid():
+    vertices, solids = read_pfsol(TUFF)
+    triangles, patches = solids[0]['triangles'], solids[0]['patches']
+    assert check_solid(vertices, triangles, patches, PATCH_NAMES) == []
+
+
+def test_check_solid_flipped(tmp_path):
+    vertices, solids = read_pfsol(TUFF)
+    triangles, patches = solids[0]['triangles'], solids[0]['patches']
+    filename = str(tmp_path / 'flipped.pfsol')
+    write_pfsol(filename, vertices, triangles[:, ::-1], patches)
+    vertices, solids = read_pfsol(filename)
+    problems = check_solid(vertices, solids[0]['triangles'], solids[0]['patches'])
+    assert any('inwards' in problem for problem in problems)
+
+
+def test_rasterize():
+    vertices, solids = read_pfsol(TUFF)
+    triangles, patches = solids[0]['triangles'], solids[0]['patches']
+    mask = rasterize_solid(vertices, triangles, GRID)
+    assert mask.shape == (300, 1, 20)
+    assert mask.sum() == 4000
+    masks = rasterize_patches(vertices, triangles, patches, GRID, mask)
+    assert len(masks) == len(PATCH_NAMES)
@@ -0,0 +1,68 @@
+import glob
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from pftools.compact import compact_run
+from pftools.pfb import read_pfb
+from pftools.store import pack_run, read_store
+from pftools.timeseries import list_timesteps, pfb_filename, pfb_timesteps, read_frame, read_timeseries
+
+DUNNE_OVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'overland', 'dunne_over')
+VARIABLES = ['press', 'satur']
+TIMESTEPS = list(range(8))
+
+
+@pytest.fixture
+def run_dir(tmp_path):
+    # a copy of the first timesteps of the Dunne overland run
+    for variable in VARIABLES:
+        for timestep in TIMESTEPS:
+            filename = pfb_filename(DUNNE_OVER, 'Dunne', variable, timestep)
+            shutil.copy(filename, str(tmp_path))
+            shutil.copy(filename + '.dist', str(tmp_path))
+    return str(tmp_path)
+
+
+def reference(run_dir, variable, indices):
+    return np.array([[read_pfb(pfb_filename(run_dir, 'Dunne', variable, timestep))[index] for index in indices]
+                     for timestep in TIMESTEPS])
+
+
+def some_cells(run_dir):
+    nz, ny, nx = read_pfb(pfb_filename(run_dir, 'Dunne', 'press', 0)).shape
+    return [(0, 0, 0), (nz - 1, ny - 1, nx - 1), (nz // 2, ny - 1, nx // 3), (nz - 1, 0, nx - 1)]
+
+
+@pytest.mark.parametrize('variable', VARIABLES)
+def test_read_timeseries(run_dir, variable):
+    indices = some_cells(run_dir)
+    np.testing.assert_array_equal(read_timeseries(run_dir, 'Dunne', variable, indices, TIMESTEPS),
+                                  reference(run_dir, variable, indices))
+
+
+def test_pack_run(run_dir):
+    indices = some_cells(run_dir)
+    data = read_store(pack_run(run_dir, 'Dunne', VARIABLES), timesteps=TIMESTEPS[2:6])
+    np.testing.assert_array_equal(data['time'], TIMESTEPS[2:6])
+    for variable in VARIABLES:
+        expected = reference(run_dir, variable, indices)[2:6]
+        np.testing.assert_array_equal(np.array([data[variable][(slice(None),) + index] for index in indices]).T,
+                                      expected)
+        np.testing.assert_array_equal(data[variable][0], read_pfb(pfb_filename(run_dir, 'Dunne', variable, 2)))
+
+
+def test_compact_run(run_dir):
+    indices = some_cells(run_dir)
+    expected = {variable: reference(run_dir, variable, indices) for variable in VARIABLES}
+    frames = {variable: read_pfb(pfb_filename(run_dir, 'Dunne', variable, 5)) for variable in VARIABLES}
+    compact_run(run_dir, 'Dunne', VARIABLES)
+    assert not glob.glob(os.path.join(run_dir, '*.pfb*'))
+    for variable in VARIABLES:
+        assert pfb_timesteps(run_dir, 'Dunne', variable) == []
+        assert list_timesteps(run_dir, 'Dunne', variable) == TIMESTEPS
+        np.testing.assert_array_equal(read_timeseries(run_dir, 'Dunne', variable, indices, TIMESTEPS),
+                                      expected[variable])
+        np.testing.assert_array_equal(read_frame(run_dir, 'Dunne', variable, 5), frames[variable])